@@ -0,0 +1,309 @@
+'''
+Benchmarks for the encode, build and fetch pipeline of infozuild.
+
+Every benchmark runs a synthetic workload of a given size (number of values,
+pages, events or activities) and reports the best time for one run of the
+whole workload. The benchmarks of the fetch path run against a local Koala
+stand-in and controller emulator, so they need no network. Results can be
+saved as JSON and compared against an earlier run, which makes the script exit
+with status 1 if any benchmark got slower than the threshold allows.
+
+Usage, from the ``code`` directory::
+
+    python benchmarks/bench.py --save benchmarks/baseline.json
+    # ... change things ...
+    python benchmarks/bench.py --compare benchmarks/baseline.json
+
+Baselines are only meaningful on the machine they were recorded on. The
+committed ``benchmarks/baseline.json`` gives a reference to compare against in
+a fresh checkout; record your own before relying on the threshold.
+'''
+import argparse
+import datetime
+import json
+import logging
+import os.path
+import platform
+import sys
+import timeit
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+# pylint: disable=wrong-import-position
+from infozuild import (__version__, daemon, emulator, eventstore, getscript, koala, parsing,
+                       sendscript)
+
+
+SIZES = [1, 10, 100, 1000, 10000]
+MIN_TIME = 0.05
+REPEAT = 3
+DEFAULT_THRESHOLD = 0.25
+
+BENCHMARKS = {}
+
+def benchmark(name):
+    '''
+    Register a workload factory under *name*. The factory takes a size and
+    returns a function without arguments that performs the workload once.
+    If that function has a ``close`` attribute, it is called afterwards.
+    '''
+    def register(factory):
+        ''' Add the factory to :data:`BENCHMARKS`. '''
+        BENCHMARKS[name] = factory
+        return factory
+    return register
+
+## Synthetic data
+def make_lines(num):
+    ''' Return 8 lines of text, varying with *num*. '''
+    return ['Regel {} van pagina {}'.format(line, num) for line in range(7)] + \
+        ['{:>32}'.format(num)]
+
+def make_pages(size):
+    ''' Return *size* pages with varying attributes. '''
+    pages = []
+    for num in range(size):
+        page = sendscript.Page(make_lines(num))
+        page.duration = 1000 + num % 200000
+        page.brightness = num % 17 + 1
+        page.scrolling = num % 3 == 0
+        page.fading = num % 5 == 0
+        pages.append(page)
+    return pages
+
+def make_events(size, base=datetime.datetime(2016, 6, 1, 12, 30)):
+    ''' Return *size* Koala-style events from *base* on, covering all cases of build_when. '''
+    events = []
+    for num in range(size):
+        start = base + datetime.timedelta(hours=7 * num)
+        end = start + datetime.timedelta(hours=2 + 20 * (num % 3))
+        event = {'name': 'Activiteit {}'.format(num)}
+        case = num % 4
+        if case == 0:
+            event['start_date'] = start.date().isoformat()
+        elif case == 1:
+            event['start_date'] = start.date().isoformat()
+            event['end_date'] = end.date().isoformat()
+        elif case == 2:
+            event['start_date'] = start.isoformat() + '+02:00'
+            event['end_date'] = end.date().isoformat()
+        else:
+            event['start_date'] = start.isoformat() + '+02:00'
+            event['end_date'] = end.isoformat() + '+02:00'
+        events.append(event)
+    return events
+
+## Workloads
+@benchmark('encode_value')
+def bench_encode_value(size):
+    ''' Encode *size* numeric values. '''
+    values = [num % 96 for num in range(size)]
+    encode = sendscript.encode_value
+    return lambda: [encode(value) for value in values]
+
+@benchmark('Page.build_duration')
+def bench_build_duration(size):
+    ''' Build the duration attribute of *size* pages. '''
+    pages = make_pages(size)
+    return lambda: [page.build_duration() for page in pages]
+
+@benchmark('Page.to_controlstring')
+def bench_page_controlstring(size):
+    ''' Encode *size* pages separately. '''
+    pages = make_pages(size)
+    return lambda: [page.to_controlstring() for page in pages]
+
+@benchmark('Rotation.to_controlstring')
+def bench_rotation_controlstring(size):
+    ''' Encode a rotation of *size* pages. '''
+    rotation = sendscript.Rotation(pages=make_pages(size))
+    return rotation.to_controlstring
+
+@benchmark('parsing.parse_rotation')
+def bench_parse_rotation(size):
+    ''' Decode a control string of *size* pages. '''
+    data = sendscript.Rotation(pages=make_pages(size)).to_bytes()
+    return lambda: parsing.parse_rotation(data)
+
+@benchmark('Rotation.to_json')
+def bench_rotation_to_json(size):
+    ''' Serialize a rotation of *size* pages to JSON. '''
+    rotation = sendscript.Rotation(pages=make_pages(size))
+    return rotation.to_json
+
+@benchmark('Rotation.from_json')
+def bench_rotation_from_json(size):
+    ''' Deserialize a rotation of *size* pages from JSON. '''
+    data = sendscript.Rotation(pages=make_pages(size)).to_json()
+    return lambda: sendscript.Rotation.from_json(data)
+
+@benchmark('getscript.build_when')
+def bench_build_when(size):
+    ''' Build the 'when' string for *size* events. '''
+    events = make_events(size)
+    today = datetime.date(2016, 6, 8)
+    build_when = getscript.build_when
+    return lambda: [build_when(event, today) for event in events]
+
+@benchmark('getscript.build_when_cold')
+def bench_build_when_cold(size):
+    ''' Build the 'when' string for *size* events, without memoized results. '''
+    events = make_events(size)
+    today = datetime.date(2016, 6, 8)
+    build_when = getscript.build_when
+    clear = getscript._build_when.cache_clear # pylint: disable=protected-access
+
+    def workload():
+        ''' Forget earlier results, then build all strings. '''
+        clear()
+        return [build_when(event, today) for event in events]
+    return workload
+
+@benchmark('getscript.build_when_many')
+def bench_build_when_many(size):
+    ''' Build the 'when' strings for *size* events in one batch. '''
+    events = make_events(size)
+    today = datetime.date(2016, 6, 8)
+    return lambda: getscript.build_when_many(events, today)
+
+@benchmark('getscript.parse_date')
+def bench_parse_date(size):
+    ''' Parse the dates of *size* events. '''
+    dates = [event['start_date'] for event in make_events(size)]
+    parse_date = getscript.parse_date
+    return lambda: [parse_date(date) for date in dates]
+
+@benchmark('getscript.make_rotation')
+def bench_make_rotation(size):
+    ''' Build a rotation from *size* preformatted activities. '''
+    activities = [(event['name'], event['start_date']) for event in make_events(size)]
+    return lambda: getscript.make_rotation(activities, 'Status')
+
+@benchmark('EventStore.activities')
+def bench_store_activities(size):
+    ''' Render the first 30 of *size* events, a week after half of them ended. '''
+    events = make_events(size)
+    now = eventstore.start_key(events[size // 2]) + datetime.timedelta(days=7)
+    store = eventstore.EventStore(events)
+    store.activities(now, 30)
+    return lambda: store.activities(now, 30)
+
+@benchmark('ZuilManager.update_activities')
+def bench_update_activities(size):
+    ''' Run the daemon's update cycle for *size* unchanged events, fetched and sent locally. '''
+    base = datetime.datetime.combine(datetime.date.today(), datetime.time(12, 30)) + \
+        datetime.timedelta(days=1)
+    standin = koala.KoalaStandIn.from_events(make_events(size, base)).start()
+    controller = emulator.ControllerEmulator().start()
+    api_url = mock.patch.object(getscript, 'API_URL', standin.url)
+    api_url.start()
+    manager = daemon.ZuilManager('localhost', 0, None, port=controller.port)
+
+    def workload():
+        ''' Fetch, render and send once. '''
+        manager.update_activities()
+
+    def close():
+        ''' Stop the manager and the servers, and restore the API URL. '''
+        manager.close()
+        controller.stop()
+        standin.stop()
+        api_url.stop()
+    workload.close = close
+    return workload
+
+## Running and comparing
+def measure(workload):
+    ''' Return the best time in seconds for one run of *workload*. '''
+    timer = timeit.Timer(workload)
+    number = 1
+    while True:
+        elapsed = timer.timeit(number)
+        if elapsed >= MIN_TIME:
+            break
+        number *= 10
+    best = min([elapsed] + timer.repeat(REPEAT - 1, number))
+    return best / number
+
+def run(names, sizes, verbose=True):
+    ''' Run the given benchmarks for all sizes, and return the results as a dict. '''
+    results = {}
+    for name in names:
+        for size in sizes:
+            key = '{}[{}]'.format(name, size)
+            workload = BENCHMARKS[name](size)
+            try:
+                results[key] = measure(workload)
+            finally:
+                getattr(workload, 'close', lambda: None)()
+            if verbose:
+                print('{:<40} {:>12.3f} us'.format(key, results[key] * 1e6))
+    return {
+        'meta': {
+            'version': __version__,
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'date': datetime.datetime.now().isoformat(),
+            },
+        'results': results,
+        }
+
+def compare(results, baseline, threshold):
+    '''
+    Compare two result dicts.
+
+    Returns:
+        A list of (*benchmark*, *baseline time*, *current time*) for every
+        benchmark that is slower than ``(1 + threshold) * baseline``.
+    '''
+    regressions = []
+    for key, current in sorted(results['results'].items()):
+        previous = baseline['results'].get(key)
+        if previous is None:
+            continue
+        if current > previous * (1 + threshold):
+            regressions.append((key, previous, current))
+    return regressions
+
+def main():
+    ''' Run the benchmarks from the command line. '''
+    parser = argparse.ArgumentParser(description='Benchmark the infozuild pipeline.')
+    parser.add_argument('benchmarks', nargs='*', default=sorted(BENCHMARKS),
+                        help='benchmarks to run (default: all of {})'.format(
+                            ', '.join(sorted(BENCHMARKS))))
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES,
+                        help='workload sizes to run')
+    parser.add_argument('--save', default=None,
+                        help='write the results as JSON to this file')
+    parser.add_argument('--compare', default=None,
+                        help='compare the results against this JSON file')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='fraction a benchmark may be slower than the baseline')
+
+    args = parser.parse_args()
+
+    unknown = set(args.benchmarks) - set(BENCHMARKS)
+    if unknown:
+        parser.error('unknown benchmarks: {}'.format(', '.join(sorted(unknown))))
+
+    logging.getLogger().setLevel(logging.WARNING) # The daemon logs every update.
+    results = run(args.benchmarks, args.sizes)
+
+    if args.save:
+        with open(args.save, 'w') as output_file:
+            json.dump(results, output_file, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = compare(results, baseline, args.threshold)
+        for key, previous, current in regressions:
+            print('REGRESSION {}: {:.3f} us -> {:.3f} us ({:+.0%})'.format(
+                key, previous * 1e6, current * 1e6, current / previous - 1))
+        if regressions:
+            sys.exit(1)
+        print('No regressions against {}.'.format(args.compare))
+
+if __name__ == '__main__':
+    main()
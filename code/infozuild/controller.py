@@ -0,0 +1,574 @@
+'''
+infozuild.controller sends control strings, as built by
+:mod:`infozuild.sendscript`, to the controller: over a connection that can be
+kept open, through a queue that drops superseded text updates, or to many
+controllers at once with asyncio. It also holds :command:`zuil-send`, which
+sends a rotation, streams commands, or sets the clock or display mode.
+'''
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import configparser
+import datetime
+import json
+import logging
+import os
+import select
+import socket
+import stat
+import sys
+import threading
+import time
+
+from . import __version__
+from .schema import RotationError
+from .sendscript import (check_in_range, set_rtc, DisplayMode, PageCache, Rotation, RtcUpdate,
+                         B_TRAILER, ENCODED_VALUES)
+
+
+## Communication with the zuil
+PORT = 23
+TIMEOUT = 10
+
+class ControllerConnection:
+    '''
+    A connection to the controller, which is opened on the first send.
+
+    If *reuse* is set, the socket is kept open after sending and used for the
+    next control string, so the connection and banner are only paid for once.
+    A connection that was closed by the controller in the meantime is detected
+    and transparently replaced. The controller only accepts one connection at a
+    time, so a reused connection blocks other clients until :meth:`close`.
+
+    Args:
+        host (str): Hostname or IP of the controller.
+        port (int): TCP port of the controller.
+        timeout (float): Socket timeout in seconds.
+        reuse (bool): Keep the connection open between sends.
+    '''
+    def __init__(self, host, port=PORT, timeout=TIMEOUT, reuse=True):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.reuse = reuse
+        self._sock = None
+
+    def open(self):
+        '''
+        Connect to the controller and consume its banner.
+
+        Raises:
+            :exc:`OSError` if the connection could not be made.
+        '''
+        self.close()
+        logging.info('Connecting to %s', self.host)
+        sock = socket.create_connection((self.host, self.port), self.timeout)
+        try:
+            sock.recv(1024) # Necesssary to get rid of the *** mini blabla *** header!
+        except OSError:
+            sock.close()
+            raise
+        self._sock = sock
+
+    def close(self):
+        ''' Close the connection, if it is open. '''
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def is_alive(self):
+        '''
+        Check without blocking whether the connection is open and the peer has
+        not closed it.
+        '''
+        if self._sock is None:
+            return False
+        try:
+            readable, _, _ = select.select([self._sock], [], [], 0)
+            # The controller never responds, so a readable socket is either
+            # closed or has stray output that is discarded here.
+            if readable and not self._sock.recv(1024):
+                return False
+        except (OSError, ValueError):
+            return False
+        return True
+
+    def send(self, controlstring):
+        '''
+        Send a control string, which may be either a :class:`str` or already
+        encoded :class:`bytes`, reconnecting once if a reused connection failed.
+
+        Returns:
+            `True` if the control string was sent, `False` otherwise.
+        '''
+        if isinstance(controlstring, str):
+            controlstring = controlstring.encode()
+
+        while True:
+            reused = self.is_alive()
+            if not reused:
+                try:
+                    self.open()
+                except OSError as ex:
+                    logging.error('Could not connect to %s: %s', self.host, ex)
+                    self.close()
+                    return False
+
+            try:
+                self._sock.sendall(controlstring)
+            except OSError as ex:
+                self.close()
+                if reused:
+                    logging.warning('Connection to %s lost, reconnecting: %s', self.host, ex)
+                    continue
+                logging.error('Could not send to %s: %s', self.host, ex)
+                return False
+            break
+
+        if not self.reuse:
+            self.close()
+        return True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+SendResult = collections.namedtuple('SendResult', ['success', 'latency', 'superseded'])
+SendResult.__doc__ = '''
+The outcome of a send through a :class:`SendQueue`.
+
+Attributes:
+    success (bool): whether the control string was sent.
+    latency (float): seconds between submitting and finishing the send.
+    superseded (bool): whether the submitted control string was replaced by a
+        newer text update for the same address, and this is the newer one's outcome.
+'''
+
+class SendQueue:
+    '''
+    Sends all control strings for one controller from a single sender thread.
+
+    The controller only accepts one connection at a time, so every sender
+    (scheduled updates, manual updates, the shutdown message) should go
+    through one queue. Text updates that are still pending when a newer text
+    update for the same address is submitted are dropped in favour of the
+    newer one. RTC and display mode updates are always sent, in order.
+
+    Args:
+        connection (ControllerConnection): the connection to send over.
+    '''
+    def __init__(self, connection):
+        self.connection = connection
+        self._pending = collections.deque()
+        self._condition = threading.Condition()
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name='zuil-sender', daemon=True)
+        self._thread.start()
+
+    def submit(self, controlstring, coalesce=None):
+        '''
+        Queue a control string for sending.
+
+        Args:
+            controlstring: the :class:`str` or :class:`bytes` to send.
+            coalesce (bool): whether this update may replace, and be replaced
+                by, other pending updates for the same address. Defaults to
+                `True` for text updates and `False` for anything else.
+
+        Returns:
+            A :class:`concurrent.futures.Future` that resolves to a :class:`SendResult`.
+        '''
+        if isinstance(controlstring, str):
+            controlstring = controlstring.encode()
+        if coalesce is None:
+            coalesce = controlstring.endswith(B_TRAILER)
+
+        future = concurrent.futures.Future()
+        item = [controlstring, coalesce, [(future, time.monotonic(), False)]]
+        with self._condition:
+            if self._stopping:
+                raise RuntimeError('SendQueue has been stopped')
+
+            if coalesce:
+                # The address is the second byte of every control string.
+                for old in [old for old in self._pending
+                            if old[1] and old[0][1:2] == controlstring[1:2]]:
+                    self._pending.remove(old)
+                    item[2][:0] = [(waiter, submitted, True) for waiter, submitted, _ in old[2]]
+                    logging.debug('Dropped superseded text update.')
+
+            self._pending.append(item)
+            self._condition.notify()
+        return future
+
+    def stop(self, timeout=None):
+        ''' Send all pending control strings, then stop the sender thread. '''
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+        self._thread.join(timeout)
+
+    def _run(self):
+        ''' Send queued control strings until stopped. '''
+        while True:
+            with self._condition:
+                while not self._pending and not self._stopping:
+                    self._condition.wait()
+                if not self._pending:
+                    return
+                controlstring, _, waiters = self._pending.popleft()
+
+            try:
+                success = self.connection.send(controlstring)
+            except Exception as ex: # pylint: disable=broad-except
+                for future, _, _ in waiters:
+                    future.set_exception(ex)
+                continue
+
+            done = time.monotonic()
+            for future, submitted, superseded in waiters:
+                future.set_result(SendResult(success, done - submitted, superseded))
+
+def connect_and_send(host, controlstring, port=PORT):
+    '''
+    Open a connection to *host* and send the given control string, which may
+    be either a :class:`str` or already encoded :class:`bytes`.
+
+    Returns:
+        `True` if the control string was sent, `False` if the connection failed.
+    '''
+    return ControllerConnection(host, port, reuse=False).send(controlstring)
+
+def update_rtc(host, address=0, when=None, connection=None):
+    ''' Generate a control string that will set the controller's RTC to the given time (or
+    the system time if None), and immediately send it to the controller, over *connection*
+    if given. '''
+
+    logging.info('Starting RTC update.')
+    controlstring = set_rtc(address, when)
+
+    logging.info('Setting RTC.')
+    logging.debug(repr(controlstring))
+    if connection:
+        connection.send(controlstring)
+    else:
+        connect_and_send(host, controlstring)
+    logging.info('RTC update complete.')
+
+def update_displaymode(host, mode, address=0, connection=None):
+    '''
+    Generate a controlstring that will set the display mode, and immediately send it.
+
+    Args:
+        host (str): Hostname or IP of the controller.
+        mode (int): Display mode to switch to, see :ref:`display_modes`.
+        address (int): Controller index
+        connection (ControllerConnection): an optional open connection to send over.
+    '''
+    new_mode = DisplayMode(mode, address)
+    controlstring = new_mode.to_controlstring()
+
+    logging.info('Setting display mode %s', new_mode.mode)
+    logging.debug(repr(controlstring))
+    if connection:
+        connection.send(controlstring)
+    else:
+        connect_and_send(host, controlstring)
+    logging.info('Mode setting complete.')
+
+def readdress(controlstring, address):
+    '''
+    Return a copy of *controlstring* (:class:`bytes`) for the controller at
+    *address*. Every control string starts with ``SOH enc(address)``, so only
+    that byte is replaced.
+    '''
+    check_in_range(('Address', address, 0, 31))
+    return controlstring[:1] + ENCODED_VALUES[address] + controlstring[2:]
+
+async def _async_send(host, port, controlstring):
+    ''' Connect, consume the banner and send, using asyncio streams. '''
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        await reader.read(1024) # The *** mini blabla *** header
+        writer.write(controlstring)
+        await writer.drain()
+    finally:
+        writer.close()
+
+async def async_connect_and_send(host, controlstring, port=PORT, timeout=TIMEOUT):
+    '''
+    Coroutine counterpart of :func:`connect_and_send`.
+
+    Args:
+        host (str): Hostname or IP of the controller.
+        controlstring: the :class:`str` or :class:`bytes` to send.
+        port (int): TCP port of the controller.
+        timeout (float): seconds allowed for connecting, the banner and sending.
+
+    Returns:
+        A :class:`SendResult`.
+    '''
+    if isinstance(controlstring, str):
+        controlstring = controlstring.encode()
+
+    start = time.monotonic()
+    try:
+        await asyncio.wait_for(_async_send(host, port, controlstring), timeout)
+    except (OSError, asyncio.TimeoutError) as ex:
+        logging.error('Could not send to %s: %s', host, str(ex) or 'timed out')
+        return SendResult(False, time.monotonic() - start, False)
+    return SendResult(True, time.monotonic() - start, False)
+
+async def send_many(targets, controlstring, port=PORT, timeout=TIMEOUT):
+    '''
+    Send a control string to many controllers concurrently.
+
+    Controllers on different hosts are updated concurrently. Addresses on the
+    same host are updated one after another, as a controller only accepts one
+    connection at a time.
+
+    Args:
+        targets: an iterable of (*host*, *address*) pairs. The control string
+            is readdressed (see :func:`readdress`) for every target.
+        controlstring: the :class:`str` or :class:`bytes` to send.
+        port (int): TCP port of the controllers.
+        timeout (float): seconds allowed per target.
+
+    Returns:
+        A dict mapping every (*host*, *address*) target to its :class:`SendResult`.
+    '''
+    if isinstance(controlstring, str):
+        controlstring = controlstring.encode()
+
+    by_host = collections.OrderedDict()
+    for host, address in targets:
+        by_host.setdefault(host, []).append(address)
+
+    results = {}
+
+    async def send_host(host, addresses):
+        ''' Send to all addresses on *host* in turn. '''
+        for address in addresses:
+            results[(host, address)] = await async_connect_and_send(
+                host, readdress(controlstring, address), port, timeout)
+
+    await asyncio.gather(*(send_host(host, addresses)
+                           for host, addresses in by_host.items()))
+    return results
+
+## Streaming commands
+def parse_command(line, address=0):
+    '''
+    Turn one line of a command stream into an instruction.
+
+    Every line is a JSON object, which is either a rotation as accepted by
+    :meth:`~infozuild.sendscript.Rotation.from_dict`, ``{"rtc": null}`` or
+    ``{"rtc": "YYYY-MM-DDTHH:MM:SS"}`` to set the RTC to the current or given
+    time, or ``{"displaymode": <mode>}``. Every command is for *address*, the
+    configured controller, as with :func:`script_set_text`, so the
+    ``"address"`` that :command:`zuil-get` writes is replaced.
+
+    Returns:
+        A :class:`~infozuild.sendscript.Rotation`,
+        :class:`~infozuild.sendscript.RtcUpdate` or :class:`~infozuild.sendscript.DisplayMode`.
+
+    Raises:
+        :exc:`ValueError` or :exc:`TypeError` if the line is not a valid command.
+    '''
+    data = json.loads(line)
+    if not isinstance(data, dict):
+        raise ValueError('command must be a JSON object')
+    data['address'] = address
+
+    if 'rtc' in data:
+        when = data['rtc']
+        if when is not None:
+            when = datetime.datetime.strptime(when, '%Y-%m-%dT%H:%M:%S')
+        return RtcUpdate(when, data['address'])
+    if 'displaymode' in data:
+        return DisplayMode(data['displaymode'], data['address'])
+    return Rotation.from_dict(data)
+
+def stream_commands(stream, connection, address=0, rate_limit=0,
+                    optimize=False, trim_lines=False):
+    '''
+    Read commands (see :func:`parse_command`) from *stream* line by line, and
+    send each one as soon as it has been read.
+
+    Invalid lines are logged and skipped, so a single bad command does not end
+    the stream.
+
+    Args:
+        stream: an iterable of lines, such as :data:`sys.stdin` or an open FIFO.
+        connection (ControllerConnection): the connection to send over, which
+            should be created with *reuse* set.
+        address (int): the controller index to send every command to.
+        rate_limit (float): the minimum number of seconds between two sends.
+        optimize (bool): see :meth:`~infozuild.sendscript.Rotation.encode_into`.
+        trim_lines (bool): see :meth:`~infozuild.sendscript.Rotation.encode_into`.
+
+    Returns:
+        The number of commands that were sent successfully.
+    '''
+    cache = PageCache()
+    last_sent = None
+    sent = 0
+    for num, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            instruction = parse_command(line, address)
+            if isinstance(instruction, Rotation):
+                controlstring = instruction.to_bytes(cache, optimize, trim_lines)
+            else:
+                controlstring = instruction.to_controlstring()
+        except (TypeError, ValueError) as ex:
+            logging.error('Skipping invalid command on line %s: %s', num, ex)
+            continue
+
+        if rate_limit and last_sent is not None:
+            wait = last_sent + rate_limit - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+        last_sent = time.monotonic()
+
+        logging.debug(repr(controlstring))
+        if connection.send(controlstring):
+            sent += 1
+    return sent
+
+## Script
+def main():
+    ''' :command:`zuil-send` entrypoint. '''
+    config = configparser.ConfigParser()
+
+    configdir = os.path.expanduser('~/.infozuil')
+    configpath = os.path.join(configdir, 'send.cfg')
+    if not os.path.isdir(configdir) or not os.path.isfile(configpath):
+        logging.critical('Configfile does not exist, please create send.cfg in ~/.infozuil')
+        os.mkdir(configdir)
+        sys.exit(1)
+    config.read(configpath) # Read the configuration file
+
+    host = config['ConnectionInfo']['server']
+    address = int(config['ConnectionInfo']['address'])
+    port = config.getint('ConnectionInfo', 'port', fallback=PORT)
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--version', action='version',
+                        version='infozuild {}'.format(__version__))
+    parser.add_argument('--verbose', '-v', action='store_true',
+                        help='activate debug logging')
+
+    # Other modes:
+    parser.add_argument('--displaymode', type=int, default=None,
+                        help='set a display mode (overrides text update)')
+    parser.add_argument('--update-rtc', action='store_true',
+                        help='update the RTC to the current time (overrides text update)')
+
+    # Text update
+    parser.add_argument('--file', '-f', default=None,
+                        help='rotation file to read, stdin if not specified.')
+    parser.add_argument('--output', '-o', default=None,
+                        help='output resulting controlstring to file, as well as sending')
+    parser.add_argument('--optimize', action='store_true',
+                        help='leave out page attributes that are inherited from the previous page')
+    parser.add_argument('--trim-lines', action='store_true',
+                        help='leave out trailing empty lines of pages')
+
+    # Streaming
+    parser.add_argument('--stream', action='store_true',
+                        help='read one command per line from the file or stdin, '
+                        'and send each over a single connection')
+    parser.add_argument('--rate-limit', type=float, default=0,
+                        help='minimum number of seconds between sends when streaming')
+
+    args = parser.parse_args()
+
+    if args.verbose:
+        logging.getLogger().setLevel(logging.DEBUG)
+
+    if args.stream:
+        script_stream(args, host, address, port)
+        return
+
+    connection = ControllerConnection(host, port, reuse=False)
+    if args.displaymode is not None:
+        update_displaymode(host, args.displaymode, address, connection)
+    elif args.update_rtc:
+        update_rtc(host, address, connection=connection)
+    else:
+        script_set_text(args, host, address, connection)
+
+def script_stream(args, host, address, port=PORT):
+    '''
+    Send commands from stdin or ``--file`` as they arrive, see
+    :func:`stream_commands`. Called from :func:`main`.
+
+    If the file is a FIFO, it is reopened whenever the writer closes it, so
+    several producers can write to it one after another. Streaming stops at
+    the end of any other input, or when interrupted.
+    '''
+    with ControllerConnection(host, port, reuse=True) as connection:
+        try:
+            if not args.file:
+                stream_commands(sys.stdin, connection, address, args.rate_limit,
+                                args.optimize, args.trim_lines)
+                return
+
+            while True:
+                try:
+                    with open(args.file, 'r') as stream:
+                        stream_commands(stream, connection, address, args.rate_limit,
+                                        args.optimize, args.trim_lines)
+                except FileNotFoundError:
+                    logging.critical('Could not open file %s, exiting', args.file)
+                    sys.exit(1)
+                if not stat.S_ISFIFO(os.stat(args.file).st_mode):
+                    return
+        except KeyboardInterrupt:
+            pass
+
+def script_set_text(args, host, address, connection=None):
+    '''
+    Send a new :class:`~infozuild.sendscript.Rotation` to the zuil. Called from :func:`main`.
+
+    Args:
+        args (argparse.Namespace): Parsed command line arguments.
+        host (str): Hostname or IP of the controller.
+        address (int): Controller index
+        connection (ControllerConnection): an optional connection to send over.
+    '''
+    if args.file:
+        try:
+            with open(args.file, 'r') as data_file:
+                data = json.load(data_file)
+        except FileNotFoundError:
+            logging.critical('Could not open file %s, exiting', args.file)
+            sys.exit(1)
+
+    else:
+        read_data = sys.stdin.read()
+        data = json.loads(read_data)
+
+    try:
+        rotation = Rotation.from_dict(data)
+    except RotationError as ex:
+        for path, message in ex.errors:
+            logging.critical('Invalid rotation: %s %s', path, message)
+        sys.exit(1)
+    rotation.address = address
+    controlstring = rotation.to_bytes(optimize=args.optimize, trim_lines=args.trim_lines)
+
+    if args.output:
+        with open(args.output, 'wb') as output_file:
+            output_file.write(controlstring)
+
+    if connection:
+        connection.send(controlstring)
+    else:
+        connect_and_send(host, controlstring)
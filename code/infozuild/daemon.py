@@ -1,42 +1,40 @@
 '''
 infozuild.daemon provides functions that will periodically update the zuil.
 
-The daemon uses APScheduler to schedule regular updates, by using the functions
-found in :mod:`infozuild.getscript` and :mod:`infozuild.sendscript` via :func:`update_zuil`.
+The daemon runs a :class:`ZuilDaemon` on an :mod:`asyncio` event loop to do
+regular updates, by using the functions found in :mod:`infozuild.getscript`,
+:mod:`infozuild.sendscript` and :mod:`infozuild.controller` via a
+:class:`ZuilManager`.
 
 The following signals will be handled:
-    * SIGUSR1: schedule an update job to be executed immediately.
-    * SIGUSR2: toggle the logging level between INFO and DEBUG.
-    * SIGINT, SIGTERM, SIGQUIT: Cleanly wait for running jobs to end, and stop the daemon.
+    * SIGUSR1: update immediately.
+    * SIGUSR2: toggle the logging level between WARNING and DEBUG.
+    * SIGINT, SIGTERM, SIGQUIT: show the shutdown message, and stop the daemon.
 '''
+import asyncio
+import concurrent.futures
 import logging
 import configparser
 import argparse
+import datetime
+import json
 import signal
 import os.path
 from os.path import expanduser
 import random
+import time
 
-from apscheduler.schedulers.blocking import BlockingScheduler
 import fortune
 
-from . import __version__, sendscript, getscript
+from . import __version__, controller, eventstore, sendscript, getscript, sources
 from .sendscript import blink
 
 
 logging.basicConfig(level=logging.INFO)
 
-JOB_DEFAULTS = {
-    'coalesce': True,   # If multiple updates have been missed, replace with only one.
-    'max_instances': 1  # Don't send multiple updates at the same time.
-}
-
 FORTUNES = os.path.join(os.path.dirname(__file__), 'motds.txt')
 FORTUNE_FREQUENCY = 0.05
 DEFAULT_STATUS = 'Dagelijks geopend van 9-17 uur.'
-SCHEDULER = BlockingScheduler(job_defaults=JOB_DEFAULTS)
-MANAGER = None
-DEBUGGING = False
 
 class ZuilManager:
     '''
@@ -45,6 +43,9 @@ class ZuilManager:
 
     Using a manager allows us to not lose all events when Koala cannot be
     reached, but show an informative message and reuse the old events instead.
+    The events are kept in an :class:`~infozuild.eventstore.EventStore`, so
+    events that have ended are left out of every refresh, even while Koala
+    cannot be reached.
     Shutdown messages and rotating MOTDs are also inserted by the manager.
 
     Args:
@@ -54,9 +55,35 @@ class ZuilManager:
             all.
         print_only (bool): activate debugging and bypass actually updating the
             zuil, instead only printing the control string to debug.
+        send_only_on_change (bool): skip sending if the content is the same as
+            the last content that was successfully sent to this controller.
+        resend_interval (int): the number of minutes after which unchanged
+            content is sent anyway, to refresh the update time. None or 0 to
+            never resend unchanged content.
+        reuse_connection (bool): keep the connection to the controller open
+            between updates.
+        port (int): the TCP port of the controller.
+        optimize (bool): leave out page attributes that are inherited from the
+            previous page when encoding.
+        cache_file (str): a file to keep the last response from Koala in, so
+            requests after a restart can be conditional too. The response is
+            only cached in memory if None.
+        activity_sources (list): the :class:`~infozuild.sources.Source` objects
+            to show the activities of, instead of only Koala's. A
+            :class:`~infozuild.sources.KoalaSource` without a cache of its
+            own gets the cache of *cache_file*.
+        snapshot_file (str): a file to keep the events, status and what was
+            last sent in, so they are shown right after a restart, before
+            anything could be retrieved. It is read on creation.
+
+    Attributes:
+        restored (bool): whether the state was restored from the snapshot file.
     '''
 
-    def __init__(self, host, controller_address, max_events, print_only=False):
+    def __init__(self, host, controller_address, max_events, print_only=False,
+                 send_only_on_change=False, resend_interval=None,
+                 reuse_connection=False, port=controller.PORT, optimize=False,
+                 cache_file=None, activity_sources=None, snapshot_file=None):
         '''
         On start, save arguments and confirm that we can load the MOTDs.
         '''
@@ -64,17 +91,37 @@ class ZuilManager:
         self.controller_address = int(controller_address)
         self.max_events = max_events
         self.print_only = print_only
+        self.send_only_on_change = send_only_on_change
+        self.resend_interval = resend_interval
+        self.optimize = optimize
+        self.activity_sources = activity_sources
+        self.snapshot_file = snapshot_file
 
         self.events = []
+        self.event_store = None
+        self.fetched_events = None
         self.status = 'infozuild {}'.format(__version__)
+        self.page_cache = sendscript.PageCache()
+        self.response_cache = getscript.ResponseCache(cache_file)
+        for source in activity_sources or []:
+            if isinstance(source, sources.KoalaSource) and source.cache is None:
+                source.cache = self.response_cache
+        self.connection = controller.ControllerConnection(host, port, reuse=reuse_connection)
+        self.sender = controller.SendQueue(self.connection)
+        self.last_sent = {} # (host, address) -> (content digest, time sent)
+        self.restored = False
+        self._snapshot = None # The last saved snapshot, to skip saving it again.
 
         self.fortunes = None
         try:
             fortune.make_fortune_data_file(FORTUNES, quiet=True)
             self.fortunes = FORTUNES
-        except FileNotFoundError:
+        except (FileNotFoundError, ValueError):
             logging.warning('Failed to load status messages.')
 
+        if snapshot_file:
+            self.load_snapshot()
+
     def generate_status(self):
         ''' Determine what message will be shown as status if no error. '''
         if self.fortunes and random.random() < FORTUNE_FREQUENCY:
@@ -85,33 +132,126 @@ class ZuilManager:
                 self.fortunes = None
         return DEFAULT_STATUS
 
-    def update_activities(self):
+    def fetch_events(self):
         '''
-        Attempt to update the cache of events, keep the old events in case of
-        an error, and refresh the display with the possibly new content.
+        Retrieve the events from Koala or the configured sources. This is the
+        only part of an update that uses the network, and it does not change
+        the manager, so it can run in another thread.
+
+        Returns:
+            A list of event dicts and a string containing an error code,
+            which is empty if there was no error.
+        '''
+        if self.activity_sources:
+            return sources.get_events(self.activity_sources)
+        return getscript.get_events(cache=self.response_cache)
+
+    def apply_events(self, new_events, error):
         '''
-        new_events, error = getscript.get_activities()
-        if not error:
-            self.events = new_events
+        Update the cache of events with the result of :meth:`fetch_events`,
+        keeping the old events in case of an error, and update the status.
+        With several sources, the events of the sources that succeeded are
+        always used, and those of failed sources are kept from before.
+        '''
+        # Sources fill in the last events of those that failed, Koala alone gives none.
+        complete = not error or bool(self.activity_sources and new_events)
+        # Koala answering 'not modified' gives the same list, which is indexed already.
+        if complete and (self.event_store is None or new_events is not self.fetched_events):
+            self.event_store = eventstore.EventStore(new_events)
+            self.fetched_events = new_events
+        self.render_events()
         self.status = blink(error) # Will clear old error if it is resolved.
 
         if not self.events and not error:
             self.status = 'Geen activiteiten gevonden.'
 
+    def update_activities(self):
+        '''
+        Attempt to update the cache of events, keep the old events in case of
+        an error, and refresh the display with the possibly new content.
+        '''
+        self.apply_events(*self.fetch_events())
         self.refresh_zuil()
+        self.save_snapshot()
+
+    def prepare_shutdown(self):
+        '''
+        Prepare the control string with a status message indicating the pi is
+        powering off, as :meth:`prepare_send` does.
+        '''
+        status = self.status
+        self.status = blink('De zuil staat nu uit.') + '\n' +\
+                      blink('Power-cycle voor nieuwe inhoud.')
+        try:
+            return self.prepare_send(force=True)
+        finally:
+            # Keep the status of the last update, but remember what is on the zuil now.
+            self.status = status
 
     def handle_shutdown(self):
         ''' Immediately update the zuil with a new status message indicating
         the pi is powering off.'''
+        self.send(self.prepare_shutdown())
+        self.save_snapshot()
 
-        self.status = blink('De zuil staat nu uit.') + '\n' +\
-                      blink('Power-cycle voor nieuwe inhoud.')
-        self.refresh_zuil()
+    def load_snapshot(self):
+        '''
+        Restore the events, status and what was last sent from
+        :attr:`snapshot_file`, leaving them as they are if that fails.
+        '''
+        try:
+            with open(self.snapshot_file) as snapshot_file:
+                data = json.load(snapshot_file)
+            store = eventstore.EventStore(data['events'])
+            status = data['status']
+            last_sent = {(host, address): (digest, sent_at)
+                         for host, address, digest, sent_at in data['last_sent']}
+        except FileNotFoundError:
+            return
+        except (ValueError, KeyError, TypeError) as ex:
+            logging.warning('Ignoring unreadable snapshot %s: %s', self.snapshot_file, ex)
+            return
+        self.event_store, self.fetched_events = store, data['events']
+        self.status, self.last_sent = status, last_sent
+        self._snapshot = data
+        self.restored = True
+        self.render_events()
+
+    def save_snapshot(self):
+        '''
+        Atomically replace :attr:`snapshot_file` with the events, status and
+        what was last sent, if a snapshot file was given and anything changed.
+        '''
+        if not self.snapshot_file or self.fetched_events is None:
+            return
+        data = {
+            'events': self.fetched_events,
+            'status': self.status,
+            'last_sent': [[host, address, digest, sent_at]
+                          for (host, address), (digest, sent_at) in self.last_sent.items()],
+            }
+        if data == self._snapshot:
+            return
+        try:
+            getscript.replace_json(self.snapshot_file, data)
+        except OSError as ex:
+            logging.warning('Could not save snapshot %s: %s', self.snapshot_file, ex)
+            return
+        self._snapshot = data
+
+    def render_events(self, now=None):
+        '''
+        Update :attr:`events` from the event store for *now*, by default the
+        current time, leaving out the events that have ended.
+        '''
+        if self.event_store is not None:
+            self.events = self.event_store.activities(now, self.max_events)
 
     def make_rotation(self):
         '''
         Build the rotation that will be sent to the zuil. Exposed for debugging purposes.
         '''
+        self.render_events()
         rota = getscript.make_rotation(
             self.events, self.status or self.generate_status(), self.max_events)
         rota.address = self.controller_address
@@ -119,21 +259,264 @@ class ZuilManager:
 
         return rota
 
-    def refresh_zuil(self):
+    def needs_send(self, digest, only_on_change=False):
+        '''
+        Decide whether content with the given digest should be sent, based on
+        what was last sent to this controller and when. Unchanged content is
+        always sent unless *only_on_change* or :attr:`send_only_on_change`
+        is set.
+        '''
+        if not (only_on_change or self.send_only_on_change):
+            return True
+
+        last_digest, sent_at = self.last_sent.get(
+            (self.host, self.controller_address), (None, 0))
+        if digest != last_digest:
+            return True
+
+        return bool(self.resend_interval) and \
+            time.time() - sent_at >= self.resend_interval * 60
+
+    def prepare_send(self, force=False, only_on_change=False):
+        '''
+        Create a new :class:`Rotation`, populate it with the earlier retrieved
+        events, and encode it, if it should be sent.
+
+        Args:
+            force (bool): send even if the content has not changed since the
+                last successful send.
+            only_on_change (bool): do not send unchanged content, even if
+                :attr:`send_only_on_change` is not set.
+
+        Returns:
+            The control string and the digest of its content, or None if
+            nothing should be sent.
+        '''
+        rotation = self.make_rotation()
+        controlstring = rotation.to_bytes(self.page_cache, self.optimize)
+        logging.debug(repr(controlstring))
+        if self.print_only:
+            return None
+
+        digest = getscript.content_digest(rotation, self.page_cache)
+        if not force and not self.needs_send(digest, only_on_change):
+            logging.info('Content unchanged, not sending.')
+            return None
+        return controlstring, digest
+
+    def record_sent(self, digest, result):
+        ''' Remember that the content with *digest* was sent, if *result* tells it was. '''
+        logging.info('Send %s after %.1fs.',
+                     'succeeded' if result.success else 'failed', result.latency)
+        if result.success and not result.superseded:
+            self.last_sent[(self.host, self.controller_address)] = (digest, time.time())
+
+    def send(self, prepared):
+        ''' Send what :meth:`prepare_send` returned, and wait for the result. '''
+        if prepared is None:
+            return
+        controlstring, digest = prepared
+        self.record_sent(digest, self.sender.submit(controlstring).result())
+
+    def refresh_zuil(self, force=False, only_on_change=False):
         '''
         Create a new :class:`Rotation`, populate it with the earlier retrieved
         events, and send it to the controller to be displayed.
+
+        Args:
+            force (bool): as for :meth:`prepare_send`.
+            only_on_change (bool): as for :meth:`prepare_send`.
         '''
+        self.send(self.prepare_send(force, only_on_change))
+
+    def close(self):
+        ''' Send anything still queued, and close the connection to the controller. '''
+        self.sender.stop()
+        self.connection.close()
+
+def next_update(now, interval):
+    '''
+    Return the first moment after *now* at which an update is due, when
+    updating at every minute of the hour that is a multiple of *interval*, as
+    cron's ``*/interval`` does.
+    '''
+    hour = now.replace(minute=0, second=0, microsecond=0)
+    minute = (now.minute // interval + 1) * interval
+    if minute >= 60:
+        return hour + datetime.timedelta(hours=1)
+    return hour + datetime.timedelta(minutes=minute)
+
+def seconds_until(moment):
+    ''' Return the number of seconds from now until the :class:`datetime.datetime` *moment*. '''
+    return max(0, (moment - datetime.datetime.now()).total_seconds())
+
+class ZuilDaemon:
+    '''
+    Runs a :class:`ZuilManager` on an :mod:`asyncio` event loop, until stopped.
+
+    An update is split over three coroutines, connected by queues:
+
+    * the fetcher retrieves the events every *interval* minutes, or right
+      away when :meth:`update_now` is called, in a thread of its own;
+    * the renderer applies the retrieved events and builds the control
+      string, also when an event ends or the day changes in between;
+    * the sender sends the control strings through the manager's
+      :class:`~infozuild.controller.SendQueue`.
+
+    A slow fetch thus never holds up a send, such as the shutdown message.
+    Of two control strings waiting to be sent, only the newest is kept.
+
+    Args:
+        manager (ZuilManager): the manager to update the zuil with.
+        interval (int): the number of minutes between updates. Updates are
+            done at the minutes of the hour that are a multiple of it.
+    '''
+
+    def __init__(self, manager, interval):
+        self.manager = manager
+        self.interval = interval
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self._fetched = None
+        self._outbox = None
+        self._fetch_now = None
+        self._stopping = None
+
+    def update_now(self):
+        ''' Retrieve the events right away, instead of at the next update. Called on SIGUSR1. '''
+        logging.info('Updating now.')
+        self._fetch_now.set()
+
+    def stop(self):
+        ''' Show the shutdown message and stop. Called on SIGINT, SIGTERM and SIGQUIT. '''
+        logging.info('Shutting down.')
+        self._stopping.set()
+
+    def add_signal_handlers(self, loop):
+        ''' Handle the signals described in :mod:`infozuild.daemon` on *loop*. '''
+        for name, callback in (('SIGTERM', self.stop), ('SIGINT', self.stop),
+                               ('SIGQUIT', self.stop), ('SIGUSR1', self.update_now),
+                               ('SIGUSR2', toggle_loglevel)):
+            try:
+                loop.add_signal_handler(getattr(signal, name), callback)
+            except (AttributeError, NotImplementedError):
+                pass # Unavailable on Windows
+
+    async def run(self):
+        '''
+        Show the restored content, or the version, then keep the zuil updated
+        until :meth:`stop` is called. The shutdown message is sent before
+        returning, unless that takes longer than
+        :data:`infozuild.controller.TIMEOUT`.
+        '''
+        loop = asyncio.get_event_loop()
+        self._fetched = asyncio.Queue()
+        self._outbox = asyncio.Queue(maxsize=1)
+        self._fetch_now = asyncio.Event()
+        self._stopping = asyncio.Event()
+
+        # Display the restored content, unless it is on the zuil already, or the version.
+        self.post(self.manager.prepare_send(only_on_change=self.manager.restored))
 
-        controlstring = self.make_rotation().to_controlstring()
-        if not self.print_only:
-            sendscript.connect_and_send(self.host, controlstring)
-        logging.debug(repr(controlstring.encode()))
+        tasks = [loop.create_task(coroutine)
+                 for coroutine in (self.fetcher(), self.renderer(), self.sender())]
+        try:
+            await self._stopping.wait()
+        finally:
+            for task in tasks[:2]:
+                task.cancel()
+            await asyncio.gather(*tasks[:2], return_exceptions=True)
+            # Fetches that are still running end by their own timeout.
+            self._executor.shutdown(wait=False)
+
+            self.post(self.manager.prepare_shutdown())
+            try:
+                await asyncio.wait_for(self._outbox.join(), controller.TIMEOUT)
+            except asyncio.TimeoutError:
+                logging.error('Could not send the shutdown message in time.')
+            tasks[2].cancel()
+            await asyncio.gather(tasks[2], return_exceptions=True)
+            self.manager.close()
+
+    def post(self, prepared):
+        '''
+        Queue what :meth:`ZuilManager.prepare_send` returned for the sender,
+        replacing anything that is still waiting to be sent.
+        '''
+        if prepared is None:
+            return
+        if self._outbox.full():
+            self._outbox.get_nowait()
+            self._outbox.task_done()
+            logging.debug('Dropped superseded text update.')
+        self._outbox.put_nowait(prepared)
+
+    async def fetcher(self):
+        ''' Retrieve the events at every update, and queue them for the renderer. '''
+        loop = asyncio.get_event_loop()
+        while True:
+            try:
+                await asyncio.wait_for(self._fetch_now.wait(),
+                                       seconds_until(next_update(datetime.datetime.now(),
+                                                                 self.interval)))
+            except asyncio.TimeoutError:
+                pass
+            self._fetch_now.clear()
+            try:
+                result = await loop.run_in_executor(self._executor, self.manager.fetch_events)
+            except asyncio.CancelledError:
+                raise
+            except Exception: # pylint: disable=broad-except
+                logging.exception('Retrieving the events failed.')
+                continue
+            await self._fetched.put(result)
+
+    async def renderer(self):
+        '''
+        Apply retrieved events and queue the new control string for the
+        sender, or only render again when the events on display change. If
+        that fails, the events and status shown before are kept.
+        '''
+        manager = self.manager
+        while True:
+            store = manager.event_store
+            timeout = seconds_until(store.next_change()) if store is not None else None
+            try:
+                result = await asyncio.wait_for(self._fetched.get(), timeout)
+            except asyncio.TimeoutError:
+                logging.debug('Rendering again, as an event ended or the day changed.')
+                result = None
+            shown = manager.event_store, manager.fetched_events, manager.events, manager.status
+            try:
+                if result is not None:
+                    manager.apply_events(*result)
+                self.post(manager.prepare_send())
+            except Exception: # pylint: disable=broad-except
+                logging.exception('Rendering the events failed, keeping the last ones.')
+                (manager.event_store, manager.fetched_events,
+                 manager.events, manager.status) = shown
+
+    async def sender(self):
+        ''' Send the queued control strings, and save a snapshot after each. '''
+        while True:
+            controlstring, digest = await self._outbox.get()
+            try:
+                result = await asyncio.wrap_future(self.manager.sender.submit(controlstring))
+                self.manager.record_sent(digest, result)
+                self.manager.save_snapshot()
+            finally:
+                self._outbox.task_done()
 
 def main():
     ''' :command:`zuild` entry point. '''
-    global DEBUGGING
-    global MANAGER
+    run()
+
+def run():
+    '''
+    Run :command:`zuild` with the command-line arguments, until it is stopped.
+
+    Returns:
+        The :class:`ZuilManager`, for inspection with ``python -i``.
+    '''
 
     # Parse command-line arguments
     parser = argparse.ArgumentParser()
@@ -162,7 +545,6 @@ def main():
     args = parser.parse_args()
 
     if args.verbose:
-        DEBUGGING = True
         logging.getLogger().setLevel(logging.DEBUG)
 
     logging.debug(args)
@@ -179,66 +561,57 @@ def main():
 
     host = args.host or config['ConnectionInfo']['Server']
     controller_address = args.index or config['ConnectionInfo']['Address']
+    port = config.getint('ConnectionInfo', 'Port', fallback=controller.PORT)
+    reuse_connection = config.getboolean('ConnectionInfo', 'Reuse', fallback=False)
 
-    update_interval = '*/{}'.format(args.interval or config['Daemon']['Interval'])
+    update_interval = args.interval or config.getint('Daemon', 'Interval')
     max_events = args.limit or config.getint('Daemon', 'MaxEntries', fallback=None)
-
-    logging.debug('Parameters: host %s, index %s, interval %s',
-                  host, controller_address, update_interval)
+    send_only_on_change = config.getboolean('Daemon', 'SendOnlyOnChange', fallback=False)
+    resend_interval = config.getint('Daemon', 'ResendInterval', fallback=None)
+    optimize = config.getboolean('Daemon', 'Optimize', fallback=False)
+    cache_file = config.get('Daemon', 'CacheFile', fallback=None)
+    snapshot_file = config.get('Daemon', 'SnapshotFile', fallback=None)
+    getscript.API_URL = config.get('Daemon', 'ApiURL', fallback=getscript.API_URL)
+    if cache_file:
+        cache_file = expanduser(cache_file)
+    if snapshot_file:
+        snapshot_file = expanduser(snapshot_file)
+    activity_sources = sources.from_config(config)
+
+    logging.debug('Parameters: host %s, port %s, index %s, interval %s, reuse connection %s',
+                  host, port, controller_address, update_interval, reuse_connection)
     logging.debug('Limit %s, configfile %s, noop %s', max_events, args.config, args.noop)
+    logging.debug('Send only on change %s, resend interval %s, optimize %s, cache file %s',
+                  send_only_on_change, resend_interval, optimize, cache_file)
+    logging.debug('API URL %s, sources %s, snapshot file %s',
+                  getscript.API_URL, activity_sources, snapshot_file)
 
-    MANAGER = ZuilManager(host, controller_address, max_events, args.noop)
+    manager = ZuilManager(host, controller_address, max_events, args.noop,
+                          send_only_on_change, resend_interval, reuse_connection, port,
+                          optimize, cache_file, activity_sources, snapshot_file)
 
     if args.once:
-        MANAGER.update_activities() # Script will exit after this.
+        manager.update_activities() # Script will exit after this.
+        return manager
 
-    else:
-        # Register signal handlers
-        signal.signal(signal.SIGTERM, quit_handler_cb)
-        signal.signal(signal.SIGINT, quit_handler_cb)
-        try:
-            signal.signal(signal.SIGQUIT, quit_handler_cb)
-            signal.signal(signal.SIGUSR1, update_now_cb)
-            signal.signal(signal.SIGUSR2, toggle_loglevel_cb)
-        except ValueError:
-            pass # Unavailable on Windows
-
-        # Register update job
-        SCHEDULER.add_job(
-            MANAGER.update_activities, trigger='cron',
-            minute=update_interval, id='zuild.update')
-
-        if not args.verbose:
-            logging.getLogger().setLevel(logging.WARNING)
-
-        # Display version
-        MANAGER.refresh_zuil()
-        SCHEDULER.start() # Blocking call
-
-def quit_handler_cb(sig, *args):
-    ''' Called when SIGINT, SIGTERM or SIGQUIT is received while in daemon mode.
-    Attempt to shutdown somewhat cleanly by waiting for the currently executing jobs.'''
-
-    logging.info('Shutting down, caught signal %s.', sig)
-    MANAGER.handle_shutdown()
-    SCHEDULER.shutdown()
-
-def update_now_cb(*args):
-    ''' Called on SIGUSR1, add a 'update-zuil'-job scheduled to execute immediately. '''
-    job = SCHEDULER.get_job('zuild.update')
-    SCHEDULER.add_job(job.func, args=job.args, kwargs=job.kwargs,
-                      name='manual_update', id='zuild.manual')
-
-def toggle_loglevel_cb(*args):
-    ''' Called on SIGUSR2, toggles the loglevel between DEBUG and WARNING. '''
-    global DEBUGGING
-    if DEBUGGING:
+    if not args.verbose:
         logging.getLogger().setLevel(logging.WARNING)
-        DEBUGGING = False
-    else:
-        logging.getLogger().setLevel(logging.DEBUG)
-        DEBUGGING = True
-    logging.warning('Loglevel set to %s', 'debug' if DEBUGGING else 'warn')
+
+    daemon = ZuilDaemon(manager, update_interval)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        daemon.add_signal_handlers(loop)
+        loop.run_until_complete(daemon.run()) # Runs until stopped by a signal.
+    finally:
+        loop.close()
+    return manager
+
+def toggle_loglevel():
+    ''' Called on SIGUSR2, toggles the loglevel between DEBUG and WARNING. '''
+    debugging = not logging.getLogger().isEnabledFor(logging.DEBUG)
+    logging.getLogger().setLevel(logging.DEBUG if debugging else logging.WARNING)
+    logging.warning('Loglevel set to %s', 'debug' if debugging else 'warn')
 
 if __name__ == '__main__':
-    main()
+    manager = run() # pylint: disable=invalid-name
@@ -0,0 +1,263 @@
+'''
+infozuild.emulator provides a stand-in for the controller of the zuil, so the
+scripts and the daemon can be exercised without the real hardware.
+
+The emulator speaks the protocol described in :doc:`protocol`: it sends a
+``*** mini ... ***`` banner on connect, refuses a second connection while one
+is open, and parses text, RTC and display mode control strings into the state
+the real controller would have. A processing delay and bandwidth limit can be
+set to approximate the real controller, and every received control string is
+recorded with its timing.
+
+The emulator can be run independently, by using the command
+:command:`zuil-emulator`, which calls :func:`main`.
+'''
+import argparse
+import collections
+import json
+import logging
+import socketserver
+import threading
+import time
+
+from . import __version__
+from .parsing import parse_controlstring
+from .sendscript import DisplayMode, Rotation, RtcUpdate, CR
+
+
+BANNER = '*** mini infozuild {} emulator ***\r\n'.format(__version__).encode()
+
+Reception = collections.namedtuple(
+    'Reception', ['kind', 'address', 'size', 'connected', 'finished'])
+Reception.__doc__ = '''
+A control string received by the :class:`ControllerEmulator`.
+
+Attributes:
+    kind (str): ``'text'``, ``'rtc'``, ``'displaymode'`` or ``'unknown'``.
+    address (int): the controller address the control string was sent to.
+    size (int): the length of the control string in bytes.
+    connected (float): :func:`time.monotonic` when the connection was accepted.
+    finished (float): :func:`time.monotonic` when processing was done.
+'''
+
+_CR = CR.encode()
+
+class ControllerEmulator(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    '''
+    A TCP server emulating the controller.
+
+    Args:
+        address (tuple): the (*host*, *port*) to listen on. Port 0 picks a free port.
+        delay (float): seconds the emulator spends processing each control
+            string, during which the connection is not read from.
+        bandwidth (int): the maximum number of bytes per second to read, or
+            None for no limit.
+
+    Attributes:
+        texts (dict): the pages per controller address, as lists of
+            :class:`~infozuild.sendscript.Page` with the attributes in effect
+            for each page, taking inheritance from earlier pages into account.
+        clocks (dict): the RTC per controller address, as a
+            :class:`datetime.datetime`.
+        modes (dict): the display mode per controller address.
+        receptions (list): a :class:`Reception` for every control string.
+        refused (int): the number of connections refused because another
+            connection was open.
+    '''
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address=('localhost', 0), delay=0, bandwidth=None):
+        self.delay = delay
+        self.bandwidth = bandwidth
+
+        self.texts = {}
+        self.clocks = {}
+        self.modes = {}
+        self.receptions = []
+        self.refused = 0
+
+        self.busy = threading.Lock()
+        self.changed = threading.Condition()
+        self._thread = None
+        super().__init__(address, _ControllerHandler)
+
+    @property
+    def port(self):
+        ''' The port the emulator is listening on. '''
+        return self.server_address[1]
+
+    def start(self):
+        ''' Start serving in a background thread. '''
+        self._thread = threading.Thread(target=self.serve_forever, name='zuil-emulator',
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        ''' Stop serving and close the listening socket. '''
+        if self._thread is not None:
+            self.shutdown()
+            self._thread.join()
+            self._thread = None
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def wait_for(self, count, timeout=5):
+        '''
+        Wait until at least *count* control strings have been processed.
+
+        Returns:
+            `True` if they were, `False` on timeout.
+        '''
+        with self.changed:
+            return self.changed.wait_for(lambda: len(self.receptions) >= count, timeout)
+
+    def process(self, controlstring, connected):
+        ''' Apply a complete control string to the emulated state. '''
+        if self.delay:
+            time.sleep(self.delay)
+
+        kind, address = 'unknown', None
+        try:
+            instructions = parse_controlstring(controlstring, inherit=True)
+        except ValueError:
+            instructions = []
+
+        for instruction in instructions:
+            address = instruction.address
+            if isinstance(instruction, Rotation):
+                kind = 'text'
+                self.texts[address] = instruction.pages
+            elif isinstance(instruction, RtcUpdate):
+                kind = 'rtc'
+                self.clocks[address] = instruction.when
+            elif isinstance(instruction, DisplayMode):
+                kind = 'displaymode'
+                self.modes[address] = instruction.mode
+
+        if kind == 'unknown':
+            logging.warning('Emulator received an unknown control string: %r', controlstring)
+
+        with self.changed:
+            self.receptions.append(Reception(
+                kind, address, len(controlstring), connected, time.monotonic()))
+            self.changed.notify_all()
+
+    def stats(self):
+        '''
+        Summarize the receptions so far.
+
+        Returns:
+            A dict with the number of control strings and bytes received, the
+            mean seconds from accepting a connection until its first control
+            string was processed, and the mean bytes per second over that time.
+        '''
+        firsts = {}
+        for reception in self.receptions:
+            firsts.setdefault(reception.connected, reception)
+        latencies = [first.finished - first.connected for first in firsts.values()]
+        elapsed = sum(latencies)
+        total = sum(first.size for first in firsts.values())
+        return {
+            'count': len(self.receptions),
+            'bytes': sum(reception.size for reception in self.receptions),
+            'mean_latency': elapsed / len(latencies) if latencies else None,
+            'throughput': total / elapsed if elapsed else None,
+            'refused': self.refused,
+            }
+
+    def state(self):
+        ''' Return the emulated state as a JSON-compatible dict. '''
+        return {
+            'texts': {address: [page.to_dict() for page in pages]
+                      for address, pages in self.texts.items()},
+            'clocks': {address: clock.isoformat() for address, clock in self.clocks.items()},
+            'modes': self.modes,
+            }
+
+class _ControllerHandler(socketserver.BaseRequestHandler):
+    ''' Handles one connection to the :class:`ControllerEmulator`. '''
+
+    def handle(self):
+        server = self.server
+        if not server.busy.acquire(blocking=False):
+            logging.info('Emulator refused a concurrent connection.')
+            server.refused += 1
+            return
+
+        try:
+            connected = time.monotonic()
+            self.request.sendall(BANNER)
+            self.receive(connected)
+        finally:
+            server.busy.release()
+
+    def receive(self, connected):
+        ''' Read and process control strings until the client disconnects. '''
+        server = self.server
+        chunk_size = min(server.bandwidth or 4096, 4096)
+        pending = bytearray()
+        while True:
+            try:
+                chunk = self.request.recv(chunk_size)
+            except OSError:
+                break
+            if not chunk:
+                break
+            if server.bandwidth:
+                time.sleep(len(chunk) / server.bandwidth)
+
+            pending += chunk
+            end = pending.find(_CR)
+            while end != -1:
+                server.process(bytes(pending[:end + 1]), connected)
+                del pending[:end + 1]
+                end = pending.find(_CR)
+
+def main():
+    '''
+    :command:`zuil-emulator` entrypoint.
+
+    Runs an emulated controller until interrupted, logging the state after
+    every control string.
+    '''
+    parser = argparse.ArgumentParser(
+        description='Emulate the controller of the zuil, for testing without hardware.')
+    parser.add_argument('--version', action='version',
+                        version='infozuild {}'.format(__version__))
+    parser.add_argument('--host', default='localhost',
+                        help='address to listen on')
+    parser.add_argument('--port', '-p', type=int, default=2323,
+                        help='port to listen on')
+    parser.add_argument('--delay', type=float, default=0,
+                        help='seconds spent processing each control string')
+    parser.add_argument('--bandwidth', type=int, default=None,
+                        help='maximum number of bytes per second to receive')
+
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.INFO)
+
+    emulator = ControllerEmulator((args.host, args.port), args.delay, args.bandwidth)
+    logging.info('Emulating a controller on %s:%s', args.host, emulator.port)
+    emulator.start()
+
+    processed = 0
+    try:
+        while True:
+            if emulator.wait_for(processed + 1, timeout=None):
+                processed = len(emulator.receptions)
+                print(json.dumps(emulator.state(), sort_keys=True, default=str))
+                logging.info('Stats: %s', emulator.stats())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        emulator.stop()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+'''
+infozuild.eventstore keeps the events retrieved from Koala (or the other
+:mod:`~infozuild.sources`) with their start and end times, so what is shown on
+the zuil can be brought up to date without retrieving anything.
+
+Events that have ended are left out as soon as they end, and the 'when'
+strings of :func:`infozuild.getscript.build_when` are rendered for the current
+day, so an event only shows its time without a date on the day it starts.
+This keeps the display correct during an outage of Koala, which can last
+much longer than the interval between updates.
+'''
+import bisect
+import datetime
+
+from . import getscript
+from .sources import start_key
+
+
+def end_key(event):
+    '''
+    Return the moment *event* ends as a naive local :class:`datetime.datetime`,
+    like :func:`infozuild.sources.start_key`. Events without an end time end at
+    the end of the day they end on, or of the day they start on if they have
+    no end date at all.
+    '''
+    end_string = event.get('end_date')
+    if end_string is None or 'T' not in end_string:
+        day = start_key(event).date() if end_string is None else \
+            getscript.parse_date(end_string).date()
+        return datetime.datetime.combine(day + datetime.timedelta(days=1), datetime.time())
+    return start_key({'start_date': end_string})
+
+class EventStore:
+    '''
+    Events indexed by their start and end time, in sorted arrays that are
+    searched with :mod:`bisect`.
+
+    The events are kept in order of start time, which is the order they are
+    shown in. Their end times are kept in a separate sorted array, so the
+    events that ended before a given moment are found by one binary search,
+    and each is only expired once. Rendering the first *limit* upcoming events
+    then takes O(log *n* + *limit*) time, and the 'when' strings are only
+    rendered again when the day changes.
+
+    Args:
+        events (list): event dicts as returned by Koala's API, in any order.
+
+    Attributes:
+        events (list): the event dicts, sorted by start time.
+        starts (list): the start time of every event in :attr:`events`.
+        ends (list): the end times of the events, sorted.
+    '''
+
+    def __init__(self, events=()):
+        keyed = sorted((start_key(event), index, event) for index, event in enumerate(events))
+        self.events = [event for _, _, event in keyed]
+        self.starts = [start for start, _, _ in keyed]
+
+        ends = sorted((end_key(event), index) for index, event in enumerate(self.events))
+        self.ends = [end for end, _ in ends]
+        self._end_order = [index for _, index in ends]
+
+        self._ended = [False] * len(self.events)
+        self._expired = 0 # The number of entries of ends that have passed.
+        self._first = 0 # The index of the first event that has not ended.
+        self._day = None
+        self._when = {} # index -> 'when' string on _day
+
+    def __len__(self):
+        ''' The number of events that have not ended, when last expired. '''
+        return len(self.events) - self._expired
+
+    def expire(self, now=None):
+        '''
+        Leave out the events that ended at or before *now*, by default the
+        current time.
+
+        Returns:
+            The number of events that ended since the last call.
+        '''
+        now = now or datetime.datetime.now()
+        ended = bisect.bisect_right(self.ends, now)
+        if ended <= self._expired:
+            return 0
+
+        for index in self._end_order[self._expired:ended]:
+            self._ended[index] = True
+        count = ended - self._expired
+        self._expired = ended
+        while self._first < len(self.events) and self._ended[self._first]:
+            self._first += 1
+        return count
+
+    def upcoming(self, now=None, limit=None):
+        '''
+        Return the indices of the first *limit* events, in order of start
+        time, that have not ended at *now*. Events that are going on are
+        included. A negative *limit* leaves out that many events at the end.
+        '''
+        self.expire(now)
+        if limit is not None and limit < 0:
+            return self.upcoming(now)[0:limit]
+        if self._expired == 0:
+            return list(range(len(self.events))[0:limit])
+
+        indices = []
+        for index in range(self._first, len(self.events)):
+            if limit is not None and len(indices) >= limit:
+                break
+            if not self._ended[index]:
+                indices.append(index)
+        return indices
+
+    def activities(self, now=None, limit=None):
+        '''
+        Return the (*name*, *date*) tuples of the upcoming events at *now*, by
+        default the current time, as :func:`infozuild.getscript.get_activities`
+        would. Only *limit* events are returned if it is not None.
+        '''
+        now = now or datetime.datetime.now()
+        today = now.date()
+        if today != self._day:
+            self._when = {}
+            self._day = today
+
+        indices = self.upcoming(now, limit)
+        missing = [index for index in indices if index not in self._when]
+        if missing:
+            whens = getscript.build_when_many([self.events[index] for index in missing], today)
+            self._when.update(zip(missing, whens))
+        return [(self.events[index]['name'], self._when[index]) for index in indices]
+
+    def next_change(self, now=None):
+        '''
+        Return the first moment after *now* at which :meth:`activities`
+        changes: when an event ends, or when the day changes.
+        '''
+        now = now or datetime.datetime.now()
+        midnight = datetime.datetime.combine(
+            now.date() + datetime.timedelta(days=1), datetime.time())
+        position = bisect.bisect_right(self.ends, now)
+        if position < len(self.ends):
+            return min(self.ends[position], midnight)
+        return midnight
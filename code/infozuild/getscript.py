@@ -7,8 +7,17 @@ The getscript can be run independently, by using the command
 '''
 from __future__ import print_function
 import argparse
+import copy
 import datetime
+import functools
+import hashlib
+import json
 import logging
+import os
+import random
+import re
+import sys
+import time
 try:
     from json.decoder import JSONDecodeError as JSONDecodeError
 except ImportError:
@@ -16,58 +25,321 @@ except ImportError:
 
 import dateutil.parser
 import requests
-import unidecode
 
-from .sendscript import Page, Rotation
+from .sendscript import blink, Page, Rotation
 
 
 LINE_WIDTH = 32
 TOP_LINE = '  --- Komende Activiteiten ---  '
 API_URL = 'https://koala.svsticky.nl/api/activities'
 
+CONNECT_TIMEOUT = 3.05
+''' Seconds to wait for a connection to Koala. '''
+READ_TIMEOUT = 10
+''' Seconds to wait for Koala between two received chunks of a response. '''
+RETRIES = 2
+''' Number of times a failed request to Koala is tried again. '''
+BACKOFF = 0.5
+''' Maximum random delay in seconds before the first retry, doubled for every next one. '''
+FETCH_TIMEOUT = (RETRIES + 1) * (CONNECT_TIMEOUT + READ_TIMEOUT) + (2 ** RETRIES - 1) * BACKOFF
+''' Seconds :func:`fetch_response` takes at most while Koala does not respond, with retries. '''
+
 ALIGN_RIGHT = '>' + str(LINE_WIDTH)
 ALIGN_CENTER = '^' + str(LINE_WIDTH)
 UPDATE_TIME_FORMAT = '%d %B %X'
 ACTIVITY_DATE_FORMAT = '%d %b'
 
-def get_activities():
+_SESSION = None
+
+def get_session():
     '''
-    Retrieve upcoming activities and parse the received data into the format to
-    be used on the display.
+    Return the :class:`requests.Session` shared by all requests to Koala, so
+    its connection is kept alive and reused instead of connecting (and doing
+    a TLS handshake) for every request.
+    '''
+    global _SESSION # pylint: disable=global-statement
+    if _SESSION is None:
+        _SESSION = requests.Session()
+    return _SESSION
+
+def fetch_response(session=None, headers=None, url=None):
+    '''
+    Request :data:`API_URL`, or *url* if given, trying again up to
+    :data:`RETRIES` times after a connection failure, a timeout or a 5xx
+    response. Retries are delayed by a random time of at most :data:`BACKOFF`
+    seconds, doubled for every retry, so a request takes at most about
+    :data:`FETCH_TIMEOUT` seconds while Koala does not respond at all.
+
+    Args:
+        session (requests.Session): the session to use, :func:`get_session` if omitted.
+        headers (dict): extra request headers.
+        url (str): the URL to request instead of :data:`API_URL`.
 
     Returns:
-        A list of (*name*, *date*) tuples and an optional string containing an
-        error code. The list of events will be empty if events could not be
-        retrieved.
+        The :class:`requests.Response` of the last attempt.
+
+    Raises:
+        :exc:`requests.exceptions.RequestException` if the last attempt failed.
     '''
+    session = session or get_session()
+    for attempt in range(RETRIES + 1):
+        if attempt:
+            time.sleep(random.uniform(0, BACKOFF * 2 ** (attempt - 1)))
+        try:
+            response = session.get(url or API_URL, headers=headers,
+                                   timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as ex:
+            if attempt == RETRIES:
+                raise
+            logging.warning('Request to Koala failed, retrying: %s', ex)
+            continue
+        if response.status_code < 500 or attempt == RETRIES:
+            return response
+        logging.warning('Koala answered with HTTP %s, retrying.', response.status_code)
+
+def _fetch_events(session, cache, url=None):
+    '''
+    Retrieve the events from Koala, for :func:`get_events` and :func:`get_activities`.
 
+    Returns:
+        The response, the list of events or None if the cached events are
+        still current, and a string containing an error code, which is empty
+        if there was no error.
+    '''
+    headers = cache.request_headers() if cache is not None else {}
     try:
-        response = requests.get(API_URL)
-    except requests.exceptions.ConnectionError as ex:
+        response = fetch_response(session, headers, url)
+    except requests.exceptions.RequestException as ex:
         logging.critical('Failed to connect: %s', ex)
-        return [], 'Geen verbinding met Koala!'
+        return None, None, 'Geen verbinding met Koala!'
+
+    if response.status_code == 304 and headers:
+        logging.debug('Activities not modified, using cached response.')
+        return response, None, ''
 
     if response.status_code != 200:
         logging.error('HTTP error: %s',
                       response.status_code)
         logging.error('Response content: %s', response.text)
-        return [], 'HTTP-fout: {}'.format(response.status_code)
+        return response, None, 'HTTP-fout: {}'.format(response.status_code)
 
     try:
-        raw_events = response.json()
+        return response, response.json(), ''
     except JSONDecodeError:
         logging.error('Invalid API output: %s', response.text)
-        return [], 'Onzin binnengekregen!'
-    result = []
-    for event in raw_events:
-        result.append((event['name'], build_when(event)))
+        return response, None, 'Onzin binnengekregen!'
 
+def get_events(session=None, cache=None, url=None):
+    '''
+    Retrieve upcoming events, as returned by Koala's API, without parsing
+    them. See :class:`infozuild.eventstore.EventStore` to show them.
+
+    Args:
+        session (requests.Session): as for :func:`get_activities`.
+        cache (ResponseCache): as for :func:`get_activities`. If Koala reports
+            no changes, the cached list of events itself is returned.
+        url (str): the URL to retrieve instead of :data:`API_URL`.
+
+    Returns:
+        A list of event dicts and an optional string containing an error
+        code. The list will be empty if events could not be retrieved.
+    '''
+    response, events, error = _fetch_events(session, cache, url)
+    if error:
+        return [], error
+    if events is None:
+        return cache.events, ''
+    if cache is not None:
+        cache.store(response, events)
+    return events, ''
+
+def get_activities(session=None, cache=None, limit=None):
+    '''
+    Retrieve upcoming activities and parse the received data into the format to
+    be used on the display.
+
+    Args:
+        session (requests.Session): the session to make the request with,
+            :func:`get_session` if omitted.
+        cache (ResponseCache): an optional cache of the last response. If
+            given, the request is made conditional, and the activities parsed
+            from the cached response are reused if Koala reports no changes.
+        limit (int): the maximum number of events to return, as for
+            :func:`make_rotation`. Events past the limit are not parsed at all.
+
+    Returns:
+        A list of (*name*, *date*) tuples and an optional string containing an
+        error code. The list of events will be empty if events could not be
+        retrieved.
+    '''
+    response, raw_events, error = _fetch_events(session, cache)
+    if error:
+        return [], error
+    if raw_events is None:
+        return cache.get_activities(limit), ''
+
+    result = list(parse_activities(raw_events[0:limit]))
+    if cache is not None:
+        cache.store(response, raw_events, result, limit)
     return result, ''
 
+def parse_activities(events, today=None):
+    '''
+    Lazily turn events as returned by Koala into (*name*, *date*) tuples, see
+    :func:`build_when`. Only the events that are consumed are parsed, so
+    :func:`itertools.islice` or slicing *events* beforehand avoids the date
+    parsing for events that will not be shown.
+    '''
+    for event in events:
+        yield event['name'], build_when(event, today)
+
+class ResponseCache:
+    '''
+    Remembers the last successful response from Koala, so the next request can
+    be made conditional with its ``ETag`` and ``Last-Modified`` headers.
+
+    When Koala answers ``304 Not Modified``, the activities parsed from the
+    cached events are reused without parsing anything. They are only built
+    again from the cached events when the day or the limit changed, as the
+    'when' strings of :func:`build_when` depend on the current date.
+
+    Args:
+        path (str): an optional file to keep the cache in, so it survives a
+            restart. It is read on creation and replaced on every change.
+    '''
+
+    def __init__(self, path=None):
+        self.path = path
+        self.etag = None
+        self.last_modified = None
+        self.events = None
+        self.activities = None
+        self.day = None
+        self.limit = None
+        if path:
+            self.load()
+
+    def request_headers(self):
+        ''' Return the headers that make a request conditional on the cached response. '''
+        headers = {}
+        if self.events is None:
+            return headers
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+    def store(self, response, events, activities=None, limit=None):
+        '''
+        Remember a successful *response*, its raw *events* and the *activities*
+        parsed from them with *limit*. If no activities are given, they are
+        parsed when they are first asked for.
+        '''
+        self.etag = response.headers.get('ETag')
+        self.last_modified = response.headers.get('Last-Modified')
+        self.events = events
+        self.activities = activities
+        self.day = datetime.date.today() if activities is not None else None
+        self.limit = limit
+        self.save()
+
+    def get_activities(self, limit=None):
+        '''
+        Return the cached activities, rebuilt from the cached events if they
+        are from another day or were parsed with another *limit*.
+        '''
+        today = datetime.date.today()
+        if self.activities is None or self.day != today or self.limit != limit:
+            events = self.events[0:limit]
+            self.activities = list(zip([event['name'] for event in events],
+                                       build_when_many(events, today)))
+            self.day = today
+            self.limit = limit
+            self.save()
+        return self.activities
+
+    def load(self):
+        ''' Read the cache from :attr:`path`, leaving it empty if that fails. '''
+        try:
+            with open(self.path) as cache_file:
+                data = json.load(cache_file)
+            events = data['events']
+            activities, day = data['activities'], data['day']
+            if activities is not None:
+                activities = [tuple(activity) for activity in activities]
+                day = datetime.datetime.strptime(day, '%Y-%m-%d').date()
+            limit = data.get('limit')
+        except FileNotFoundError:
+            return
+        except (ValueError, KeyError, TypeError) as ex:
+            logging.warning('Ignoring unreadable response cache %s: %s', self.path, ex)
+            return
+        self.etag = data.get('etag')
+        self.last_modified = data.get('last_modified')
+        self.events, self.activities, self.day, self.limit = events, activities, day, limit
+
+    def save(self):
+        ''' Atomically replace the file at :attr:`path` with the cache, if a path was given. '''
+        if not self.path or self.events is None:
+            return
+        data = {
+            'etag': self.etag,
+            'last_modified': self.last_modified,
+            'events': self.events,
+            'activities': self.activities,
+            'day': self.day and self.day.isoformat(),
+            'limit': self.limit,
+            }
+        try:
+            replace_json(self.path, data)
+        except OSError as ex:
+            logging.warning('Could not save response cache %s: %s', self.path, ex)
+
+def replace_json(path, data):
+    '''
+    Atomically replace the file at *path* with *data* as JSON, by writing a
+    temporary file next to it first, so a crash never leaves half a file.
+
+    Raises:
+        :exc:`OSError` if the file could not be written.
+    '''
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as output_file:
+        json.dump(data, output_file)
+    os.replace(temp_path, path)
+
 def no_secs(time):
     ''' Force a :class:`datetime.datetime` to a string, with the seconds removed. '''
     return time.strftime("%H:%M")
 
+_ISO_DATE = re.compile(
+    r'(\d{4})-(\d\d)-(\d\d)'
+    r'(?:T(\d\d):(\d\d)(?::(\d\d)(?:\.(\d{1,6})\d*)?)?(Z|[+-]\d\d:?\d\d)?)?$')
+
+def parse_date(value):
+    '''
+    Parse a date, or a date and time, in the ISO 8601 format that Koala uses.
+    Anything else is left to :func:`dateutil.parser.parse`.
+
+    Returns:
+        A :class:`datetime.datetime`, with a fixed offset timezone if *value* has one.
+    '''
+    match = _ISO_DATE.match(value)
+    if match is None:
+        return dateutil.parser.parse(value)
+
+    year, month, day, hour, minute, second, fraction, zone = match.groups()
+    tzinfo = None
+    if zone == 'Z':
+        tzinfo = datetime.timezone.utc
+    elif zone:
+        offset = datetime.timedelta(hours=int(zone[1:3]), minutes=int(zone[-2:]))
+        tzinfo = datetime.timezone(-offset if zone[0] == '-' else offset)
+    return datetime.datetime(int(year), int(month), int(day), int(hour or 0),
+                             int(minute or 0), int(second or 0),
+                             int((fraction or '0').ljust(6, '0')), tzinfo)
+
 def build_when(event, today=None):
     '''
     Args:
@@ -78,41 +350,109 @@ def build_when(event, today=None):
     Returns:
         A string that contains just enough information to inform the viewer
         when an event will take place.
+
+    Results are memoized per start date, end date and day, as events rarely
+    change between updates. The memo is cleared when the day changes.
     '''
+    global _WHEN_DAY # pylint: disable=global-statement
+    if not today:
+        today = datetime.date.today()
+        if today != _WHEN_DAY:
+            _build_when.cache_clear()
+            _WHEN_DAY = today
+    return _build_when(event['start_date'], event.get('end_date'), today)
 
-    start = dateutil.parser.parse(event['start_date'])
-    start_date = start.date().strftime(ACTIVITY_DATE_FORMAT)
-    start_time = no_secs(start)
+_WHEN_DAY = None
 
-    if 'end_date' not in event: #1
-        return start_date
+@functools.lru_cache(maxsize=1024)
+def _build_when(start_string, end_string, today):
+    ''' Build the 'when' string for :func:`build_when`. '''
+    end = None if end_string is None else _when_parts(end_string)
+    return _format_when(_when_parts(start_string), end, today)
 
-    end = dateutil.parser.parse(event['end_date'])
-    end_date = end.date().strftime(ACTIVITY_DATE_FORMAT)
-    end_time = no_secs(end)
+def build_when_many(events, today=None):
+    '''
+    Build the 'when' strings for many events at once, exactly as
+    :func:`build_when` would for each of them.
 
+    Every distinct date string is parsed only once, and every distinct day
+    formatted only once, which pays off for long feeds in which many events
+    share days, such as when all events are rendered again on a new day.
+
+    Args:
+        events (list): dicts as returned by Koala's API.
+        today (datetime.date): as for :func:`build_when`.
+
+    Returns:
+        A list with the 'when' string of every event.
+    '''
     if not today:
         today = datetime.date.today()
 
-    starts_today = today == start.date()
-    multiday = start.date() != end.date()
+    days = {}
+    parts = {None: None}
+    result = []
+    for event in events:
+        start_string = event['start_date']
+        end_string = event.get('end_date')
+        for value in (start_string, end_string):
+            if value not in parts:
+                parts[value] = _when_parts(value, days)
+        result.append(_format_when(parts[start_string], parts[end_string], today))
+    return result
+
+def _when_parts(value, days=None):
+    '''
+    Parse a date string from Koala into the parts that are shown.
+
+    Args:
+        value (str): the date string.
+        days (dict): formatted days by date, filled in and reused if given.
+
+    Returns:
+        A (*day*, *formatted day*, *formatted time*, *has time*) tuple.
+    '''
+    when = parse_date(value)
+    day = when.date()
+    formatted = None if days is None else days.get(day)
+    if formatted is None:
+        formatted = day.strftime(ACTIVITY_DATE_FORMAT)
+        if days is not None:
+            days[day] = formatted
+    return day, formatted, no_secs(when), 'T' in value
+
+def _format_when(start, end, today):
+    '''
+    Choose and format the 'when' string from the :func:`_when_parts` of the
+    start and end date, see :func:`build_when`. *end* is None if the event
+    has no end date.
+    '''
+    start_day, start_date, start_time, start_has_time = start
+
+    if end is None: #1
+        return start_date
+
+    end_day, end_date, end_time, end_has_time = end
+
+    starts_today = today == start_day
+    multiday = start_day != end_day
 
     start_date_n2d = start_date + ' ' if not starts_today else '' # n2d == not today
 
     if not multiday:
-        if 'T' not in event['start_date']: #2
+        if not start_has_time: #2
             return start_date
 
-        if 'T' not in event['end_date']: #3
+        if not end_has_time: #3
             return "{}{}".format(start_date_n2d, start_time)
 
         else: #4
             return "{}{}~{}".format(start_date_n2d, start_time, end_time)
 
-    if 'T' not in event['start_date']: #5
+    if not start_has_time: #5
         return "{}~{}".format(start_date, end_date)
 
-    if 'T' not in event['end_date']: #6
+    if not end_has_time: #6
         return "{} {}~{}".format(start_date, start_time, end_date)
 
     return "{} {} ~ {} {}".format(start_date, start_time, end_date, end_time) #7
@@ -150,9 +490,8 @@ def make_rotation(activities=None, motd=None, limit_activities=None):
     rota = Rotation()
 
     # Retrieve activities if we didn't get pre-retrieved ones.
-    if not activities and activities is not []:
-        activities, _ = get_activities()
-        activities = activities[0:limit_activities]
+    if activities is None:
+        activities, _ = get_activities(limit=limit_activities)
         if not activities:
             logging.warning('No activities were left after limit.')
 
@@ -182,8 +521,7 @@ def make_rotation(activities=None, motd=None, limit_activities=None):
         lines = [TOP_LINE]
 
         for activity in group: # activities are (name, date) tuples
-            name = unidecode.unidecode(activity[0])
-            lines.append(name)
+            lines.append(activity[0])
             lines.append(format(activity[1], ALIGN_RIGHT))
 
         # Add empty lines until we've got 7 lines, and then page number
@@ -197,9 +535,77 @@ def make_rotation(activities=None, motd=None, limit_activities=None):
 
     return rota
 
+def content_digest(rotation, cache=None):
+    '''
+    Return a digest of the content of a :class:`Rotation` made by
+    :func:`make_rotation`, ignoring the 'last updated' time on the info page.
+
+    Two rotations built at different moments from the same events and status
+    have the same digest, so the digest tells whether anything changed that
+    is worth sending.
+
+    Args:
+        rotation (Rotation): the rotation to digest.
+        cache (PageCache): an optional cache of encoded pages to reuse.
+    '''
+    pages = list(rotation.pages)
+    if pages and list(pages[0].lines[-2:-1]) == INFO_LINES[-2:-1]:
+        info_page = copy.copy(pages[0])
+        info_page.lines = info_page.lines[:-1]
+        pages[0] = info_page
+
+    content = Rotation(rotation.address, pages).to_bytes(cache)
+    return hashlib.sha1(content).hexdigest()
+
 def make_rotation_json(max_activities=None):
     ''' Convert the :class:`Rotation` returned by :func:`make_rotation` to a json string. '''
-    return make_rotation(max_activities).to_json()
+    return make_rotation(limit_activities=max_activities).to_json()
+
+def watch(interval, output, limit_activities=None, session=None, polls=None):
+    '''
+    Keep retrieving activities, and write the resulting :class:`Rotation` to
+    *output* as a line of JSON whenever its content changed, as determined by
+    :func:`content_digest`. The first rotation is always written. While
+    Koala cannot be reached, the last retrieved activities are kept, with the
+    error as status, as :command:`zuild` does.
+
+    Args:
+        interval (float): the number of seconds between the start of two retrievals.
+        output: a writable text file, which is flushed after every line.
+        limit_activities (int): as for :func:`make_rotation`.
+        session (requests.Session): the session to retrieve with,
+            :func:`get_session` if omitted. It is kept for all retrievals,
+            together with a :class:`ResponseCache`.
+        polls (int): the number of retrievals to do, or None to keep going forever.
+
+    Returns:
+        The number of rotations written.
+    '''
+    session = session or get_session()
+    cache = ResponseCache()
+    last_digest = None
+    written = 0
+    poll = 0
+    next_poll = time.monotonic()
+    while polls is None or poll < polls:
+        time.sleep(max(0, next_poll - time.monotonic()))
+        next_poll = time.monotonic() + interval
+        poll += 1
+
+        activities, error = get_activities(session, cache, limit_activities)
+        if error and cache.events is not None:
+            activities = cache.get_activities(limit_activities)
+        rotation = make_rotation(activities, blink(error) if error else None)
+        digest = content_digest(rotation)
+        if digest == last_digest:
+            logging.debug('Rotation unchanged.')
+            continue
+
+        last_digest = digest
+        output.write(rotation.to_json() + '\n')
+        output.flush()
+        written += 1
+    return written
 
 def main():
     '''
@@ -208,6 +614,7 @@ def main():
     :command:`zuil-get` retrieves the current activities, and outputs them in a
     JSON format parsable by :func:`infozuild.sendscript.Rotation.from_json`.
     '''
+    global API_URL # pylint: disable=global-statement
     parser = argparse.ArgumentParser(
         description='Retrieve events from Koala and output in JSON format suitable for the zuil.'
         )
@@ -217,9 +624,30 @@ def main():
     parser.add_argument(
         '--limit', '-l', type=int, default=None,
         help='limit the number of events displayed.')
+    parser.add_argument(
+        '--api-url', default=None,
+        help='retrieve the activities from this URL instead of Koala.')
+    parser.add_argument(
+        '--watch', '-w', type=float, default=None, metavar='INTERVAL',
+        help='keep retrieving every INTERVAL seconds, and output a line of JSON '
+        'whenever the rotation changed.')
 
     args = parser.parse_args()
 
+    if args.api_url:
+        API_URL = args.api_url
+
+    if args.watch is not None:
+        try:
+            if args.output:
+                with open(args.output, 'w') as outputfile:
+                    watch(args.watch, outputfile, args.limit)
+            else:
+                watch(args.watch, sys.stdout, args.limit)
+        except KeyboardInterrupt:
+            pass
+        return
+
     result = make_rotation_json(args.limit)
     if args.output:
         with open(args.output, 'w') as outputfile:
@@ -0,0 +1,258 @@
+'''
+infozuild.koala provides a local stand-in for Koala's activities API, so the
+getscript and the daemon can be exercised and benchmarked offline and
+deterministically.
+
+The stand-in serves a recorded response, which can be recorded from the real
+API with :func:`record`, or a list of events. It supports conditional requests
+with ``ETag`` and ``If-None-Match``, and can inject latency, 5xx responses and
+malformed JSON.
+
+The stand-in can be run independently, by using the command
+:command:`zuil-koala`, which calls :func:`main`. Point
+:data:`infozuild.getscript.API_URL` at it with :option:`zuil-get --api-url`
+or the ``ApiURL`` option of the daemon.
+'''
+import argparse
+import hashlib
+import http.server
+import json
+import logging
+import random
+import socketserver
+import threading
+import time
+
+import requests
+
+from . import __version__, getscript
+
+
+def record(path, url=None):
+    '''
+    Retrieve the activities from *url* (by default the real
+    :data:`infozuild.getscript.API_URL`) and save the response to *path*, in
+    the format read by :meth:`KoalaStandIn.from_recording`.
+    '''
+    response = requests.get(url or getscript.API_URL, timeout=30)
+    response.raise_for_status()
+    recording = {
+        'url': response.url,
+        'recorded': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'etag': response.headers.get('ETag'),
+        'body': response.text,
+        }
+    with open(path, 'w') as recording_file:
+        json.dump(recording, recording_file, indent=2)
+
+class KoalaStandIn(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    '''
+    An HTTP server standing in for Koala's activities API, which answers
+    every GET request with :attr:`body`.
+
+    Args:
+        address (tuple): the (*host*, *port*) to listen on. Port 0 picks a free port.
+        body (str): the response body to serve.
+        etag (str): the ``ETag`` to serve with the body, or None to derive
+            one from the body. Requests with a matching ``If-None-Match`` get a
+            ``304 Not Modified``.
+        etags (bool): whether to serve ETags and answer conditional requests.
+        latency (float): seconds to wait before answering.
+        error_rate (float): the fraction of requests answered with a ``503``.
+        malformed_rate (float): the fraction of requests answered with a
+            truncated body, which is not valid JSON.
+        seed: the seed for choosing which requests fail, so runs are repeatable.
+
+    Attributes:
+        requests (int): the number of requests received.
+        not_modified (int): the number of ``304`` answers.
+        errors (int): the number of injected errors and malformed bodies.
+    '''
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address=('localhost', 0), body='[]', etag=None, etags=True,
+                 latency=0, error_rate=0, malformed_rate=0, seed=None):
+        self.body = body
+        self.etag = etag
+        self.etags = etags
+        self.latency = latency
+        self.error_rate = error_rate
+        self.malformed_rate = malformed_rate
+
+        self.requests = 0
+        self.not_modified = 0
+        self.errors = 0
+
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._thread = None
+        super().__init__(address, _KoalaHandler)
+
+    @classmethod
+    def from_events(cls, events, **kwargs):
+        ''' Create a stand-in serving the list of event dicts *events*. '''
+        return cls(body=json.dumps(events), **kwargs)
+
+    @classmethod
+    def from_recording(cls, path, **kwargs):
+        ''' Create a stand-in replaying a response saved by :func:`record`. '''
+        with open(path) as recording_file:
+            recording = json.load(recording_file)
+        kwargs.setdefault('etag', recording.get('etag'))
+        return cls(body=recording['body'], **kwargs)
+
+    @property
+    def url(self):
+        ''' The URL of the stand-in, to use as :data:`infozuild.getscript.API_URL`. '''
+        return 'http://{}:{}/api/activities'.format(*self.server_address[:2])
+
+    @property
+    def body(self):
+        ''' The response body. Setting it changes the derived ETag, as a change on Koala would. '''
+        return self._body
+
+    @body.setter
+    def body(self, body):
+        self._body = body
+        self._body_etag = '"{}"'.format(hashlib.sha1(body.encode()).hexdigest())
+
+    def current_etag(self):
+        ''' Return the ETag that is served with the body, or None if ETags are disabled. '''
+        if not self.etags:
+            return None
+        return self.etag or self._body_etag
+
+    def choose(self):
+        '''
+        Count a request and decide how to answer it.
+
+        Returns:
+            ``'error'``, ``'malformed'`` or ``'ok'``.
+        '''
+        with self._lock:
+            self.requests += 1
+            chance = self._random.random()
+            if chance < self.error_rate:
+                self.errors += 1
+                return 'error'
+            if chance < self.error_rate + self.malformed_rate:
+                self.errors += 1
+                return 'malformed'
+            return 'ok'
+
+    def start(self):
+        ''' Start serving in a background thread. '''
+        self._thread = threading.Thread(target=self.serve_forever, name='zuil-koala',
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        ''' Stop serving and close the listening socket. '''
+        if self._thread is not None:
+            self.shutdown()
+            self._thread.join()
+            self._thread = None
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+class _KoalaHandler(http.server.BaseHTTPRequestHandler):
+    ''' Handles one request to the :class:`KoalaStandIn`. '''
+    protocol_version = 'HTTP/1.1' # Allows keep-alive, as Koala does.
+
+    def do_GET(self): # pylint: disable=invalid-name
+        ''' Answer with the body, a 304, or an injected failure. '''
+        server = self.server
+        outcome = server.choose()
+        if server.latency:
+            time.sleep(server.latency)
+
+        if outcome == 'error':
+            self.respond(503, b'Service Unavailable', 'text/plain')
+            return
+
+        body, etag = server.body, server.current_etag()
+        if outcome == 'ok' and etag and self.headers.get('If-None-Match') == etag:
+            with server._lock: # pylint: disable=protected-access
+                server.not_modified += 1
+            self.respond(304, b'', etag=etag)
+            return
+
+        data = body.encode()
+        if outcome == 'malformed':
+            data = data[:len(data) // 2] or b'{'
+        self.respond(200, data, 'application/json', etag)
+
+    def respond(self, status, data, content_type=None, etag=None):
+        ''' Send a complete response. '''
+        self.send_response(status)
+        if content_type:
+            self.send_header('Content-Type', content_type)
+        if etag:
+            self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, fmt, *args): # pylint: disable=arguments-differ
+        logging.debug('Koala stand-in: ' + fmt, *args)
+
+def main():
+    '''
+    :command:`zuil-koala` entrypoint.
+
+    Records the real API to a file, or serves a recording until interrupted.
+    '''
+    parser = argparse.ArgumentParser(
+        description="Stand in for Koala's activities API, for testing without network.")
+    parser.add_argument('--version', action='version',
+                        version='infozuild {}'.format(__version__))
+    parser.add_argument('recording',
+                        help='JSON file with a recorded response')
+    parser.add_argument('--record', action='store_true',
+                        help='record the real API to the file, instead of serving it')
+    parser.add_argument('--host', default='localhost',
+                        help='address to listen on')
+    parser.add_argument('--port', '-p', type=int, default=8023,
+                        help='port to listen on')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='seconds to wait before answering')
+    parser.add_argument('--error-rate', type=float, default=0,
+                        help='fraction of requests answered with a 503')
+    parser.add_argument('--malformed-rate', type=float, default=0,
+                        help='fraction of requests answered with malformed JSON')
+    parser.add_argument('--no-etag', action='store_true',
+                        help='always answer with the full body')
+    parser.add_argument('--seed', type=int, default=None,
+                        help='seed for the injected failures')
+
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.INFO)
+
+    if args.record:
+        record(args.recording)
+        logging.info('Recorded to %s', args.recording)
+        return
+
+    standin = KoalaStandIn.from_recording(
+        args.recording, address=(args.host, args.port), latency=args.latency,
+        etags=not args.no_etag, error_rate=args.error_rate,
+        malformed_rate=args.malformed_rate, seed=args.seed)
+    logging.info('Serving %s at %s', args.recording, standin.url)
+    try:
+        standin.start()
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        standin.stop()
+
+if __name__ == '__main__':
+    main()
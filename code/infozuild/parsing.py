@@ -0,0 +1,192 @@
+'''
+infozuild.parsing decodes control strings, as sent to the controller, back
+into the :class:`~infozuild.sendscript.Rotation`, :class:`~infozuild.sendscript.DisplayMode`
+and :class:`~infozuild.sendscript.RtcUpdate` instructions they contain.
+'''
+import datetime
+import math
+import mmap
+import os
+import re
+
+from .sendscript import (decode_value, DisplayMode, Page, Rotation, RtcUpdate,
+                         B_BLINKSPEED, SYN)
+
+
+_START = re.compile(b'\x01(.)\x1c', re.DOTALL) # SOH enc(address) FS
+_FIELD = re.compile(b'([^\x1c\r]*)([\x1c\r])') # Field, terminated by FS or CR
+_ESC_BYTE = B_BLINKSPEED[0]
+_SYN_FIELD = SYN.encode()
+_ZERO = ord('0')
+
+_PAGE_ATTRIBUTES = {
+    ord('A'): 'duration',
+    ord('B'): 'blinkspeed',
+    ord('P'): 'schedular',
+    ord('Q'): 'brightness',
+    ord('R'): 'scrolling',
+    ord('S'): 'fading',
+    }
+
+# The values of attributes that are omitted when encoding a Page.
+_NOT_SENT = {'blinkspeed': 0, 'schedular': None, 'brightness': 0,
+             'scrolling': False, 'fading': False}
+
+def _attribute_value(name, data, start, end):
+    ''' Decode the value of attribute *name*, stored in ``data[start:end]``. '''
+    if name == 'duration':
+        # pylint: disable=invalid-name
+        a, b, c, d = (data[index] - 32 for index in range(start, start + 4))
+        # Round up, so re-encoding gives the same number of ticks. Durations
+        # under a tick encode to 0 ticks, but a page lasts at least 1 ms.
+        return max(1, math.ceil((a * 4096 + b * 256 + c * 16 + d) * 26.7))
+    if name == 'schedular':
+        # Values may exceed one byte, see Page.build_schedular.
+        values = [decode_value(char) for char in bytes(data[start:end]).decode()]
+        year, month, _, day, hour, minute, second = values
+        return datetime.datetime(year, month, day, hour, minute, second)
+    if name in ('scrolling', 'fading'):
+        return bool(data[start] - 32)
+    return data[start] - 32
+
+def _build_page(lines, attributes, previous, inherit):
+    ''' Create a Page from decoded lines and the attributes that were present. '''
+    page = Page(lines)
+    if inherit:
+        values = dict(previous)
+        values.update(attributes)
+    else:
+        values = dict(_NOT_SENT)
+        values.update(attributes)
+    for name, value in values.items():
+        setattr(page, name, value)
+    return page
+
+def _effective(page):
+    ''' Return the attribute values of *page* that the next page may inherit. '''
+    return {name: getattr(page, name) for name in Page._attributes}
+
+def iter_controlstrings(data, inherit=False):
+    '''
+    Decode all control strings in *data*, in one pass.
+
+    *data* may be :class:`bytes`, :class:`bytearray`, a :class:`memoryview` or
+    a :class:`mmap.mmap`. It is scanned in place, only the text of lines is
+    copied out.
+
+    Args:
+        data: the buffer containing one or more control strings.
+        inherit (bool): if `False`, attributes that are absent for a page get
+            the value that makes :meth:`Page.to_controlstring` omit them
+            again. If `True`, they get the value in effect from the previous
+            page instead (or the :class:`Page` default for the first page),
+            which is what the controller will display.
+
+    Yields:
+        :class:`Rotation`, :class:`DisplayMode` and :class:`RtcUpdate`
+        instances, in the order they appear.
+
+    Raises:
+        :exc:`ValueError` if a control string is malformed.
+    '''
+    pos = 0
+    while True:
+        start = _START.search(data, pos)
+        if start is None:
+            return
+
+        address = start.group(1)[0] - 32
+        pos = start.end()
+        fields = []
+        while True:
+            field = _FIELD.match(data, pos)
+            if field is None:
+                raise ValueError('Unterminated control string at offset', start.start())
+            pos = field.end()
+            if field.end(1) > field.start(1) or field.group(2) == b'\x1c':
+                fields.append(field.span(1))
+            if field.group(2) == b'\r':
+                break
+
+        yield _decode(data, address, fields, inherit, start.start())
+
+def _decode(data, address, fields, inherit, offset):
+    ''' Decode the fields of one control string. '''
+    if fields and data[fields[0][0]] == _ESC_BYTE:
+        code = data[fields[0][0] + 1]
+        begin = fields[0][0] + 2
+        if code == ord('T'):
+            year, month, _, day, hour, minute, second = (
+                data[index] - 32 for index in range(begin, begin + 7))
+            return RtcUpdate(datetime.datetime(year + 1980, month, day, hour, minute, second),
+                             address)
+        if code == ord('D'):
+            return DisplayMode(data[begin] - 32, address)
+
+    if not fields or data[fields[-1][0]:fields[-1][1]] != _SYN_FIELD:
+        raise ValueError('Unknown control string at offset', offset)
+
+    rotation = Rotation(address)
+    previous = _effective(Page())
+    lines, attributes, last_line = None, {}, 8
+    for begin, end in fields[:-1]:
+        if data[begin] == _ESC_BYTE:
+            name = _PAGE_ATTRIBUTES.get(data[begin + 1])
+            if name is None:
+                raise ValueError('Unknown page attribute at offset', begin)
+            attributes[name] = _attribute_value(name, data, begin + 2, end)
+            last_line = 8 # Lines after attributes belong to the next page
+            if lines is None:
+                lines = [''] * 8
+            continue
+
+        line = data[begin] - _ZERO if end > begin else -1
+        if not 0 <= line <= 7:
+            raise ValueError('Invalid line number at offset', begin)
+        if line <= last_line:
+            if lines is not None:
+                rotation.pages.append(_build_page(lines, attributes, previous, inherit))
+                previous = _effective(rotation.pages[-1])
+            lines, attributes = [''] * 8, {}
+        lines[line] = bytes(data[begin + 1:end]).decode('latin-1')
+        last_line = line
+
+    if lines is not None:
+        rotation.pages.append(_build_page(lines, attributes, previous, inherit))
+    return rotation
+
+def parse_rotation(data, inherit=False):
+    '''
+    Decode the first text control string in *data* into a :class:`Rotation`.
+    See :func:`iter_controlstrings` for the arguments.
+
+    Raises:
+        :exc:`ValueError` if *data* contains no valid text control string.
+    '''
+    for instruction in iter_controlstrings(data, inherit):
+        if isinstance(instruction, Rotation):
+            return instruction
+    raise ValueError('No text control string found')
+
+def parse_controlstring(data, inherit=False):
+    '''
+    Decode all control strings in *data*, see :func:`iter_controlstrings`.
+
+    Returns:
+        A list of :class:`Rotation`, :class:`DisplayMode` and :class:`RtcUpdate` instances.
+    '''
+    return list(iter_controlstrings(data, inherit))
+
+def parse_controlstring_file(path, inherit=False):
+    '''
+    Decode all control strings in the file at *path*, such as one written by
+    :command:`zuil-send --output`. The file is memory-mapped instead of read.
+
+    Returns:
+        A list of :class:`Rotation`, :class:`DisplayMode` and :class:`RtcUpdate` instances.
+    '''
+    with open(path, 'rb') as archive:
+        if not os.fstat(archive.fileno()).st_size:
+            return []
+        with mmap.mmap(archive.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return parse_controlstring(data, inherit)
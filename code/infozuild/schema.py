@@ -0,0 +1,114 @@
+'''
+infozuild.schema checks rotation dicts, as read from JSON, against the schema
+of :class:`~infozuild.sendscript.Rotation` in a single pass, so every problem
+in a rotation file is reported at once instead of only the first.
+'''
+import datetime
+
+
+class RotationError(ValueError):
+    '''
+    Raised when a rotation dict does not match the schema.
+
+    Attributes:
+        errors (list): (*path*, *message*) tuples for every problem found,
+            with JSON paths such as ``$.pages[2].brightness``.
+    '''
+    def __init__(self, errors):
+        super().__init__('{} error(s) in rotation: {}'.format(
+            len(errors), '; '.join('{} {}'.format(path, message) for path, message in errors)))
+        self.errors = errors
+
+def _integer(low, high, optional=True):
+    ''' Compile a check for an integer from *low* to *high*, or None if *optional*. '''
+    message = 'must be an integer from {} to {}'.format(low, high)
+    if optional:
+        message += ', or null'
+
+    def check(value):
+        ''' Return an error message if *value* is not allowed. '''
+        if value is None and optional:
+            return None
+        # pylint: disable=unidiomatic-typecheck
+        if type(value) is not int or not low <= value <= high:
+            return message
+        return None
+    return check
+
+def _boolean(value):
+    ''' Return an error message if *value* is not a boolean or None. '''
+    if value is not None and not isinstance(value, bool):
+        return 'must be true, false or null'
+    return None
+
+def _schedular(value):
+    ''' Return an error message if *value* is not a valid schedular or None. '''
+    if not value:
+        return None
+    if not isinstance(value, datetime.datetime):
+        return 'must be a datetime or null'
+    if not 1980 <= value.year <= 2075:
+        return 'must have a year from 1980 to 2075'
+    return None
+
+def _lines(value):
+    ''' Return an error message if *value* is not a list of at most 8 strings. '''
+    if not isinstance(value, list) or len(value) > 8:
+        return 'must be a list of at most 8 strings'
+    for line in value:
+        if not isinstance(line, str):
+            return 'must be a list of at most 8 strings'
+    return None
+
+_ADDRESS_CHECK = _integer(0, 31, optional=False)
+_PAGE_CHECKS = {
+    'lines': _lines,
+    'blinkspeed': _integer(0, 4),
+    'duration': _integer(1, 218450),
+    'schedular': _schedular,
+    'brightness': _integer(0, 17),
+    'scrolling': _boolean,
+    'fading': _boolean,
+    }
+
+def validate_rotation(data):
+    '''
+    Check a rotation dict, as accepted by :meth:`~infozuild.sendscript.Rotation.from_dict`, against
+    the schema in a single pass.
+
+    Returns:
+        A list of (*path*, *message*) tuples for every problem found, which
+        is empty if *data* is valid.
+    '''
+    if not isinstance(data, dict):
+        return [('$', 'must be an object')]
+
+    errors = []
+    if 'address' not in data:
+        errors.append(('$.address', 'is required'))
+    else:
+        message = _ADDRESS_CHECK(data['address'])
+        if message:
+            errors.append(('$.address', message))
+
+    pages = data.get('pages')
+    if not isinstance(pages, list):
+        errors.append(('$.pages', 'is required' if pages is None else 'must be a list'))
+        return errors
+
+    checks = _PAGE_CHECKS
+    for num, page in enumerate(pages):
+        if not isinstance(page, dict):
+            errors.append(('$.pages[{}]'.format(num), 'must be an object'))
+            continue
+        if 'lines' not in page:
+            errors.append(('$.pages[{}].lines'.format(num), 'is required'))
+        for key, value in page.items():
+            check = checks.get(key)
+            if check is None: # Unknown keys are ignored, as by Page.from_dict
+                continue
+            message = check(value)
+            if message:
+                errors.append(('$.pages[{}].{}'.format(num, key), message))
+
+    return errors
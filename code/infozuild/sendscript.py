@@ -1,19 +1,18 @@
 '''
 The sendscript contains the relevant code to generate a controlstring from a
-list of lines and send it to the zuil.
+list of lines. Sending it to the zuil is done by :mod:`infozuild.controller`.
 '''
 
-import argparse
-import configparser
+import collections
 import datetime
+import functools
 import json
 import logging
 import math
-import os
-import socket
-import sys
 
-from . import __version__
+import unidecode
+
+from .schema import RotationError, validate_rotation
 
 
 def encode_value(value):
@@ -34,6 +33,9 @@ def check_in_range(*items):
         additional values are not checked.
     '''
     for item in items:
+        if type(item[1]) is int: # pylint: disable=unidiomatic-typecheck
+            if item[2] <= item[1] <= item[3]:
+                continue
         if item[1] not in range(item[2], item[3]+1):
             raise ValueError('Argument out of range: ', item[0], '=', item[1],
                              ', min=', item[2], ', max=', item[3])
@@ -47,6 +49,74 @@ ESC = chr(27)   # Escape
 FS = chr(28)    # Field Seperator
 GS = chr(29)    # Blink
 
+## Precomputed byte fragments, used by the bytes encoder.
+ENCODED_VALUES = tuple(encode_value(value).encode() for value in range(96))
+''' ``ENCODED_VALUES[value] == encode_value(value).encode()`` for 0 <= `value` <= 95. '''
+
+B_SOH = SOH.encode()
+B_FS = FS.encode()
+B_TRAILER = (SYN + CR).encode()
+B_LINE_NUMBERS = tuple(str(num).encode() for num in range(8))
+B_EMPTY_LINES = tuple(str(num).encode() + B_FS for num in range(8))
+B_BLINKSPEED = (ESC + 'B').encode()
+B_DURATION = (ESC + 'A').encode()
+B_SCHEDULAR = (ESC + 'P').encode()
+B_BRIGHTNESS = (ESC + 'Q').encode()
+B_SCROLLING_ON = (ESC + 'R').encode() + ENCODED_VALUES[1] + B_FS
+B_FADING_ON = (ESC + 'S').encode() + ENCODED_VALUES[1] + B_FS
+
+def encode_value_bytes(value):
+    ''' Convert a numeric value to a single byte, using :data:`ENCODED_VALUES` when possible. '''
+    if 0 <= value < 96:
+        return ENCODED_VALUES[value]
+    return encode_value(value).encode()
+
+## Controller character set
+class _Transliterations(dict):
+    '''
+    A :meth:`str.translate` table to the character set of the controller,
+    which is printable ASCII plus the :data:`SO` and :data:`GS` codes. It is
+    filled for ASCII up front, and for other characters on first use, with
+    their :func:`unidecode.unidecode` transliteration.
+    '''
+    def __init__(self):
+        super().__init__((code, chr(code)) for code in range(32, 127))
+        self.update((code, '') for code in range(32))
+        self.update({ord(SO): SO, ord(GS): GS, ord('\t'): ' ', 127: ''})
+
+    def __missing__(self, code):
+        value = self[code] = unidecode.unidecode(chr(code)).translate(self)
+        return value
+
+_TRANSLITERATIONS = _Transliterations()
+_TAB_TO_SPACE = bytes.maketrans(b'\t', b' ')
+_LEFT_OUT = bytes(code for code, value in _TRANSLITERATIONS.items() if value == '')
+
+def encode_text(text):
+    '''
+    Encode a line of text in the character set of the controller, with
+    exactly one byte per character.
+
+    Characters outside ASCII are transliterated (``'é'`` becomes ``'e'``), and
+    control characters other than the bold and blink codes are left out, as
+    they could end the line or control string early.
+
+    Returns:
+        The encoded :class:`bytes`.
+    '''
+    try:
+        return text.encode('ascii').translate(_TAB_TO_SPACE, _LEFT_OUT)
+    except UnicodeEncodeError:
+        return _transliterate(text)
+
+@functools.lru_cache(maxsize=1024)
+def _transliterate(text):
+    '''
+    Encode text with characters outside ASCII for :func:`encode_text`. The
+    results are cached, as the same names are sent again on every update.
+    '''
+    return text.translate(_TRANSLITERATIONS).encode('ascii')
+
 def blink(text):
     ''' Enclose the given text with the blink escape code. '''
     if text:
@@ -142,16 +212,50 @@ def set_rtc(address=0, when=None):
 
     return result
 
+class RtcUpdate:
+    '''
+    Represents an instruction to set the controller's RTC, as produced by
+    :func:`set_rtc`.
+
+    Attributes:
+        address (int): the controller index.
+        when (datetime.datetime): the new value of the RTC.
+    '''
+
+    def __init__(self, when, address=0):
+        self.address = int(address)
+        self.when = when
+
+    def to_controlstring(self):
+        ''' Generate the control string, see :func:`set_rtc`. '''
+        return set_rtc(self.address, self.when)
+
 ## Page-related classes
+def _changes(state, name, value):
+    '''
+    Return whether attribute *name* must be sent to get *value* in effect,
+    given the controller *state* (None if unknown), and update *state*.
+    '''
+    if state is None:
+        return True
+    if name in state and state[name] == value:
+        return False
+    state[name] = value
+    return True
+
 class Page:
     '''
     Represents one screenful of text. All attributes may be `None` to inherit
     the setting used by the previous Page.
 
+    Attributes are validated when they are assigned, so a Page can always be
+    encoded without checking it again. Assigning a value that is out of range
+    raises :exc:`ValueError`.
+
     Attributes:
-        lines (list):
-            a list of strings containing the text to display. Should contain 8
-            strings when sending.
+        lines (tuple):
+            the strings containing the text to display, at most 8. Assigned
+            lists are stored as a tuple, so they cannot change unchecked.
 
         blinkspeed (int):
             an optional integer controlling the duration of the transition to
@@ -161,7 +265,10 @@ class Page:
             an optional integer controlling the time the controller waits until
             advancing to the next page, in milliseconds. Due to a quirk in the
             encoding, the set value will be rounded to ``floor(duration/26.7)``
-            on sending. 0 <= `duration` <= 218450.
+            on sending. 1 <= `duration` <= 218450.
+
+        schedular (datetime.datetime):
+            an optional date and time with an unknown meaning, see :doc:`protocol`.
 
         brightness (int):
             an optional integer controlling the brightness of the leds for this
@@ -173,22 +280,90 @@ class Page:
         fading (bool):
             A boolean that will, if `True`, make the contents of the page fade in and out.
     '''
+    __slots__ = ('_lines', '_encoded_lines', '_blinkspeed', '_duration', '_schedular',
+                 '_brightness', 'scrolling', 'fading')
+
     _attributes = ['blinkspeed', 'duration', 'schedular', 'brightness',
                    'scrolling', 'fading']
 
     def __init__(self, lines=None):
         ''' Initialize a new page with the given text and default attributes. '''
-        self.lines = lines or []
-        self.blinkspeed = 1
-        self.duration = 10000
-        self.schedular = None
-        self.brightness = 17
+        self.lines = lines or ()
+        # The defaults are known to be valid.
+        self._blinkspeed = 1
+        self._duration = 10000
+        self._schedular = None
+        self._brightness = 17
         self.scrolling = False
         self.fading = False
 
+    # Validated attributes
+    @property
+    def lines(self):
+        ''' The text to display, see :class:`Page`. '''
+        return self._lines
+
+    @lines.setter
+    def lines(self, lines):
+        lines = tuple(lines)
+        check_in_range(('Line amount', len(lines), 0, 8))
+        self._lines = lines
+        self._encoded_lines = None
+
+    @property
+    def blinkspeed(self):
+        ''' The transition duration, see :class:`Page`. '''
+        return self._blinkspeed
+
+    @blinkspeed.setter
+    def blinkspeed(self, blinkspeed):
+        if blinkspeed is not None:
+            check_in_range(('Blink speed', blinkspeed, 0, 4))
+        self._blinkspeed = blinkspeed
+
+    @property
+    def duration(self):
+        ''' The time this page is shown, see :class:`Page`. '''
+        return self._duration
+
+    @duration.setter
+    def duration(self, duration):
+        if duration is not None:
+            check_in_range(('Duration', duration, 1, 218450))
+        self._duration = duration
+
+    @property
+    def schedular(self):
+        ''' The schedular, see :class:`Page`. '''
+        return self._schedular
+
+    @schedular.setter
+    def schedular(self, schedular):
+        if schedular:
+            check_in_range(
+                ('Year', schedular.year, 1980, 2075),
+                ('Month', schedular.month, 1, 12),
+                ('Day', schedular.day, 1, 31),
+                ('Hour', schedular.hour, 0, 23),
+                ('Minute', schedular.minute, 0, 59),
+                ('Second', schedular.second, 0, 59)
+            )
+        self._schedular = schedular
+
+    @property
+    def brightness(self):
+        ''' The brightness of the leds, see :class:`Page`. '''
+        return self._brightness
+
+    @brightness.setter
+    def brightness(self, brightness):
+        if brightness is not None:
+            check_in_range(('Brightness', brightness, 0, 17))
+        self._brightness = brightness
+
     # Attribute encoding
-    def build_duration(self):
-        ''' Return 4 characters representing the duration of this page. '''
+    def duration_values(self):
+        ''' Return the 4 numeric values that encode the duration of this page. '''
         i = math.floor(self.duration / 26.7)
 
         # pylint: disable=invalid-name
@@ -200,77 +375,113 @@ class Page:
         i %= 16
         d = i
 
+        return a, b, c, d
+
+    def build_duration(self):
+        ''' Return 4 characters representing the duration of this page. '''
+        # pylint: disable=invalid-name
+        a, b, c, d = self.duration_values()
+
         enc = encode_value
         result = enc(a) + enc(b) + enc(c) + enc(d)
         logging.debug('duration: %s %s %s %s', a, b, c, d)
         logging.debug(result)
         return result
 
+    def schedular_values(self):
+        ''' Return the 7 numeric values that encode the schedular. '''
+        sch = self.schedular
+        return (sch.year, sch.month, 0, sch.day, sch.hour, sch.minute,
+                sch.second)
+
     def build_schedular(self):
         ''' Return 7 characters respresenting the schedular, whatever it may be. (Unused)'''
-        enc = encode_value
-
-        sch = self.schedular
-        return '{}{}{}{}{}{}{}'.format(
-            enc(sch.year), enc(sch.month), enc(0), enc(sch.day), enc(sch.hour),
-            enc(sch.minute), enc(sch.second))
+        return ''.join(encode_value(value) for value in self.schedular_values())
 
     # Encoding
+    def encode_into(self, buf, state=None, trim_lines=False):
+        '''
+        Append the encoded page to *buf*, without building intermediate strings.
+
+        Args:
+            buf (bytearray): the buffer to extend.
+            state (dict): optionally, the attribute values the controller has
+                in effect from the previous pages. Attributes that already
+                have the right value are left out, and *state* is updated.
+            trim_lines (bool): leave out trailing empty lines instead of
+                sending them as empty fields.
+        '''
+        lines = self._encoded_lines
+        if lines is None:
+            # Encoded once, on first use, as pages are usually encoded more than once.
+            lines = self._encoded_lines = tuple(encode_text(line) for line in self._lines)
+        if trim_lines:
+            count = len(lines)
+            while count > 1 and not lines[count - 1]:
+                count -= 1
+            # Always send the first line, it marks the start of the page.
+            lines = lines[:count] or (b'',)
+
+        for num, line in enumerate(lines):
+            buf += B_LINE_NUMBERS[num]
+            buf += line
+            buf += B_FS
+
+        if not trim_lines:
+            # Pad to 8 lines. An empty page has always started padding at line 1.
+            for num in range(len(lines) or 1, 8):
+                buf += B_EMPTY_LINES[num]
+
+        enc = encode_value_bytes
+
+        if self._blinkspeed and _changes(state, 'blinkspeed', self._blinkspeed):
+            buf += B_BLINKSPEED
+            buf += enc(self._blinkspeed)
+            buf += B_FS
+
+        # The duration seems to be required, so it is always sent unless
+        # explicitly inherited.
+        if self._duration is not None:
+            buf += B_DURATION
+            for value in self.duration_values():
+                buf += enc(value)
+            buf += B_FS
+
+        if self._schedular and _changes(state, 'schedular', self._schedular):
+            buf += B_SCHEDULAR
+            for value in self.schedular_values():
+                buf += enc(value)
+            buf += B_FS
+
+        if self._brightness and _changes(state, 'brightness', self._brightness):
+            buf += B_BRIGHTNESS
+            buf += enc(self._brightness)
+            buf += B_FS
+
+        if self.scrolling and _changes(state, 'scrolling', True):
+            buf += B_SCROLLING_ON
+        if self.fading and _changes(state, 'fading', True):
+            buf += B_FADING_ON
+
+    def cache_key(self):
+        ''' Return a hashable key that identifies the encoded content of this page. '''
+        return (self._lines, self._blinkspeed, self._duration,
+                self._schedular, self._brightness, self.scrolling, self.fading)
+
+    def to_bytes(self):
+        ''' Return the encoded page as :class:`bytes`. '''
+        buf = bytearray()
+        self.encode_into(buf)
+        return bytes(buf)
+
     def to_controlstring(self):
         '''
         Convert the page to a controlstring.
 
         Returns:
             A string that may be included in the controlstring of a :class:`Rotation`.
-        Raises:
-            :exc:`ValueError` if any attributes are out of range.
         '''
-
-        # Validate attributes
-        check_in_range(
-            ('Line amount', len(self.lines), 0, 8),
-            ('Blink speed', self.blinkspeed, 0, 4),
-            ('Duration', self.duration, 1, 218450),
-            ('Brightness', self.brightness, 0, 17)
-            )
-
-        result = ''
-        num = 0
-        for num, line in enumerate(self.lines):
-            result += str(num) + line + FS
-
-        num += 1
-
-        if num < 8:
-            for line in range(num, 8):
-                result += str(line) + FS
-
-
-        if self.blinkspeed:
-            result += ESC + 'B' + encode_value(self.blinkspeed) + FS
-
-        result += ESC + 'A' + self.build_duration() + FS
-
-        if self.schedular:
-            check_in_range(
-                ('Year', self.schedular.year, 1980, 2075),
-                ('Month', self.schedular.month, 1, 12),
-                ('Day', self.schedular.day, 1, 31),
-                ('Hour', self.schedular.hour, 0, 23),
-                ('Minute', self.schedular.minute, 0, 59),
-                ('Second', self.schedular.second, 0, 59)
-            )
-            result += ESC + 'P' + self.build_schedular() + FS
-
-        if self.brightness:
-            result += ESC + 'Q' + encode_value(self.brightness) + FS
-
-        if self.scrolling:
-            result += ESC + 'R' + encode_value(1) + FS
-        if self.fading:
-            result += ESC + 'S' + encode_value(1) + FS
-
-        return result
+        return self.to_bytes().decode()
 
     def to_json(self):
         ''' Dump all relevant attributes as a JSON string. '''
@@ -279,7 +490,7 @@ class Page:
     def to_dict(self):
         ''' Dump all relevant attributes as a dict. '''
         result = {
-            'lines': self.lines,
+            'lines': list(self.lines),
             }
 
         for attribute in self._attributes:
@@ -304,9 +515,83 @@ class Page:
                 setattr(page, attribute, data[attribute])
         return page
 
+    @classmethod
+    def from_trusted_dict(cls, data):
+        '''
+        Initialize a page from a dict of attributes that has already been
+        validated by :func:`~infozuild.schema.validate_rotation`, without
+        checking it again.
+        '''
+        # pylint: disable=protected-access
+        page = cls.__new__(cls)
+        page._lines = tuple(data['lines'])
+        page._encoded_lines = None
+        page._blinkspeed = data.get('blinkspeed', 1)
+        page._duration = data.get('duration', 10000)
+        page._schedular = data.get('schedular')
+        page._brightness = data.get('brightness', 17)
+        page.scrolling = data.get('scrolling', False)
+        page.fading = data.get('fading', False)
+        return page
+
     def __repr__(self):
         return json.dumps(self.to_dict(), indent=2)
 
+class PageCache:
+    '''
+    A least-recently-used cache of encoded pages, addressed by their content.
+
+    Pages are looked up by :meth:`Page.cache_key`, so a page that is rebuilt
+    with the same lines and attributes is never encoded twice,
+    while a page that changed is simply a new entry.
+
+    Attributes:
+        maxsize (int): the maximum number of fragments to keep.
+        hits (int): the number of lookups that were served from the cache.
+        misses (int): the number of lookups that required encoding a page.
+    '''
+    def __init__(self, maxsize=128):
+        ''' Create an empty cache holding at most *maxsize* fragments. '''
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._fragments = collections.OrderedDict()
+
+    def fragment(self, page, state=None, trim_lines=False):
+        '''
+        Return the encoded *page*, encoding it only if its content is not cached.
+        The arguments are as for :meth:`Page.encode_into`, and *state* is
+        updated in the same way.
+        '''
+        key = page.cache_key()
+        if state is not None or trim_lines:
+            # The encoding depends on what previous pages left in effect.
+            key = (key, trim_lines, None if state is None else tuple(sorted(state.items())))
+        try:
+            fragment, new_state = self._fragments[key]
+        except KeyError:
+            self.misses += 1
+            buf = bytearray()
+            page.encode_into(buf, state, trim_lines)
+            fragment = bytes(buf)
+            new_state = None if state is None else dict(state)
+            self._fragments[key] = (fragment, new_state)
+            if len(self._fragments) > self.maxsize:
+                self._fragments.popitem(last=False)
+        else:
+            self.hits += 1
+            self._fragments.move_to_end(key)
+            if state is not None:
+                state.update(new_state)
+        return fragment
+
+    def clear(self):
+        ''' Remove all cached fragments. '''
+        self._fragments.clear()
+
+    def __len__(self):
+        return len(self._fragments)
+
 class Rotation:
     '''
     Contains a set of :class:`Page`\\ s that should be displayed, and the
@@ -330,18 +615,90 @@ class Rotation:
             self.pages = []
 
     # Encoding
-    def to_controlstring(self):
-        ''' Convert the Rotation to a controlstring that can be sent to the controller. '''
+    def encode_into(self, buf, cache=None, optimize=False, trim_lines=False):
+        '''
+        Append the complete control string for this Rotation to *buf*.
+
+        Args:
+            buf (bytearray): the buffer to extend.
+            cache (PageCache): an optional cache of encoded pages to reuse.
+            optimize (bool): leave out page attributes that are already in
+                effect from the previous page, as pages inherit them.
+            trim_lines (bool): leave out trailing empty lines of pages.
+        Raises:
+            :exc:`ValueError` if the address is out of range.
+        '''
         check_in_range(('Address', self.address, 0, 31))
 
-        result = start_controlstring(self.address)
+        buf += B_SOH
+        buf += ENCODED_VALUES[self.address]
+        buf += B_FS
 
+        state = {} if optimize else None
         for page in self.pages:
-            result += page.to_controlstring()
+            if cache is None:
+                page.encode_into(buf, state, trim_lines)
+            else:
+                buf += cache.fragment(page, state, trim_lines)
 
-        result += SYN + CR
+        buf += B_TRAILER
 
-        return result
+    def write_to(self, stream, buf=None, cache=None, optimize=False, trim_lines=False):
+        '''
+        Encode the Rotation page by page, writing each page to *stream* as soon
+        as it is encoded.
+
+        Args:
+            stream: an object with a ``write`` method accepting bytes, such as a
+                binary file or ``socket.makefile('wb')``.
+            buf (bytearray): an optional scratch buffer to reuse between calls.
+            cache (PageCache): an optional cache of encoded pages to reuse.
+            optimize (bool): as for :meth:`encode_into`.
+            trim_lines (bool): as for :meth:`encode_into`.
+
+        Returns:
+            The number of bytes written.
+        '''
+        check_in_range(('Address', self.address, 0, 31))
+
+        if buf is None:
+            buf = bytearray()
+
+        del buf[:]
+        buf += B_SOH
+        buf += ENCODED_VALUES[self.address]
+        buf += B_FS
+
+        written = 0
+        state = {} if optimize else None
+        for page in self.pages:
+            if cache is None:
+                page.encode_into(buf, state, trim_lines)
+            else:
+                buf += cache.fragment(page, state, trim_lines)
+            stream.write(buf)
+            written += len(buf)
+            del buf[:]
+
+        buf += B_TRAILER
+        stream.write(buf)
+        written += len(buf)
+        del buf[:]
+
+        return written
+
+    def to_bytes(self, cache=None, optimize=False, trim_lines=False):
+        '''
+        Convert the Rotation to a control string, as :class:`bytes`. See
+        :meth:`encode_into` for the arguments.
+        '''
+        buf = bytearray()
+        self.encode_into(buf, cache, optimize, trim_lines)
+        return bytes(buf)
+
+    def to_controlstring(self, cache=None, optimize=False, trim_lines=False):
+        ''' Convert the Rotation to a controlstring that can be sent to the controller. '''
+        return self.to_bytes(cache, optimize, trim_lines).decode()
 
     def to_dict(self):
         ''' Dump all relevant attributes as a dict. '''
@@ -354,7 +711,6 @@ class Rotation:
         ''' Dump all relevant attributes as a JSON string. '''
         return json.dumps(self.to_dict(), sort_keys=True)
 
-    # Decoding
     @classmethod
     def from_json(cls, jsonstring):
         ''' Initialize a Rotation from a JSON-string. '''
@@ -362,132 +718,20 @@ class Rotation:
 
     @classmethod
     def from_dict(cls, data):
-        ''' Initialize a Rotation from a dict with a list of pages and address. '''
+        '''
+        Initialize a Rotation from a dict with a list of pages and address.
+
+        The whole dict is validated at once by
+        :func:`~infozuild.schema.validate_rotation`.
+
+        Raises:
+            :exc:`~infozuild.schema.RotationError` listing every problem in *data*.
+        '''
+        errors = validate_rotation(data)
+        if errors:
+            raise RotationError(errors)
         return cls(data['address'],
-                   [Page.from_dict(page) for page in data['pages']])
+                   [Page.from_trusted_dict(page) for page in data['pages']])
 
     def __repr__(self):
         return json.dumps(self.to_dict(), indent=2)
-
-## Communication with the zuil
-def connect_and_send(host, controlstring):
-    ''' Open a connection to *host* and send the given control string. '''
-    logging.info('Connecting to %s', host)
-    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    sock.settimeout(10)
-    try:
-        sock.connect((host, 23))
-    except OSError as ex:
-        logging.error('Could not connect to %s: %s', host, ex)
-        return
-    sock.recv(1024) # Necesssary to get rid of the *** mini blabla *** header!
-
-    sock.sendall(controlstring.encode())
-    sock.close()
-
-def update_rtc(host, address=0, when=None):
-    ''' Generate a control string that will set the controller's RTC to the given time (or
-    the system time if None), and immediately send it to the controller. '''
-
-    logging.info('Starting RTC update.')
-    controlstring = set_rtc(address, when)
-
-    logging.info('Setting RTC.')
-    logging.debug(repr(controlstring))
-    connect_and_send(host, controlstring)
-    logging.info('RTC update complete.')
-
-def update_displaymode(host, mode, address=0):
-    '''
-    Generate a controlstring that will set the display mode, and immediately send it.
-
-    Args:
-        host (str): Hostname or IP of the controller.
-        mode (int): Display mode to switch to, see :ref:`display_modes`.
-        address (int): Controller index
-    '''
-    new_mode = DisplayMode(mode, address)
-    controlstring = new_mode.to_controlstring()
-
-    logging.info('Setting display mode %s', new_mode.mode)
-    logging.debug(repr(controlstring))
-    connect_and_send(host, controlstring)
-    logging.info('Mode setting complete.')
-
-## Script
-def main():
-    ''' :command:`zuil-send` entrypoint. '''
-    config = configparser.ConfigParser()
-
-    configdir = os.path.expanduser('~/.infozuil')
-    configpath = os.path.join(configdir, 'send.cfg')
-    if not os.path.isdir(configdir) or not os.path.isfile(configpath):
-        logging.critical('Configfile does not exist, please create send.cfg in ~/.infozuil')
-        os.mkdir(configdir)
-        sys.exit(1)
-    config.read(configpath) # Read the configuration file
-
-    host = config['ConnectionInfo']['server']
-    address = int(config['ConnectionInfo']['address'])
-
-    parser = argparse.ArgumentParser()
-
-    parser.add_argument('--version', action='version',
-                        version='infozuild {}'.format(__version__))
-    parser.add_argument('--verbose', '-v', action='store_true',
-                        help='activate debug logging')
-
-    # Other modes:
-    parser.add_argument('--displaymode', type=int, default=None,
-                        help='set a display mode (overrides text update)')
-    parser.add_argument('--update-rtc', action='store_true',
-                        help='update the RTC to the current time (overrides text update)')
-
-    # Text update
-    parser.add_argument('--file', '-f', default=None,
-                        help='rotation file to read, stdin if not specified.')
-    parser.add_argument('--output', '-o', default=None,
-                        help='output resulting controlstring to file, as well as sending')
-
-    args = parser.parse_args()
-
-    if args.verbose:
-        logging.getLogger().setLevel(logging.DEBUG)
-
-    if args.displaymode is not None:
-        update_displaymode(host, args.displaymode, address)
-    elif args.update_rtc:
-        update_rtc(host, address)
-    else:
-        script_set_text(args, host, address)
-
-def script_set_text(args, host, address):
-    '''
-    Send a new :class:`Rotation` to the zuil. Called from :func:`main`.
-
-    Args:
-        args (argparse.Namespace): Parsed command line arguments.
-        host (str): Hostname or IP of the controller.
-        address (int): Controller index
-    '''
-    if args.file:
-        try:
-            with open(args.file, 'r') as data_file:
-                data = json.load(data_file)
-        except FileNotFoundError:
-            logging.critical('Could not open file %s, exiting', args.file)
-            sys.exit(1)
-
-    else:
-        read_data = sys.stdin.read()
-        data = json.loads(read_data)
-
-    rotation = Rotation.from_dict(data)
-    rotation.address = address
-    controlstring = rotation.to_controlstring()
-
-    if args.output:
-        with open(args.output, 'w') as output_file:
-            output_file.write(controlstring)
-
-    connect_and_send(host, controlstring)
@@ -0,0 +1,337 @@
+'''
+infozuild.sources combines activities from several calendars, such as Koala,
+the APIs of other associations and iCal exports, into one list for the zuil.
+
+Every source is fetched in its own thread with its own timeout, so a slow or
+unreachable source only loses its own events, and does not delay the update.
+The events of all sources are merged by start date and de-duplicated.
+
+Sources are configured in the daemon configuration file, with one section per
+source, see :func:`from_config`.
+'''
+import concurrent.futures
+import datetime
+import heapq
+import logging
+import re
+import time
+
+import requests
+
+from . import getscript
+
+
+class SourceError(Exception):
+    '''
+    Raised by :meth:`Source.fetch` when a source could not be read.
+
+    Attributes:
+        status (str): the message to show on the zuil.
+    '''
+    def __init__(self, status):
+        super().__init__(status)
+        self.status = status
+
+class Source:
+    '''
+    A calendar to retrieve events from. Subclasses implement :meth:`parse`.
+
+    Events are dicts in the format of Koala's API: a ``name``, a
+    ``start_date`` and optionally an ``end_date``, as ISO 8601 strings of a
+    date or a date and time.
+
+    Args:
+        name (str): the name of the source, as shown in error messages.
+        url (str): the URL to retrieve the events from.
+        timeout (float): the number of seconds the source may take.
+        session (requests.Session): the session to retrieve with, a new one
+            if omitted.
+
+    Attributes:
+        last_events (list): the events of the last successful fetch, or
+            None if there was none yet.
+    '''
+    def __init__(self, name, url, timeout=getscript.READ_TIMEOUT, session=None):
+        self.name = name
+        self.url = url
+        self.timeout = timeout
+        self.session = session or requests.Session()
+        self.last_events = None
+
+    def fetch(self):
+        '''
+        Retrieve the events of this source, sorted by start date.
+
+        Raises:
+            :exc:`SourceError` with a status message if that failed.
+        '''
+        try:
+            response = self.session.get(
+                self.url, timeout=(min(getscript.CONNECT_TIMEOUT, self.timeout), self.timeout))
+        except requests.exceptions.RequestException as ex:
+            logging.error('Failed to connect to %s: %s', self.name, ex)
+            raise SourceError('Geen verbinding met {}!'.format(self.name)) from ex
+
+        if response.status_code != 200:
+            logging.error('HTTP error from %s: %s', self.name, response.status_code)
+            raise SourceError('{}: HTTP-fout {}'.format(self.name, response.status_code))
+
+        try:
+            return sorted(self.parse(response), key=start_key)
+        except (ValueError, KeyError, TypeError) as ex:
+            logging.error('Invalid output from %s: %s', self.name, ex)
+            raise SourceError('{}: onzin binnengekregen!'.format(self.name)) from ex
+
+    def parse(self, response):
+        ''' Return the events in *response*. '''
+        raise NotImplementedError
+
+    def __repr__(self):
+        return '{}({!r}, {!r})'.format(type(self).__name__, self.name, self.url)
+
+class JSONSource(Source):
+    '''
+    A JSON API that returns a list of events, of which the name, start date
+    and end date can be found under the given keys. By default, these are
+    the keys Koala uses.
+    '''
+    def __init__(self, name, url, timeout=getscript.READ_TIMEOUT,
+                 name_key='name', start_key='start_date', end_key='end_date'):
+        super().__init__(name, url, timeout)
+        self.keys = (name_key, start_key, end_key)
+
+    def parse(self, response):
+        name_key, start_key, end_key = self.keys
+        events = []
+        for item in response.json():
+            event = {'name': item[name_key], 'start_date': item[start_key]}
+            if item.get(end_key):
+                event['end_date'] = item[end_key]
+            events.append(event)
+        return events
+
+class KoalaSource(Source):
+    '''
+    Koala, at :data:`infozuild.getscript.API_URL` unless another URL is given.
+
+    Koala is retrieved with :func:`infozuild.getscript.get_events`, over the
+    shared session of :func:`infozuild.getscript.get_session` with its
+    retries, and conditionally if a *cache* is given. The timeout is at least
+    :data:`infozuild.getscript.FETCH_TIMEOUT`, so the retries are not cut off,
+    and a fetch that was given up on cannot still write to the cache while
+    the next one runs.
+
+    Args:
+        cache (ResponseCache): an optional
+            :class:`~infozuild.getscript.ResponseCache` of the last response.
+    '''
+    def __init__(self, name='Koala', url=None, timeout=getscript.FETCH_TIMEOUT, cache=None):
+        super().__init__(name, url or getscript.API_URL,
+                         max(timeout, getscript.FETCH_TIMEOUT), getscript.get_session())
+        self.cache = cache
+
+    def fetch(self):
+        events, error = getscript.get_events(self.session, self.cache, self.url)
+        if error:
+            raise SourceError(error)
+        try:
+            return sorted(events, key=start_key)
+        except (ValueError, KeyError, TypeError) as ex:
+            logging.error('Invalid output from %s: %s', self.name, ex)
+            raise SourceError('{}: onzin binnengekregen!'.format(self.name)) from ex
+
+_ICAL_DATE = re.compile(r'(\d{4})(\d\d)(\d\d)(?:T(\d\d)(\d\d)(\d\d)(Z?))?$')
+_ICAL_ESCAPE = re.compile(r'\\(.)')
+
+class ICalSource(Source):
+    '''
+    An iCalendar (``.ics``) export. Only the ``SUMMARY``, ``DTSTART`` and
+    ``DTEND`` of every ``VEVENT`` are used, and events that have ended
+    before today are left out. Times with a ``TZID`` are taken as local time.
+    '''
+    def parse(self, response):
+        events = []
+        event = {}
+        in_event = False
+        # Long lines are folded by starting the next line with whitespace.
+        for line in re.sub(r'\r?\n[ \t]', '', response.text).splitlines():
+            name, _, value = line.partition(':')
+            name = name.split(';')[0].upper()
+            if line == 'BEGIN:VEVENT':
+                event = {}
+                in_event = True
+            elif not in_event:
+                continue
+            elif line == 'END:VEVENT':
+                if 'name' not in event or 'start_date' not in event:
+                    raise ValueError('VEVENT without SUMMARY or DTSTART')
+                events.append(event)
+                in_event = False
+            elif name == 'SUMMARY':
+                event['name'] = _ICAL_ESCAPE.sub(_ical_unescape, value)
+            elif name == 'DTSTART':
+                event['start_date'] = ical_date(value)
+            elif name == 'DTEND':
+                end = ical_date(value)
+                if 'T' not in end: # The end of all-day events is exclusive.
+                    end = (datetime.datetime.strptime(end, '%Y-%m-%d').date() -
+                           datetime.timedelta(days=1)).isoformat()
+                event['end_date'] = end
+
+        today = datetime.date.today().isoformat()
+        return [event for event in events
+                if event.get('end_date', event['start_date'])[:10] >= today]
+
+def _ical_unescape(match):
+    ''' Return the character escaped in *match*, or a space for an escaped newline. '''
+    return ' ' if match.group(1) in 'nN' else match.group(1)
+
+def ical_date(value):
+    ''' Convert an iCalendar ``DATE`` or ``DATE-TIME`` to an ISO 8601 string. '''
+    match = _ICAL_DATE.match(value.strip())
+    if match is None:
+        raise ValueError('Invalid iCalendar date: {!r}'.format(value))
+    year, month, day, hour, minute, second, utc = match.groups()
+    result = '{}-{}-{}'.format(year, month, day)
+    if hour is not None:
+        result += 'T{}:{}:{}{}'.format(hour, minute, second, utc)
+    return result
+
+SOURCE_TYPES = {
+    'koala': KoalaSource,
+    'json': JSONSource,
+    'ical': ICalSource,
+    }
+''' The :class:`Source` classes by the ``Type`` used in configuration files. '''
+
+def start_key(event):
+    '''
+    Return the start of *event* as a naive local :class:`datetime.datetime`,
+    so events with and without timezones can be compared.
+    '''
+    start = getscript.parse_date(event['start_date'])
+    if start.tzinfo is not None:
+        start = start.astimezone().replace(tzinfo=None)
+    return start
+
+def fetch_all(sources):
+    '''
+    Fetch all *sources* at the same time. Each source gets its own timeout,
+    counted from the start, after which it is given up on. A source that
+    failed contributes the events of its last successful fetch, if any.
+
+    Returns:
+        A list with the events of every source, each sorted by start date,
+        and a list of status messages of the sources that failed.
+    '''
+    results = []
+    errors = []
+    started = time.monotonic()
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(len(sources), 1))
+    try:
+        futures = [(source, executor.submit(source.fetch)) for source in sources]
+        for source, future in futures:
+            try:
+                source.last_events = future.result(
+                    max(0, started + source.timeout - time.monotonic()))
+            except SourceError as ex:
+                errors.append(ex.status)
+            except concurrent.futures.TimeoutError:
+                logging.error('%s did not respond within %s seconds.', source.name, source.timeout)
+                errors.append('{} reageert niet.'.format(source.name))
+            if source.last_events is not None:
+                results.append(source.last_events)
+    finally:
+        # Do not wait for sources that timed out, they stop by their own timeout.
+        executor.shutdown(wait=False)
+    return results, errors
+
+def merge(results):
+    '''
+    Merge sorted lists of events into one list sorted by start date, with
+    a k-way merge. Events with the same name on the same day are only kept
+    once, from the source that comes first.
+    '''
+    keyed = [[(start_key(event), num, index, event) for index, event in enumerate(events)]
+             for num, events in enumerate(results)]
+    seen = set()
+    merged = []
+    for start, _, _, event in heapq.merge(*keyed):
+        duplicate = (' '.join(event['name'].casefold().split()), start.date())
+        if duplicate in seen:
+            continue
+        seen.add(duplicate)
+        merged.append(event)
+    return merged
+
+def get_events(sources):
+    '''
+    Retrieve the events of all *sources*, like
+    :func:`infozuild.getscript.get_events` does for Koala alone.
+
+    Returns:
+        The merged list of event dicts and a string with the status messages
+        of all sources that failed, which is empty if none did. The list
+        always has the events of every source that ever succeeded, see
+        :func:`fetch_all`.
+    '''
+    results, errors = fetch_all(sources)
+    return merge(results), ' '.join(errors)
+
+def get_activities(sources, limit=None):
+    '''
+    Retrieve the activities of all *sources*, like
+    :func:`infozuild.getscript.get_activities` does for Koala alone.
+
+    Returns:
+        A list of (*name*, *date*) tuples and a string with the status
+        messages of all sources that failed, which is empty if none did.
+    '''
+    events, error = get_events(sources)
+    return list(getscript.parse_activities(events[0:limit])), error
+
+def from_config(config):
+    '''
+    Create the sources configured in *config*, a
+    :class:`configparser.ConfigParser`. Every section named ``Source NAME``
+    is a source, with these options:
+
+    ``Type``
+        ``koala``, ``json`` or ``ical``, see :data:`SOURCE_TYPES`.
+    ``URL``
+        The URL to retrieve. Optional for ``koala``, which uses
+        :data:`infozuild.getscript.API_URL` by default.
+    ``Timeout``
+        The number of seconds the source may take. For ``koala``, this is at
+        least :data:`infozuild.getscript.FETCH_TIMEOUT`.
+    ``NameKey``, ``StartKey``, ``EndKey``
+        For ``json`` sources, the keys of the name, start date and end date.
+
+    Returns:
+        A list of :class:`Source`, which is empty if no sources are configured.
+
+    Raises:
+        :exc:`ValueError` if a source has an unknown type, or no URL while
+        it needs one.
+    '''
+    sources = []
+    for section in config.sections():
+        if not section.startswith('Source '):
+            continue
+        options = config[section]
+        kind = options.get('Type', 'koala').lower()
+        if kind not in SOURCE_TYPES:
+            raise ValueError('Unknown type {!r} of source {!r}'.format(kind, section))
+        if kind != 'koala' and not options.get('URL'):
+            raise ValueError('Source {!r} has no URL'.format(section))
+
+        kwargs = {}
+        if options.get('Timeout'):
+            kwargs['timeout'] = options.getfloat('Timeout')
+        if kind == 'json':
+            kwargs.update(name_key=options.get('NameKey', 'name'),
+                          start_key=options.get('StartKey', 'start_date'),
+                          end_key=options.get('EndKey', 'end_date'))
+        sources.append(SOURCE_TYPES[kind](
+            section[len('Source '):].strip(), options.get('URL'), **kwargs))
+    return sources
@@ -1,16 +1,52 @@
 ''' Contains various tests to verify zuild works as intended. '''
+import asyncio
+import configparser
 import datetime
+import glob
+import http.server
 import imp
+import io
+import json
 import logging
+import os.path
+import socket
+import tempfile
+import threading
+import time
+import types
 import unittest
+from unittest import mock
 
 import dateutil.parser
 from hypothesis import given
 import hypothesis.strategies as st
 
-import infozuild.getscript, infozuild.sendscript
+import infozuild.controller, infozuild.daemon, infozuild.emulator, infozuild.getscript
+import infozuild.eventstore, infozuild.koala, infozuild.parsing, infozuild.schema
+import infozuild.sendscript, infozuild.sources
 from infozuild.getscript import no_secs, ACTIVITY_DATE_FORMAT
 
+TESTDATA = os.path.join(os.path.dirname(__file__), '..', '..', '..', 'testdata')
+
+class TickingClock(datetime.datetime):
+    ''' A datetime whose :meth:`now` advances a minute on every reading. '''
+    current = datetime.datetime(2016, 6, 8, 12)
+
+    @classmethod
+    def now(cls, tz=None):
+        TickingClock.current += datetime.timedelta(minutes=1)
+        return cls.combine(TickingClock.current.date(), TickingClock.current.time())
+
+def ticking_clock():
+    '''
+    Patch the clock of the getscript with :class:`TickingClock`, so the
+    'last updated' time differs between any two rotations.
+    '''
+    clock = types.ModuleType('datetime')
+    clock.__dict__.update(vars(datetime))
+    clock.datetime = TickingClock
+    return mock.patch.object(infozuild.getscript, 'datetime', clock)
+
 class TestNotConnected(unittest.TestCase):
     ''' Test various scenarios where the daemon might not be able to retrieve events from Koala. '''
 
@@ -152,9 +188,1268 @@ class TestWhenBuilder(unittest.TestCase):
                 start.date().strftime(ACTIVITY_DATE_FORMAT), no_secs(start.time()),
                 end.date().strftime(ACTIVITY_DATE_FORMAT), no_secs(end.time())))
 
+    @given(st.datetimes(datetime.datetime(1980, 1, 1), datetime.datetime(2075, 1, 1)),
+           st.sampled_from(['%Y-%m-%d', '%Y-%m-%dT%H:%M', '%Y-%m-%dT%H:%M:%S',
+                            '%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S+02:00',
+                            '%Y-%m-%dT%H:%M:%S-0530', '%Y-%m-%dT%H:%M:%SZ', '%d %B %Y %H:%M']))
+    def test_parse_date(self, when, date_format):
+        ''' Ensure the fast date parser agrees with dateutil. '''
+        value = when.strftime(date_format)
+        self.assertEqual(infozuild.getscript.parse_date(value), dateutil.parser.parse(value))
+
+    def test_memoized(self):
+        ''' Ensure unchanged events are not parsed again. '''
+        event = {'start_date': '2016-06-08T21:09:00+02:00', 'end_date': '2016-06-08'}
+        with mock.patch.object(infozuild.getscript, 'parse_date',
+                               wraps=infozuild.getscript.parse_date) as parse_date:
+            first = infozuild.getscript.build_when(dict(event, name='Borrel'), self.today)
+            second = infozuild.getscript.build_when(dict(event, name='Lezing'), self.today)
+            self.assertEqual(first, second)
+            self.assertEqual(parse_date.call_count, 2)
+            infozuild.getscript.build_when(event, self.tomorrow)
+            self.assertEqual(parse_date.call_count, 4)
+
 class TestEncoding(unittest.TestCase):
     ''' Verifies Pages and Rotations behave as specified. '''
     @given(st.integers(0, 95))
     def test_encode_is_decode(self, value):
         self.assertEqual(infozuild.sendscript.decode_value(infozuild.sendscript.encode_value(value)),
                          value)
+
+class TestControlstrings(unittest.TestCase):
+    ''' Verifies the bytes encoder against the archived control strings in testdata. '''
+
+    def archived(self):
+        ''' Yield (Rotation, expected bytes) for every archived control string. '''
+        paths = glob.glob(os.path.join(TESTDATA, '*.cts'))
+        self.assertTrue(paths)
+        for path in paths:
+            with open(os.path.splitext(path)[0] + '.json') as json_file:
+                rotation = infozuild.sendscript.Rotation.from_json(json_file.read())
+            with open(path, 'rb') as cts_file:
+                yield rotation, cts_file.read()
+
+    def test_round_trip(self):
+        ''' Ensure both the bytes and string encoders reproduce the archived control strings. '''
+        for rotation, expected in self.archived():
+            self.assertEqual(rotation.to_bytes(), expected)
+            self.assertEqual(rotation.to_controlstring(), expected.decode())
+
+    def test_write_to(self):
+        ''' Ensure streaming page by page into a file gives the same output. '''
+        buf = bytearray()
+        for rotation, expected in self.archived():
+            stream = io.BytesIO()
+            written = rotation.write_to(stream, buf)
+            self.assertEqual(stream.getvalue(), expected)
+            self.assertEqual(written, len(expected))
+
+    def test_empty_page(self):
+        ''' Ensure pages without lines are encoded as they always were. '''
+        page = infozuild.sendscript.Page()
+        self.assertEqual(page.to_controlstring(),
+                         '1\x1c2\x1c3\x1c4\x1c5\x1c6\x1c7\x1c\x1bB!\x1c\x1bA !\'&\x1c\x1bQ1\x1c')
+
+class TestPageCache(unittest.TestCase):
+    ''' Verifies that the PageCache only encodes pages whose content changed. '''
+
+    def test_reuse(self):
+        ''' Ensure identical pages are served from the cache, and changed pages are not. '''
+        cache = infozuild.sendscript.PageCache()
+        rotation = infozuild.sendscript.Rotation(pages=[
+            infozuild.sendscript.Page(['Laatste update:', 'nu']),
+            infozuild.sendscript.Page(['Borrel'])])
+        expected = rotation.to_bytes()
+
+        self.assertEqual(rotation.to_bytes(cache), expected)
+        self.assertEqual(rotation.to_bytes(cache), expected)
+        self.assertEqual((cache.hits, cache.misses), (2, 2))
+
+        rotation.pages[0].lines = ['Laatste update:', 'straks']
+        self.assertEqual(rotation.to_bytes(cache), rotation.to_bytes())
+        self.assertEqual((cache.hits, cache.misses), (3, 3))
+
+    def test_eviction(self):
+        ''' Ensure the least recently used fragment is evicted first. '''
+        cache = infozuild.sendscript.PageCache(maxsize=2)
+        first, second, third = (infozuild.sendscript.Page([str(num)]) for num in range(3))
+        cache.fragment(first)
+        cache.fragment(second)
+        cache.fragment(first)
+        cache.fragment(third)
+        self.assertEqual(len(cache), 2)
+
+        cache.fragment(first)
+        self.assertEqual(cache.misses, 3)
+        cache.fragment(second)
+        self.assertEqual(cache.misses, 4)
+
+class TestSendOnlyOnChange(unittest.TestCase):
+    ''' Verifies the ZuilManager skips sends when the content did not change. '''
+
+    def setUp(self):
+        ''' Replace the actual sending with a mock. '''
+        patcher = mock.patch.object(infozuild.controller.ControllerConnection, 'send',
+                                    return_value=True)
+        self.send = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.manager = infozuild.daemon.ZuilManager(
+            'localhost', 0, None, send_only_on_change=True, resend_interval=60)
+        self.addCleanup(self.manager.close)
+        self.manager.events = [('Borrel', '08 jun')]
+        self.manager.status = 'Status'
+
+        patcher = ticking_clock()
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_skip_unchanged(self):
+        ''' Ensure unchanged content is only sent once, unless forced. '''
+        self.manager.refresh_zuil()
+        self.manager.refresh_zuil()
+        self.assertEqual(self.send.call_count, 1)
+
+        self.manager.refresh_zuil(force=True)
+        self.assertEqual(self.send.call_count, 2)
+
+    def test_digest_ignores_update_time(self):
+        ''' Ensure rotations built at different times have the same digest. '''
+        first = infozuild.getscript.make_rotation([('Borrel', '08 jun')], 'Status')
+        second = infozuild.getscript.make_rotation([('Borrel', '08 jun')], 'Status')
+        self.assertNotEqual(first.pages[0].lines[-1], second.pages[0].lines[-1])
+        self.assertEqual(infozuild.getscript.content_digest(first),
+                         infozuild.getscript.content_digest(second))
+
+    def test_send_changed(self):
+        ''' Ensure changed content is sent. '''
+        self.manager.refresh_zuil()
+        self.manager.events = [('Lunchlezing', '09 jun')]
+        self.manager.refresh_zuil()
+        self.assertEqual(self.send.call_count, 2)
+
+    def test_resend_interval(self):
+        ''' Ensure unchanged content is sent again once the resend interval passed. '''
+        self.manager.refresh_zuil()
+        target = ('localhost', 0)
+        digest, sent_at = self.manager.last_sent[target]
+        self.manager.last_sent[target] = (digest, sent_at - 3600)
+        self.manager.refresh_zuil()
+        self.assertEqual(self.send.call_count, 2)
+
+    def test_failed_send(self):
+        ''' Ensure content is sent again if the previous send failed. '''
+        self.send.return_value = False
+        self.manager.refresh_zuil()
+        self.manager.refresh_zuil()
+        self.assertEqual(self.send.call_count, 2)
+
+class FakeController:
+    '''
+    Accepts connections one at a time on localhost, sends a banner and records
+    the data received per connection.
+    '''
+
+    def __init__(self):
+        self.server = socket.socket()
+        self.server.bind(('localhost', 0))
+        self.server.listen(1)
+        self.port = self.server.getsockname()[1]
+        self.received = []
+        self.current = None
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+    def serve(self):
+        ''' Accept and read connections until the server socket is closed. '''
+        while True:
+            try:
+                conn, _ = self.server.accept()
+            except OSError:
+                return
+            self.current = conn
+            data = bytearray()
+            conn.sendall(b'*** mini test ***\r\n')
+            while True:
+                try:
+                    chunk = conn.recv(4096)
+                except OSError:
+                    break
+                if not chunk:
+                    break
+                data += chunk
+            conn.close()
+            self.received.append(bytes(data))
+
+    def drop(self):
+        ''' Close the current client connection from the controller side. '''
+        self.current.shutdown(socket.SHUT_RDWR)
+
+    def wait(self, connections):
+        ''' Wait until the given number of connections have been closed. '''
+        for _ in range(100):
+            if len(self.received) >= connections:
+                return
+            threading.Event().wait(0.01)
+
+    def close(self):
+        '''
+        Stop accepting connections. Closing alone does not wake up the thread
+        blocked in ``accept``, which keeps the port listening until it is
+        shut down.
+        '''
+        if self.server.fileno() != -1:
+            try:
+                self.server.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self.server.close()
+        self.thread.join(1)
+
+class TestControllerConnection(unittest.TestCase):
+    ''' Verifies connections to the controller are reused and reopened as configured. '''
+
+    def setUp(self):
+        ''' Start a fake controller. '''
+        self.controller = FakeController()
+        self.addCleanup(self.controller.close)
+
+    def test_reuse(self):
+        ''' Ensure several control strings are sent over one connection. '''
+        with infozuild.controller.ControllerConnection(
+                'localhost', self.controller.port) as connection:
+            self.assertTrue(connection.send(infozuild.sendscript.set_rtc()))
+            self.assertTrue(connection.send(b'text'))
+            self.assertTrue(connection.send(
+                infozuild.sendscript.DisplayMode(1).to_controlstring()))
+        self.controller.wait(1)
+        self.assertEqual(len(self.controller.received), 1)
+        self.assertTrue(self.controller.received[0].endswith(b'\x1bD!\x1c\r'))
+
+    def test_no_reuse(self):
+        ''' Ensure every control string gets its own connection without reuse. '''
+        connection = infozuild.controller.ControllerConnection(
+            'localhost', self.controller.port, reuse=False)
+        self.assertTrue(connection.send(b'one'))
+        self.assertTrue(connection.send(b'two'))
+        self.controller.wait(2)
+        self.assertEqual(self.controller.received, [b'one', b'two'])
+
+    def test_reconnect(self):
+        ''' Ensure a connection closed by the controller is transparently reopened. '''
+        connection = infozuild.controller.ControllerConnection('localhost', self.controller.port)
+        self.assertTrue(connection.send(b'one'))
+        self.controller.drop()
+        self.controller.wait(1)
+        self.assertTrue(connection.send(b'two'))
+        connection.close()
+        self.controller.wait(2)
+        self.assertEqual(self.controller.received, [b'one', b'two'])
+
+    def test_unreachable(self):
+        ''' Ensure a failed connection is reported instead of raised. '''
+        self.controller.close()
+        self.assertFalse(self.controller.thread.is_alive())
+        logging.disable(logging.ERROR)
+        self.assertFalse(infozuild.controller.connect_and_send(
+            'localhost', b'text', self.controller.port))
+        logging.disable(logging.NOTSET)
+
+class TestSendQueue(unittest.TestCase):
+    ''' Verifies the SendQueue sends in order and drops superseded text updates. '''
+
+    def setUp(self):
+        ''' Create a queue with a connection that blocks until released. '''
+        self.sending = threading.Event()
+        self.release = threading.Event()
+        self.sent = []
+
+        def send(controlstring):
+            ''' Record the control string once released. '''
+            self.sending.set()
+            self.release.wait(5)
+            self.sent.append(controlstring)
+            return True
+
+        connection = mock.Mock()
+        connection.send.side_effect = send
+        self.queue = infozuild.controller.SendQueue(connection)
+        self.addCleanup(self.queue.stop, 5)
+
+    @staticmethod
+    def text(line, address=0):
+        ''' Return a text update control string with one line. '''
+        return infozuild.sendscript.Rotation(
+            address, [infozuild.sendscript.Page([line])]).to_bytes()
+
+    def test_coalesce(self):
+        ''' Ensure only the newest pending text update is sent, and other updates keep order. '''
+        rtc = infozuild.sendscript.set_rtc().encode()
+        mode = infozuild.sendscript.DisplayMode(1).to_controlstring().encode()
+
+        self.queue.submit(self.text('first'))
+        self.assertTrue(self.sending.wait(5))
+        old = self.queue.submit(self.text('old'))
+        self.queue.submit(rtc)
+        self.queue.submit(mode)
+        new = self.queue.submit(self.text('new'))
+        self.release.set()
+
+        self.assertTrue(new.result(5).success)
+        self.assertFalse(new.result().superseded)
+        self.assertTrue(old.result(5).success)
+        self.assertTrue(old.result().superseded)
+        self.assertEqual(self.sent, [self.text('first'), rtc, mode, self.text('new')])
+
+    def test_other_address(self):
+        ''' Ensure text updates for different addresses are not coalesced. '''
+        self.queue.submit(self.text('first'))
+        self.assertTrue(self.sending.wait(5))
+        futures = [self.queue.submit(self.text('zero')), self.queue.submit(self.text('one', 1))]
+        self.release.set()
+        for future in futures:
+            self.assertFalse(future.result(5).superseded)
+        self.assertEqual(self.sent, [self.text('first'), self.text('zero'), self.text('one', 1)])
+
+class TestSendMany(unittest.TestCase):
+    ''' Verifies the asyncio transport sends to many controllers concurrently. '''
+
+    def setUp(self):
+        ''' Create an event loop. '''
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+    def test_send_many(self):
+        ''' Ensure every target receives a readdressed control string. '''
+        controllers = [FakeController(), FakeController()]
+        for controller in controllers:
+            self.addCleanup(controller.close)
+
+        # All targets of one call share a port, so each fake controller gets its own call.
+        rotation = infozuild.sendscript.Rotation(pages=[infozuild.sendscript.Page(['Borrel'])])
+        for controller in controllers:
+            results = self.loop.run_until_complete(infozuild.controller.send_many(
+                [('localhost', 0), ('localhost', 3)], rotation.to_bytes(), controller.port))
+            self.assertEqual(sorted(results), [('localhost', 0), ('localhost', 3)])
+            self.assertTrue(all(result.success for result in results.values()))
+
+            controller.wait(2)
+            rotation.address = 3
+            self.assertEqual(controller.received[1], rotation.to_bytes())
+            rotation.address = 0
+            self.assertEqual(controller.received[0], rotation.to_bytes())
+
+    def test_timeout(self):
+        ''' Ensure a controller that never sends its banner times out. '''
+        silent = socket.socket()
+        self.addCleanup(silent.close)
+        silent.bind(('localhost', 0))
+        silent.listen(1)
+
+        logging.disable(logging.ERROR)
+        results = self.loop.run_until_complete(infozuild.controller.send_many(
+            [('localhost', 0)], b'text', silent.getsockname()[1], timeout=0.1))
+        logging.disable(logging.NOTSET)
+        self.assertFalse(results[('localhost', 0)].success)
+        self.assertLess(results[('localhost', 0)].latency, 1)
+
+class TestEmulator(unittest.TestCase):
+    ''' Verifies the controller emulator understands what the sendscript sends. '''
+
+    def setUp(self):
+        ''' Start an emulator. '''
+        self.emulator = infozuild.emulator.ControllerEmulator().start()
+        self.addCleanup(self.emulator.stop)
+
+    def test_text(self):
+        ''' Ensure an archived rotation is parsed into the pages it was made from. '''
+        with open(os.path.join(TESTDATA, 'normal.json')) as json_file:
+            rotation = infozuild.sendscript.Rotation.from_json(json_file.read())
+        self.assertTrue(infozuild.controller.connect_and_send(
+            'localhost', rotation.to_bytes(), self.emulator.port))
+        self.assertTrue(self.emulator.wait_for(1))
+
+        pages = self.emulator.texts[0]
+        self.assertEqual([page.lines for page in pages],
+                         [page.lines for page in rotation.pages])
+        self.assertEqual(pages[0].brightness, 17)
+        self.assertTrue(pages[0].fading)
+        self.assertTrue(pages[1].fading) # Inherited from the first page
+        self.assertEqual(pages[1].duration_values(), rotation.pages[1].duration_values())
+
+    def test_rtc_and_mode(self):
+        ''' Ensure RTC and display mode updates over one connection are applied. '''
+        when = datetime.datetime(2016, 6, 8, 12, 34, 56)
+        with infozuild.controller.ControllerConnection('localhost', self.emulator.port) as conn:
+            infozuild.controller.update_rtc('localhost', 2, when, conn)
+            infozuild.controller.update_displaymode('localhost', 0, 2, conn)
+            self.assertTrue(self.emulator.wait_for(2))
+        self.assertEqual(self.emulator.clocks, {2: when})
+        self.assertEqual(self.emulator.modes, {2: 0})
+        self.assertEqual([reception.kind for reception in self.emulator.receptions],
+                         ['rtc', 'displaymode'])
+
+    def test_refuse_concurrent(self):
+        ''' Ensure a second connection is refused while the first is open. '''
+        with infozuild.controller.ControllerConnection('localhost', self.emulator.port) as conn:
+            conn.send(infozuild.sendscript.set_rtc())
+            self.assertTrue(self.emulator.wait_for(1))
+            logging.disable(logging.ERROR)
+            infozuild.controller.connect_and_send(
+                'localhost', infozuild.sendscript.set_rtc(), self.emulator.port)
+            logging.disable(logging.NOTSET)
+        self.assertEqual(self.emulator.refused, 1)
+        self.assertEqual(len(self.emulator.receptions), 1)
+
+    def test_manager(self):
+        ''' Ensure the ZuilManager can update the emulator end-to-end. '''
+        manager = infozuild.daemon.ZuilManager(
+            'localhost', 0, None, port=self.emulator.port)
+        self.addCleanup(manager.close)
+        manager.events = [('Borrel', '08 jun')]
+        manager.refresh_zuil()
+        self.assertTrue(self.emulator.wait_for(1))
+        self.assertEqual(self.emulator.texts[0][1].lines[1], 'Borrel')
+
+class TestDecoding(unittest.TestCase):
+    ''' Verifies control strings can be decoded back into instructions. '''
+
+    def test_archived(self):
+        ''' Ensure archived control strings decode to their source rotations and re-encode identically. '''
+        for path in glob.glob(os.path.join(TESTDATA, '*.cts')):
+            with open(os.path.splitext(path)[0] + '.json') as json_file:
+                expected = infozuild.sendscript.Rotation.from_json(json_file.read())
+            with open(path, 'rb') as cts_file:
+                data = cts_file.read()
+
+            decoded = infozuild.parsing.parse_controlstring_file(path)
+            self.assertEqual(len(decoded), 1)
+            self.assertEqual(decoded[0].to_bytes(), data)
+            for page, original in zip(decoded[0].pages, expected.pages):
+                self.assertEqual(page.lines, original.lines)
+                self.assertEqual(page.duration_values(), original.duration_values())
+
+            decoded = infozuild.parsing.parse_rotation(memoryview(data))
+            self.assertEqual(decoded.to_bytes(), data)
+
+    def test_inherit(self):
+        ''' Ensure absent attributes inherit from the previous page if requested. '''
+        first = infozuild.sendscript.Page(['Eerste'])
+        first.fading = True
+        first.blinkspeed = 3
+        second = infozuild.sendscript.Page(['Tweede'])
+        second.blinkspeed = 0
+        data = infozuild.sendscript.Rotation(pages=[first, second]).to_bytes()
+
+        raw = infozuild.parsing.parse_rotation(data)
+        self.assertEqual((raw.pages[1].fading, raw.pages[1].blinkspeed), (False, 0))
+        self.assertEqual(raw.to_bytes(), data)
+
+        inherited = infozuild.parsing.parse_rotation(data, inherit=True)
+        self.assertEqual((inherited.pages[1].fading, inherited.pages[1].blinkspeed), (True, 3))
+
+    def test_short_duration(self):
+        ''' Ensure a duration shorter than one tick survives a round trip. '''
+        page = infozuild.sendscript.Page(['Kort'])
+        page.duration = 20
+        data = infozuild.sendscript.Rotation(pages=[page]).to_bytes()
+        decoded = infozuild.parsing.parse_controlstring(data)
+        self.assertEqual(decoded[0].pages[0].duration, 1)
+        self.assertEqual(decoded[0].to_bytes(), data)
+
+    def test_mixed_archive(self):
+        ''' Ensure RTC, display mode and text control strings are decoded in order. '''
+        when = datetime.datetime(2016, 6, 8, 12, 34, 56)
+        data = (infozuild.sendscript.set_rtc(4, when) +
+                infozuild.sendscript.DisplayMode(0, 4).to_controlstring() +
+                infozuild.sendscript.Rotation(4, [infozuild.sendscript.Page(['Hoi'])])
+                .to_controlstring()).encode()
+
+        rtc, mode, rotation = infozuild.parsing.parse_controlstring(data)
+        self.assertEqual((rtc.address, rtc.when), (4, when))
+        self.assertEqual((mode.address, mode.mode), (4, 0))
+        self.assertEqual(rotation.pages[0].lines[0], 'Hoi')
+
+    def test_malformed(self):
+        ''' Ensure truncated control strings are rejected. '''
+        data = infozuild.sendscript.set_rtc().encode()
+        with self.assertRaises(ValueError):
+            infozuild.parsing.parse_controlstring(data[:-1])
+
+class TestOptimizedEncoding(unittest.TestCase):
+    ''' Verifies optimized control strings have the same effect as normal ones. '''
+
+    @staticmethod
+    def effective(data):
+        ''' Decode *data* into the lines and attributes in effect for every page. '''
+        rotation = infozuild.parsing.parse_rotation(data, inherit=True)
+        return [(page.lines, page.cache_key()[1:]) for page in rotation.pages]
+
+    @staticmethod
+    def rotations():
+        ''' Yield the archived rotations and a synthetic one with varying attributes. '''
+        for path in glob.glob(os.path.join(TESTDATA, '*.json')):
+            with open(path) as json_file:
+                yield infozuild.sendscript.Rotation.from_json(json_file.read())
+
+        pages = []
+        for num in range(12):
+            page = infozuild.sendscript.Page(['Pagina {}'.format(num)] + [''] * (num % 8))
+            page.blinkspeed = num % 3
+            page.brightness = 17 - num % 2
+            page.scrolling = num % 4 == 1
+            page.fading = num % 3 == 0
+            pages.append(page)
+        yield infozuild.sendscript.Rotation(pages=pages)
+
+    def test_same_effect(self):
+        ''' Ensure optimizing and trimming never change what the controller shows. '''
+        cache = infozuild.sendscript.PageCache()
+        for rotation in self.rotations():
+            normal = rotation.to_bytes()
+            for options in ((True, False), (False, True), (True, True)):
+                optimized = rotation.to_bytes(None, *options)
+                self.assertLessEqual(len(optimized), len(normal))
+                self.assertEqual(self.effective(optimized), self.effective(normal))
+                self.assertEqual(rotation.to_bytes(cache, *options), optimized)
+                self.assertEqual(rotation.to_bytes(cache, *options), optimized)
+
+    def test_elided(self):
+        ''' Ensure repeated attributes are only sent once. '''
+        pages = [infozuild.sendscript.Page(['Hoi']) for _ in range(3)]
+        for page in pages:
+            page.fading = True
+        data = infozuild.sendscript.Rotation(pages=pages).to_bytes(optimize=True)
+        self.assertEqual(data.count(b'\x1bS'), 1)
+        self.assertEqual(data.count(b'\x1bQ'), 1)
+        self.assertEqual(data.count(b'\x1bA'), 3)
+
+class TestPageValidation(unittest.TestCase):
+    ''' Verifies Page attributes are validated when assigned. '''
+
+    def test_out_of_range(self):
+        ''' Ensure invalid values are rejected on assignment, and the old value is kept. '''
+        page = infozuild.sendscript.Page()
+        for attribute, value in (('blinkspeed', 5), ('duration', 0), ('brightness', 18),
+                                 ('schedular', datetime.datetime(2080, 1, 1)),
+                                 ('lines', [''] * 9)):
+            with self.assertRaises(ValueError):
+                setattr(page, attribute, value)
+        self.assertEqual(page.to_dict(), infozuild.sendscript.Page().to_dict())
+
+        with self.assertRaises(ValueError):
+            infozuild.sendscript.Page.from_dict({'lines': [], 'brightness': -1})
+
+    def test_inherit(self):
+        ''' Ensure None is accepted, and leaves the attribute out when encoding. '''
+        page = infozuild.sendscript.Page(['Hoi'])
+        page.duration = None
+        page.brightness = None
+        self.assertNotIn(infozuild.sendscript.ESC + 'A', page.to_controlstring())
+        self.assertNotIn(infozuild.sendscript.ESC + 'Q', page.to_controlstring())
+
+    def test_compatible(self):
+        ''' Ensure dicts survive a round trip, and lines stay unchangeable. '''
+        data = {'lines': ['a', 'b'], 'brightness': 3, 'fading': True}
+        page = infozuild.sendscript.Page.from_dict(data)
+        self.assertEqual(page.to_dict(), dict(data, blinkspeed=1, duration=10000))
+        self.assertIsInstance(page.lines, tuple)
+        with self.assertRaises(AttributeError):
+            page.colour = 'rood'
+
+class TestRotationSchema(unittest.TestCase):
+    ''' Verifies rotation dicts are validated as a whole. '''
+
+    def test_all_errors(self):
+        ''' Ensure every problem is reported, with its path. '''
+        data = {'address': 40, 'pages': [
+            {'lines': ['Goed']},
+            {'lines': ['Fout'], 'blinkspeed': 9},
+            {'lines': ['a'] * 9, 'brightness': 'vol', 'kleur': 'rood'},
+            'geen pagina',
+            ]}
+        with self.assertRaises(infozuild.schema.RotationError) as context:
+            infozuild.sendscript.Rotation.from_dict(data)
+        self.assertIsInstance(context.exception, ValueError)
+        self.assertEqual([path for path, _ in context.exception.errors], [
+            '$.address', '$.pages[1].blinkspeed', '$.pages[2].lines',
+            '$.pages[2].brightness', '$.pages[3]'])
+
+    def test_missing(self):
+        ''' Ensure required keys are reported. '''
+        errors = infozuild.schema.validate_rotation({'pages': [{}]})
+        self.assertEqual(errors, [('$.address', 'is required'),
+                                  ('$.pages[0].lines', 'is required')])
+
+    def test_same_result(self):
+        ''' Ensure validated rotations encode like pages built through the setters. '''
+        for filename in glob.glob(os.path.join(TESTDATA, '*.json')):
+            with open(filename) as json_file:
+                data = json.load(json_file)
+            rotation = infozuild.sendscript.Rotation.from_dict(data)
+            pages = [infozuild.sendscript.Page.from_dict(page) for page in data['pages']]
+            self.assertEqual(rotation.to_bytes(),
+                             infozuild.sendscript.Rotation(data['address'], pages).to_bytes())
+
+class TestStreaming(unittest.TestCase):
+    ''' Verifies commands streamed to zuil-send arrive over a single connection. '''
+
+    def setUp(self):
+        ''' Start an emulator and connect to it. '''
+        self.emulator = infozuild.emulator.ControllerEmulator().start()
+        self.addCleanup(self.emulator.stop)
+        self.connection = infozuild.controller.ControllerConnection(
+            'localhost', self.emulator.port)
+        self.addCleanup(self.connection.close)
+
+    def test_stream(self):
+        ''' Ensure every kind of command is sent to the address, and invalid lines are skipped. '''
+        stream = io.StringIO('\n'.join([
+            '{"pages": [{"lines": ["Hoi"]}], "address": 0}',
+            '{"rtc": "1970-01-01T00:00:00"}',
+            '{"rtc": "2016-06-08T12:34:56", "address": 2}',
+            'geen json',
+            '{"displaymode": 7}',
+            '',
+            '{"displaymode": 0}',
+            ]))
+        logging.disable(logging.ERROR)
+        self.addCleanup(logging.disable, logging.NOTSET)
+        sent = infozuild.controller.stream_commands(stream, self.connection, address=1)
+        self.assertEqual(sent, 3)
+        self.assertTrue(self.emulator.wait_for(3))
+
+        self.assertEqual(self.emulator.texts[1][0].lines[0], 'Hoi')
+        self.assertEqual(self.emulator.clocks, {1: datetime.datetime(2016, 6, 8, 12, 34, 56)})
+        self.assertEqual(self.emulator.modes, {1: 0})
+        self.assertEqual(len({reception.connected for reception in self.emulator.receptions}), 1)
+
+    def test_rate_limit(self):
+        ''' Ensure sends are spaced at least the rate limit apart. '''
+        stream = io.StringIO('{"displaymode": 1}\n' * 3)
+        infozuild.controller.stream_commands(stream, self.connection, rate_limit=0.05)
+        self.assertTrue(self.emulator.wait_for(3))
+        finished = [reception.finished for reception in self.emulator.receptions]
+        self.assertGreaterEqual(finished[2] - finished[0], 0.09)
+
+class TestWatch(unittest.TestCase):
+    ''' Verifies zuil-get --watch only outputs rotations that changed. '''
+
+    def test_changes_only(self):
+        ''' Ensure unchanged rotations are skipped, and one session is used. '''
+        results = [([('Borrel', '08 jun')], ''), ([('Borrel', '08 jun')], ''),
+                   ([('Lezing', '09 jun')], '')]
+        output = io.StringIO()
+        with mock.patch.object(infozuild.getscript, 'get_activities',
+                               side_effect=results) as get_activities, ticking_clock():
+            written = infozuild.getscript.watch(0, output, polls=3)
+        self.assertEqual(written, 2)
+
+        lines = output.getvalue().splitlines()
+        self.assertEqual(len(lines), 2)
+        rotations = [infozuild.sendscript.Rotation.from_json(line) for line in lines]
+        self.assertEqual([rotation.pages[1].lines[1] for rotation in rotations],
+                         ['Borrel', 'Lezing'])
+        sessions = {call[0][0] for call in get_activities.call_args_list}
+        self.assertEqual(len(sessions), 1)
+
+    def test_outage(self):
+        ''' Ensure the last activities are kept, with the error as status, while Koala is down. '''
+        def get_activities(session, cache, limit):
+            ''' Succeed the first time, storing the events in the cache, and fail after. '''
+            if cache.events is None:
+                cache.store(mock.Mock(headers={}), [{'name': 'Borrel', 'start_date': '2016-06-08'}])
+                return cache.get_activities(limit), ''
+            return [], 'Geen verbinding met Koala!'
+
+        output = io.StringIO()
+        with mock.patch.object(infozuild.getscript, 'get_activities',
+                               side_effect=get_activities), ticking_clock():
+            written = infozuild.getscript.watch(0, output, polls=2)
+        self.assertEqual(written, 2)
+
+        rotation = infozuild.sendscript.Rotation.from_json(output.getvalue().splitlines()[1])
+        self.assertEqual(rotation.pages[1].lines[1], 'Borrel')
+        self.assertIn('Geen verbinding met Koala!', rotation.pages[0].lines[4])
+
+class FakeKoala(http.server.BaseHTTPRequestHandler):
+    '''
+    Serves a fixed list of activities with an ETag, honouring If-None-Match.
+    The first *failures* requests get a 503, and every answer takes *delay* seconds.
+    '''
+    events = [{'name': 'Borrel', 'start_date': '2016-06-08'}]
+    etag = '"v1"'
+    failures = 0
+    delay = 0
+    requests = []
+
+    @classmethod
+    def serve(cls, testcase, failures=0, delay=0):
+        ''' Serve in the background during *testcase*, and point the getscript at it. '''
+        cls.requests = []
+        cls.failures = failures
+        cls.delay = delay
+        server = http.server.HTTPServer(('localhost', 0), cls)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        testcase.addCleanup(server.server_close)
+        testcase.addCleanup(server.shutdown)
+        patcher = mock.patch.object(infozuild.getscript, 'API_URL',
+                                    'http://localhost:{}/'.format(server.server_port))
+        patcher.start()
+        testcase.addCleanup(patcher.stop)
+
+    def do_GET(self): # pylint: disable=invalid-name
+        ''' Answer with the events, or 304 if the client has them already. '''
+        FakeKoala.requests.append(dict(self.headers))
+        time.sleep(self.delay)
+        if len(FakeKoala.requests) <= self.failures:
+            self.send_response(503)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if self.headers.get('If-None-Match') == self.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        body = json.dumps(self.events).encode()
+        self.send_response(200)
+        self.send_header('ETag', self.etag)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args): # pylint: disable=arguments-differ
+        pass
+
+class TestResponseCache(unittest.TestCase):
+    ''' Verifies Koala responses are cached and revalidated. '''
+
+    def setUp(self):
+        ''' Serve FakeKoala and make a place for the cache file. '''
+        FakeKoala.serve(self)
+
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.path = os.path.join(temp_dir.name, 'cache.json')
+
+    def test_not_modified(self):
+        ''' Ensure a 304 reuses the parsed activities without building them again. '''
+        cache = infozuild.getscript.ResponseCache()
+        first, _ = infozuild.getscript.get_activities(cache=cache)
+        with mock.patch.object(infozuild.getscript, 'build_when') as build_when:
+            second, error = infozuild.getscript.get_activities(cache=cache)
+        self.assertEqual((second, error), (first, ''))
+        self.assertFalse(build_when.called)
+        self.assertNotIn('If-None-Match', FakeKoala.requests[0])
+        self.assertEqual(FakeKoala.requests[1]['If-None-Match'], '"v1"')
+
+    def test_persisted(self):
+        ''' Ensure a new cache on the same file starts warm. '''
+        first, _ = infozuild.getscript.get_activities(
+            cache=infozuild.getscript.ResponseCache(self.path))
+        cache = infozuild.getscript.ResponseCache(self.path)
+        self.assertEqual(cache.get_activities(), first)
+        infozuild.getscript.get_activities(cache=cache)
+        self.assertEqual(FakeKoala.requests[1]['If-None-Match'], '"v1"')
+
+    def test_new_day(self):
+        ''' Ensure cached activities are rebuilt on another day, and bad files are ignored. '''
+        cache = infozuild.getscript.ResponseCache(self.path)
+        infozuild.getscript.get_activities(cache=cache)
+        cache.day -= datetime.timedelta(days=1)
+        with mock.patch.object(infozuild.getscript, 'build_when_many',
+                               return_value=['morgen']) as build_when_many:
+            activities, _ = infozuild.getscript.get_activities(cache=cache)
+        self.assertEqual(activities, [('Borrel', 'morgen')])
+        self.assertTrue(build_when_many.called)
+
+        with open(self.path, 'w') as cache_file:
+            cache_file.write('{')
+        logging.disable(logging.WARNING)
+        self.addCleanup(logging.disable, logging.NOTSET)
+        self.assertEqual(infozuild.getscript.ResponseCache(self.path).request_headers(), {})
+
+class TestKoalaClient(unittest.TestCase):
+    ''' Verifies requests to Koala are retried and bounded in time. '''
+
+    def setUp(self):
+        ''' Use short timeouts and backoff, and keep warnings out of the output. '''
+        for name, value in (('READ_TIMEOUT', 0.2), ('BACKOFF', 0.01)):
+            patcher = mock.patch.object(infozuild.getscript, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        logging.disable(logging.CRITICAL)
+        self.addCleanup(logging.disable, logging.NOTSET)
+
+    def test_retry(self):
+        ''' Ensure a temporary server error is retried over the shared session. '''
+        FakeKoala.serve(self, failures=2)
+        activities, error = infozuild.getscript.get_activities()
+        self.assertEqual((len(activities), error), (1, ''))
+        self.assertEqual(len(FakeKoala.requests), 3)
+
+    def test_gives_up(self):
+        ''' Ensure persistent errors map onto a status after a bounded number of tries. '''
+        FakeKoala.serve(self, failures=10)
+        self.assertEqual(infozuild.getscript.get_activities(), ([], 'HTTP-fout: 503'))
+        self.assertEqual(len(FakeKoala.requests), 3)
+
+    def test_timeout(self):
+        ''' Ensure a stalled Koala does not block the update indefinitely. '''
+        FakeKoala.serve(self, delay=1)
+        started = time.monotonic()
+        self.assertEqual(infozuild.getscript.get_activities(),
+                         ([], 'Geen verbinding met Koala!'))
+        self.assertLess(time.monotonic() - started, 1)
+
+class TestActivityLimit(unittest.TestCase):
+    ''' Verifies only the events that will be shown are parsed. '''
+
+    def setUp(self):
+        ''' Serve a long list of events. '''
+        events = [{'name': 'Activiteit {}'.format(num), 'start_date': '2016-06-08'}
+                  for num in range(50)]
+        patcher = mock.patch.object(FakeKoala, 'events', events)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        FakeKoala.serve(self)
+
+    def test_limit(self):
+        ''' Ensure build_when is only called for events within the limit. '''
+        with mock.patch.object(infozuild.getscript, 'build_when',
+                               wraps=infozuild.getscript.build_when) as build_when:
+            activities, _ = infozuild.getscript.get_activities(limit=5)
+            self.assertEqual(build_when.call_count, 5)
+            self.assertEqual([name for name, _ in activities],
+                             ['Activiteit {}'.format(num) for num in range(5)])
+
+            rotation = infozuild.getscript.make_rotation(limit_activities=-45)
+            self.assertEqual(build_when.call_count, 10)
+            self.assertEqual(len(rotation.pages), 3)
+
+    def test_cached_limit(self):
+        ''' Ensure a cached response is parsed again when the limit changes. '''
+        cache = infozuild.getscript.ResponseCache()
+        infozuild.getscript.get_activities(cache=cache, limit=3)
+        activities, _ = infozuild.getscript.get_activities(cache=cache, limit=6)
+        self.assertEqual(len(activities), 6)
+        self.assertEqual(FakeKoala.requests[1]['If-None-Match'], '"v1"')
+
+class TestWhenBatch(unittest.TestCase):
+    ''' Verifies build_when_many agrees with build_when. '''
+
+    @given(st.lists(st.tuples(
+        st.datetimes(datetime.datetime(2016, 6, 1), datetime.datetime(2016, 6, 15)),
+        st.one_of(st.none(), st.timedeltas(datetime.timedelta(0), datetime.timedelta(days=3))),
+        st.booleans(), st.booleans())))
+    def test_identical(self, specs):
+        ''' Ensure all seven cases give the same strings in a batch. '''
+        events = []
+        for start, duration, start_time, end_time in specs:
+            event = {'start_date': start.isoformat() if start_time else start.date().isoformat()}
+            if duration is not None:
+                end = start + duration
+                event['end_date'] = end.isoformat() if end_time else end.date().isoformat()
+            events.append(event)
+        today = datetime.date(2016, 6, 8)
+        self.assertEqual(infozuild.getscript.build_when_many(events, today),
+                         [infozuild.getscript.build_when(event, today) for event in events])
+
+class TestCharset(unittest.TestCase):
+    ''' Verifies text is encoded in the character set of the controller. '''
+
+    def test_encode_text(self):
+        ''' Ensure non-ASCII is transliterated, and control characters are left out. '''
+        encode_text = infozuild.sendscript.encode_text
+        self.assertEqual(encode_text('Café\tß€'), b'Cafe ssEUR')
+        self.assertEqual(encode_text('Een\x1cregel\r\x1b'), b'Eenregel')
+        blinking = infozuild.sendscript.blink('Geen verbinding met Koala!')
+        self.assertEqual(encode_text(blinking), blinking.encode())
+
+    def test_single_byte(self):
+        ''' Ensure every character of a page becomes one byte, and the page decodes cleanly. '''
+        rotation = infozuild.getscript.make_rotation([('Crêpes & glühwein\x1c', 'vandaag')],
+                                                     'Öffnungszeiten')
+        data = rotation.to_bytes()
+        self.assertLess(max(data), 128)
+        pages = infozuild.parsing.parse_rotation(data).pages
+        self.assertEqual(pages[1].lines[1], 'Crepes & gluhwein')
+        self.assertEqual(pages[0].lines[4].strip(), 'Offnungszeiten')
+
+class StaticSource(infozuild.sources.Source):
+    ''' A source that returns fixed events after *delay* seconds, or fails if *events* is None. '''
+    def __init__(self, name, events, delay=0, timeout=1):
+        super().__init__(name, None, timeout)
+        self.events = events
+        self.delay = delay
+
+    def fetch(self):
+        time.sleep(self.delay)
+        if self.events is None:
+            raise infozuild.sources.SourceError('{} is stuk.'.format(self.name))
+        return sorted(self.events, key=infozuild.sources.start_key)
+
+class TestSources(unittest.TestCase):
+    ''' Verifies activities from several sources are combined. '''
+
+    def test_merge(self):
+        ''' Ensure events are merged by start, and duplicates are dropped. '''
+        koala = [{'name': 'Borrel', 'start_date': '2016-06-08T16:00:00+02:00'},
+                 {'name': 'Lezing', 'start_date': '2016-06-10'}]
+        other = [{'name': 'Symposium', 'start_date': '2016-06-09'},
+                 {'name': ' borrel', 'start_date': '2016-06-08T16:30:00+02:00'},
+                 {'name': 'Lezing', 'start_date': '2016-06-10'}]
+        merged = infozuild.sources.merge([koala, sorted(other, key=infozuild.sources.start_key)])
+        self.assertEqual([event['name'] for event in merged], ['Borrel', 'Symposium', 'Lezing'])
+
+    def test_slow_source(self):
+        ''' Ensure a slow source does not hold up the others. '''
+        sources = [StaticSource('Traag', [{'name': 'Laat', 'start_date': '2016-06-08'}],
+                                delay=1, timeout=0.1),
+                   StaticSource('Snel', [{'name': 'Borrel', 'start_date': '2016-06-08'}])]
+        started = time.monotonic()
+        logging.disable(logging.ERROR)
+        self.addCleanup(logging.disable, logging.NOTSET)
+        activities, error = infozuild.sources.get_activities(sources)
+        self.assertLess(time.monotonic() - started, 0.5)
+        self.assertEqual([name for name, _ in activities], ['Borrel'])
+        self.assertEqual(error, 'Traag reageert niet.')
+
+    def test_partial_failure(self):
+        ''' Ensure new events of healthy sources are shown when another source fails. '''
+        tomorrow = datetime.date.today() + datetime.timedelta(days=1)
+        agenda = StaticSource('Agenda', [{'name': 'Symposium', 'start_date': tomorrow.isoformat()}])
+        koala = StaticSource('Koala', [{'name': 'Borrel', 'start_date': tomorrow.isoformat()}])
+        manager = infozuild.daemon.ZuilManager('localhost', 0, None, print_only=True,
+                                               activity_sources=[agenda, koala])
+        self.addCleanup(manager.close)
+        manager.update_activities()
+
+        agenda.events = None
+        koala.events.append({'name': 'Lezing', 'start_date': tomorrow.isoformat()})
+        manager.update_activities()
+        self.assertEqual(sorted(name for name, _ in manager.events),
+                         ['Borrel', 'Lezing', 'Symposium'])
+        self.assertIn('Agenda is stuk.', manager.status)
+
+    def test_ical(self):
+        ''' Ensure iCalendar exports are read, skipping events that have ended. '''
+        today = datetime.date.today()
+        calendar = '\r\n'.join([
+            'BEGIN:VCALENDAR',
+            'BEGIN:VEVENT', 'SUMMARY:Oud', 'DTSTART;VALUE=DATE:20100101', 'END:VEVENT',
+            'BEGIN:VEVENT', 'SUMMARY:Lange\\, gevouwen', ' naam',
+            'DTSTART;VALUE=DATE:{:%Y%m%d}'.format(today),
+            'DTEND;VALUE=DATE:{:%Y%m%d}'.format(today + datetime.timedelta(days=2)),
+            'END:VEVENT',
+            'BEGIN:VEVENT', 'SUMMARY:Borrel\\nmet taart\\\\',
+            'DTSTART:{:%Y%m%d}T160000Z'.format(today),
+            'END:VEVENT',
+            'END:VCALENDAR'])
+        source = infozuild.sources.ICalSource('Agenda', None)
+        events = source.parse(mock.Mock(text=calendar))
+        self.assertEqual(events, [
+            {'name': 'Lange, gevouwennaam', 'start_date': today.isoformat(),
+             'end_date': (today + datetime.timedelta(days=1)).isoformat()},
+            {'name': 'Borrel met taart\\', 'start_date': '{}T16:00:00Z'.format(today)}])
+
+    def test_config(self):
+        ''' Ensure sources are created from their configuration sections. '''
+        config = configparser.ConfigParser()
+        config.read_string('\n'.join([
+            '[Daemon]', 'Interval = 10',
+            '[Source Koala]', 'Type = koala', 'Timeout = 5',
+            '[Source Agenda]', 'Type = ical', 'URL = http://localhost/agenda.ics', 'Timeout = 2',
+            '[Source Andere vereniging]', 'Type = json', 'URL = http://localhost/api',
+            'NameKey = title']))
+        sources = infozuild.sources.from_config(config)
+        self.assertEqual([type(source) for source in sources],
+                         [infozuild.sources.KoalaSource, infozuild.sources.ICalSource,
+                          infozuild.sources.JSONSource])
+        self.assertEqual(sources[0].url, infozuild.getscript.API_URL)
+        self.assertEqual(sources[0].timeout, infozuild.getscript.FETCH_TIMEOUT)
+        self.assertEqual(sources[1].timeout, 2)
+        self.assertEqual(sources[2].timeout, infozuild.getscript.READ_TIMEOUT)
+        self.assertEqual(sources[2].name, 'Andere vereniging')
+        self.assertEqual(sources[2].keys, ('title', 'start_date', 'end_date'))
+
+        config['Source Agenda']['URL'] = ''
+        with self.assertRaises(ValueError):
+            infozuild.sources.from_config(config)
+
+    def test_koala_source(self):
+        ''' Ensure Koala is retrieved over the shared session, with the response cache. '''
+        FakeKoala.serve(self)
+        source = infozuild.sources.KoalaSource(cache=infozuild.getscript.ResponseCache())
+        self.assertIs(source.session, infozuild.getscript.get_session())
+        self.assertEqual(source.fetch(), FakeKoala.events)
+        self.assertEqual(source.fetch(), FakeKoala.events)
+        self.assertEqual(FakeKoala.requests[1].get('If-None-Match'), FakeKoala.etag)
+
+class TestKoalaStandIn(unittest.TestCase):
+    ''' Verifies the Koala stand-in serves, records and fails as configured. '''
+
+    events = [{'name': 'Borrel', 'start_date': '2016-06-08'},
+              {'name': 'Lezing', 'start_date': '2016-06-09'}]
+
+    def serve(self, standin):
+        ''' Start *standin* for the duration of the test, and point the getscript at it. '''
+        standin.start()
+        self.addCleanup(standin.stop)
+        for name, value in (('API_URL', standin.url), ('BACKOFF', 0.01)):
+            patcher = mock.patch.object(infozuild.getscript, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        return standin
+
+    def test_etag(self):
+        ''' Ensure unchanged content gets a 304, and changed content does not. '''
+        standin = self.serve(infozuild.koala.KoalaStandIn.from_events(self.events))
+        cache = infozuild.getscript.ResponseCache()
+        infozuild.getscript.get_activities(cache=cache)
+        infozuild.getscript.get_activities(cache=cache)
+        self.assertEqual(standin.not_modified, 1)
+
+        standin.body = json.dumps(self.events[:1])
+        activities, _ = infozuild.getscript.get_activities(cache=cache)
+        self.assertEqual(len(activities), 1)
+        self.assertEqual((standin.requests, standin.not_modified), (3, 1))
+
+    def test_failures(self):
+        ''' Ensure injected failures map onto the status messages. '''
+        standin = self.serve(infozuild.koala.KoalaStandIn.from_events(self.events, error_rate=1))
+        logging.disable(logging.CRITICAL)
+        self.addCleanup(logging.disable, logging.NOTSET)
+        self.assertEqual(infozuild.getscript.get_activities(), ([], 'HTTP-fout: 503'))
+        standin.error_rate, standin.malformed_rate = 0, 1
+        self.assertEqual(infozuild.getscript.get_activities(), ([], 'Onzin binnengekregen!'))
+        self.assertEqual(standin.errors, 4)
+
+    def test_record_replay(self):
+        ''' Ensure a recorded response is replayed with the same body and ETag. '''
+        original = self.serve(infozuild.koala.KoalaStandIn.from_events(self.events))
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'koala.json')
+            infozuild.koala.record(path, original.url)
+            replay = infozuild.koala.KoalaStandIn.from_recording(path)
+        self.addCleanup(replay.server_close)
+        self.assertEqual(replay.body, original.body)
+        self.assertEqual(replay.current_etag(), original.current_etag())
+
+    def test_update_cycle(self):
+        ''' Ensure a full update of the daemon runs offline. '''
+        today = datetime.date.today()
+        events = [{'name': name, 'start_date': (today + datetime.timedelta(days)).isoformat()}
+                  for days, name in ((1, 'Borrel'), (2, 'Lezing'))]
+        self.serve(infozuild.koala.KoalaStandIn.from_events(events))
+        emulator = infozuild.emulator.ControllerEmulator().start()
+        self.addCleanup(emulator.stop)
+        manager = infozuild.daemon.ZuilManager('localhost', 0, None, port=emulator.port)
+        self.addCleanup(manager.close)
+        manager.update_activities()
+        self.assertTrue(emulator.wait_for(1))
+        self.assertEqual(emulator.texts[0][1].lines[3], 'Lezing')
+
+class TestEventStore(unittest.TestCase):
+    ''' Verifies the event store expires events and renders them for the current day. '''
+
+    events = [{'name': 'Lezing', 'start_date': '2016-06-09T12:00:00+02:00',
+               'end_date': '2016-06-09T13:00:00+02:00'},
+              {'name': 'Borrel', 'start_date': '2016-06-08'},
+              {'name': 'Kamp', 'start_date': '2016-06-07', 'end_date': '2016-06-12'},
+              {'name': 'Lunch', 'start_date': '2016-06-09T12:30:00+02:00'}]
+
+    def local(self, value):
+        ''' Return the naive local time of an ISO 8601 string. '''
+        return infozuild.sources.start_key({'start_date': value})
+
+    def test_expire(self):
+        ''' Ensure events are left out once they ended, in order of start. '''
+        store = infozuild.eventstore.EventStore(self.events)
+        now = datetime.datetime(2016, 6, 8, 20)
+        self.assertEqual([name for name, _ in store.activities(now)],
+                         ['Kamp', 'Borrel', 'Lezing', 'Lunch'])
+
+        now = self.local('2016-06-09T13:30:00+02:00')
+        self.assertEqual([name for name, _ in store.activities(now)],
+                         ['Kamp', 'Lunch'])
+        self.assertEqual(len(store), 2)
+        kamp = ('Kamp', infozuild.getscript.build_when(self.events[2], now.date()))
+        self.assertEqual(store.activities(now, 1), [kamp])
+        self.assertEqual(store.activities(now, -1), [kamp])
+
+    def test_rendered_today(self):
+        ''' Ensure 'when' strings are rendered again on another day. '''
+        store = infozuild.eventstore.EventStore(self.events[:1])
+        day = datetime.date(2016, 6, 9)
+        before = store.activities(datetime.datetime(2016, 6, 8, 12))
+        self.assertEqual(before[0][1], '{} 12:00~13:00'.format(day.strftime(ACTIVITY_DATE_FORMAT)))
+        self.assertEqual(store.activities(datetime.datetime(2016, 6, 9, 1)),
+                         [('Lezing', '12:00~13:00')])
+
+    def test_next_change(self):
+        ''' Ensure the next change is the next end or midnight, whichever is first. '''
+        store = infozuild.eventstore.EventStore(self.events)
+        now = datetime.datetime(2016, 6, 8, 20)
+        self.assertEqual(store.next_change(now), datetime.datetime(2016, 6, 9))
+        now = datetime.datetime(2016, 6, 9)
+        self.assertEqual(store.next_change(now),
+                         self.local('2016-06-09T13:00:00+02:00'))
+
+    def test_manager_outage(self):
+        ''' Ensure the daemon leaves out ended events while Koala cannot be reached. '''
+        manager = infozuild.daemon.ZuilManager('localhost', 0, None, print_only=True)
+        self.addCleanup(manager.close)
+        with mock.patch.object(infozuild.getscript, 'get_events',
+                               side_effect=[(self.events, ''), ([], 'Geen verbinding met Koala!')]):
+            with mock.patch('datetime.datetime', wraps=datetime.datetime) as patched:
+                patched.now.return_value = datetime.datetime(2016, 6, 8, 20)
+                manager.update_activities()
+                self.assertEqual(len(manager.events), 4)
+                patched.now.return_value = datetime.datetime(2016, 6, 10)
+                manager.update_activities()
+        self.assertEqual([name for name, _ in manager.events], ['Kamp'])
+        self.assertIn('Geen verbinding', manager.status)
+
+class TestSnapshot(unittest.TestCase):
+    ''' Verifies the daemon restores its state from a snapshot after a restart. '''
+
+    def setUp(self):
+        ''' Replace the actual sending and retrieving with mocks. '''
+        patcher = mock.patch.object(infozuild.controller.ControllerConnection, 'send',
+                                    return_value=True)
+        self.send = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        tomorrow = datetime.date.today() + datetime.timedelta(days=1)
+        events = [{'name': 'Borrel', 'start_date': tomorrow.isoformat()}]
+        patcher = mock.patch.object(infozuild.getscript, 'get_events', return_value=(events, ''))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.path = os.path.join(temp_dir.name, 'snapshot.json')
+
+        patcher = ticking_clock()
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def manager(self):
+        ''' Start a manager with the snapshot file, as after a restart. '''
+        manager = infozuild.daemon.ZuilManager('localhost', 0, None, snapshot_file=self.path)
+        self.addCleanup(manager.close)
+        return manager
+
+    def test_warm_start(self):
+        ''' Ensure restored content that is on the zuil already is not sent again. '''
+        first = self.manager()
+        self.assertFalse(first.restored)
+        first.update_activities()
+
+        second = self.manager()
+        self.assertTrue(second.restored)
+        self.assertEqual((second.events, second.status, second.last_sent),
+                         (first.events, first.status, first.last_sent))
+        second.refresh_zuil(only_on_change=True)
+        self.assertEqual(self.send.call_count, 1)
+
+    def test_after_shutdown(self):
+        ''' Ensure the restored content replaces the shutdown message. '''
+        first = self.manager()
+        first.update_activities()
+        status = first.status
+        first.handle_shutdown()
+
+        second = self.manager()
+        self.assertEqual(second.status, status)
+        second.refresh_zuil(only_on_change=True)
+        self.assertEqual(self.send.call_count, 3)
+
+    def test_unreadable(self):
+        ''' Ensure an unreadable snapshot is ignored. '''
+        with open(self.path, 'w') as snapshot_file:
+            snapshot_file.write('{"events": [')
+        logging.disable(logging.CRITICAL)
+        self.addCleanup(logging.disable, logging.NOTSET)
+        self.assertFalse(self.manager().restored)
+
+class TestAsyncDaemon(unittest.TestCase):
+    ''' Verifies the asyncio daemon fetches, renders and sends independently. '''
+
+    def setUp(self):
+        ''' Start an emulator, and a manager sending to it. '''
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+        self.emulator = infozuild.emulator.ControllerEmulator().start()
+        self.addCleanup(self.emulator.stop)
+        self.manager = infozuild.daemon.ZuilManager('localhost', 0, None,
+                                                    port=self.emulator.port)
+        self.addCleanup(self.manager.close)
+        self.daemon = infozuild.daemon.ZuilDaemon(self.manager, 10)
+
+        tomorrow = datetime.date.today() + datetime.timedelta(days=1)
+        self.events = [{'name': 'Borrel', 'start_date': tomorrow.isoformat()}]
+
+    def test_update_now(self):
+        ''' Ensure an update on request is sent between the version and the shutdown message. '''
+        self.manager.fetch_events = mock.Mock(return_value=(self.events, ''))
+        self.loop.call_later(0.1, self.daemon.update_now)
+        self.loop.call_later(0.5, self.daemon.stop)
+        self.loop.run_until_complete(self.daemon.run())
+
+        self.assertTrue(self.emulator.wait_for(3))
+        self.assertEqual(self.manager.fetch_events.call_count, 1)
+        self.assertEqual(self.manager.events[0][0], 'Borrel')
+        self.assertIn('staat nu uit', self.emulator.texts[0][0].lines[4])
+
+    def test_slow_fetch(self):
+        ''' Ensure the shutdown message is sent while a fetch is still running. '''
+        self.manager.fetch_events = lambda: time.sleep(2) or (self.events, '')
+        self.loop.call_later(0.1, self.daemon.update_now)
+        self.loop.call_later(0.2, self.daemon.stop)
+        started = time.monotonic()
+        self.loop.run_until_complete(self.daemon.run())
+
+        self.assertLess(time.monotonic() - started, 1.5)
+        self.assertTrue(self.emulator.wait_for(2))
+        self.assertEqual(self.manager.events, [])
+        self.assertIn('staat nu uit', self.emulator.texts[0][0].lines[4])
+
+    def test_bad_fetch(self):
+        ''' Ensure a fetch that cannot be rendered is logged, and later fetches are still sent. '''
+        bad_events = [{'name': 'Kapot', 'start_date': 'garbage'}]
+        self.manager.fetch_events = mock.Mock(side_effect=[(bad_events, ''), (self.events, '')])
+        self.loop.call_later(0.1, self.daemon.update_now)
+        self.loop.call_later(0.3, self.daemon.update_now)
+        self.loop.call_later(0.7, self.daemon.stop)
+        with self.assertLogs(level='ERROR'):
+            self.loop.run_until_complete(self.daemon.run())
+
+        self.assertTrue(self.emulator.wait_for(3))
+        self.assertEqual(self.manager.fetch_events.call_count, 2)
+        self.assertEqual(self.manager.fetched_events, self.events)
+        self.assertEqual(len(self.emulator.receptions), 3) # Version, Borrel, shutdown.
+        self.assertEqual(self.manager.events[0][0], 'Borrel')
+
+    def test_entry_point(self):
+        ''' Ensure the console script entry point returns None, so it exits with status 0. '''
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'daemon.ini')
+            with open(path, 'w') as config_file:
+                config_file.write('[Daemon]\nCacheFile =\nSnapshotFile =\n')
+            argv = ['zuild', '--once', '--noop', '--config', path]
+            with mock.patch('sys.argv', argv), \
+                 mock.patch.object(infozuild.daemon.ZuilManager, 'fetch_events',
+                                   return_value=(self.events, '')) as fetch_events:
+                self.assertIsNone(infozuild.daemon.main())
+        self.assertEqual(fetch_events.call_count, 1)
+
+    def test_next_update(self):
+        ''' Ensure updates are due at multiples of the interval, as with cron. '''
+        now = datetime.datetime(2016, 6, 8, 12, 7, 30)
+        self.assertEqual(infozuild.daemon.next_update(now, 10),
+                         datetime.datetime(2016, 6, 8, 12, 10))
+        self.assertEqual(infozuild.daemon.next_update(now.replace(minute=56), 7),
+                         datetime.datetime(2016, 6, 8, 13, 0))
@@ -19,8 +19,6 @@ setup(
         'Environment :: Console',
 
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.3',
-        'Programming Language :: Python :: 3.4',
         'Programming Language :: Python :: 3.5',
         'Programming Language :: Python :: 3 :: Only',
     ],
@@ -29,14 +27,15 @@ setup(
     entry_points={
         'console_scripts': [
             'zuil-get=infozuild.getscript:main',
-            'zuil-send=infozuild.sendscript:main',
+            'zuil-send=infozuild.controller:main',
             'zuild=infozuild.daemon:main',
+            'zuil-emulator=infozuild.emulator:main',
+            'zuil-koala=infozuild.koala:main',
             ],
         },
     install_requires=[
         'requests',
         'python-dateutil',
-        'apscheduler',
         'unidecode',
         'sv-fortune',
     ],